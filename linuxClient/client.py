@@ -1,30 +1,68 @@
 import tkinter as tk
+from tkinter import filedialog
 import requests
 import json
+import queue
+import threading
 
-URL = "http://127.0.0.1:8000/assistant/text-command"
+URL = "http://127.0.0.1:8000/assistant/text-command/stream"
+AUDIO_URL = "http://127.0.0.1:8000/assistant/audio-conversation/stream"
 
-def send_request(event=None):
-    text = entry.get()
+STAGE_LABELS = {
+    "transcribing": "Transkrybuję nagranie...",
+    "saving_transcription": "Zapisuję transkrypcję...",
+    "extracting": "Analizuję wiadomość...",
+    "integrations": "Zapisuję...",
+    "notifications": "Wysyłam powiadomienie...",
+}
+
+events = queue.Queue()
+
+def describe_event(event, data):
+    if event == "stage":
+        return STAGE_LABELS.get(data.get("stage"))
+    if event == "transcription_segment":
+        return f"Transkrypcja: fragment {data.get('index') + 1} z {data.get('segments')}"
+    if event == "integration":
+        response = data.get("response") or {}
+        title = (data.get("data") or {}).get("title", "")
+        if response.get("success") or response.get("queued"):
+            status = "OK"
+        elif response.get("pending"):
+            status = "w toku"
+        else:
+            status = f"Błąd: {response.get('error')}"
+        return f"{data.get('type')}: {title} - {status}"
+    if event == "error":
+        return f"Błąd: {data.get('detail')}"
+    return None
+
+def stream_request(url, content_type, body):
+    """
+    Reads the server-sent events on a worker thread and hands them to the UI thread.
+    """
     headers = {
-        "Content-Type": "application/json",
+        "Content-Type": content_type,
         "x-auth": "AUTH_TOKEN_SECRET_TO_REPLACE"
     }
     try:
-        response = requests.post(URL, json={"message": text}, headers=headers)
-        response.raise_for_status()
-        try:
-            json_response = response.json()
-            output_text = json.dumps(json_response, indent=4, ensure_ascii=False)
-        except json.JSONDecodeError:
-            output_text = response.text
-    except requests.exceptions.RequestException as e:
-        output_text = f"Błąd: {e}"
+        with requests.post(url, data=body, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            event = None
+            for line in response.iter_lines(decode_unicode=True):
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                elif line.startswith("data:") and event:
+                    events.put((event, json.loads(line[len("data:"):])))
+    except (requests.exceptions.RequestException, json.JSONDecodeError, OSError) as e:
+        events.put(("error", {"detail": str(e)}))
+    events.put(("closed", {}))
 
+def show_output():
     for widget in root.winfo_children():
         widget.destroy()
 
-    output_label = tk.Label(root, text=output_text, wraplength=800, justify="left")
+    output_label = tk.Label(root, text="Wysłano...", wraplength=800, justify="left")
     output_label.pack(padx=10, pady=10)
 
     close_button = tk.Button(root, text="Zamknij", command=root.destroy)
@@ -32,6 +70,38 @@ def send_request(event=None):
     close_button.focus()
 
     root.bind('<Return>', lambda e: root.destroy())
+    return output_label
+
+def poll_events(output_label, lines):
+    while True:
+        try:
+            event, data = events.get_nowait()
+        except queue.Empty:
+            break
+        if event == "closed":
+            return
+        if event == "done":
+            lines = [json.dumps(data, indent=4, ensure_ascii=False)]
+        else:
+            line = describe_event(event, data)
+            if line:
+                lines = lines + [line]
+        output_label.config(text="\n".join(lines))
+    root.after(100, poll_events, output_label, lines)
+
+def send_request(event=None):
+    body = json.dumps({"message": entry.get()}).encode("utf-8")
+    threading.Thread(target=stream_request, args=(URL, "application/json", body), daemon=True).start()
+    poll_events(show_output(), [])
+
+def send_recording():
+    path = filedialog.askopenfilename(title="Nagranie rozmowy", filetypes=[("Nagrania 3GP", "*.3gp *.amr")])
+    if not path:
+        return
+    with open(path, "rb") as f:
+        body = f.read()
+    threading.Thread(target=stream_request, args=(AUDIO_URL, "audio/3gpp", body), daemon=True).start()
+    poll_events(show_output(), [])
 
 root = tk.Tk()
 root.title("Komenda dla asystenta")
@@ -43,5 +113,8 @@ entry.bind('<Return>', send_request)
 button = tk.Button(root, text="Wyślij", command=send_request)
 button.pack(pady=5)
 
+recording_button = tk.Button(root, text="Wyślij nagranie rozmowy...", command=send_recording)
+recording_button.pack(pady=5)
+
 entry.focus()
 root.mainloop()
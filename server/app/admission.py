@@ -0,0 +1,246 @@
+import os
+import math
+import time
+import asyncio
+import logging
+import threading
+from collections import deque
+from contextlib import asynccontextmanager
+from fastapi import HTTPException, Request
+from .metrics import Counter, REGISTRY
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "true").lower() == "true"
+# Requests processed at once per endpoint class, and requests allowed to wait for a slot
+ADMISSION_AUDIO_CONCURRENCY = int(os.getenv("ADMISSION_AUDIO_CONCURRENCY", "2"))
+ADMISSION_AUDIO_QUEUE = int(os.getenv("ADMISSION_AUDIO_QUEUE", "4"))
+ADMISSION_TEXT_CONCURRENCY = int(os.getenv("ADMISSION_TEXT_CONCURRENCY", "8"))
+ADMISSION_TEXT_QUEUE = int(os.getenv("ADMISSION_TEXT_QUEUE", "16"))
+# A queued request is rejected after waiting this many seconds
+ADMISSION_QUEUE_TIMEOUT = float(os.getenv("ADMISSION_QUEUE_TIMEOUT", "30"))
+# Gemini tokens (total_tokens_used) allowed per rolling window, 0 to only track usage
+GEMINI_TOKEN_BUDGET = int(os.getenv("GEMINI_TOKEN_BUDGET", "0"))
+GEMINI_TOKEN_BUDGET_WINDOW = float(os.getenv("GEMINI_TOKEN_BUDGET_WINDOW", "60"))
+
+admission_rejections = Counter(
+    "assistant_admission_rejections_total",
+    "Requests rejected with 429 by admission control, by lane and reason.",
+    ["lane", "reason"]
+)
+REGISTRY.append(admission_rejections)
+
+
+class Rejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class TokenBudget:
+    """
+    Gemini tokens used in the last `window` seconds. Recorded from worker threads.
+    """
+
+    def __init__(self, budget=GEMINI_TOKEN_BUDGET, window=GEMINI_TOKEN_BUDGET_WINDOW):
+        self.budget = budget
+        self.window = window
+        self._entries = deque()
+        self._used = 0
+        self._lock = threading.Lock()
+
+    def _prune(self, now):
+        while self._entries and self._entries[0][0] <= now - self.window:
+            self._used -= self._entries.popleft()[1]
+
+    def record(self, tokens: int):
+        if not tokens:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            self._entries.append((now, tokens))
+            self._used += tokens
+
+    def used(self):
+        with self._lock:
+            self._prune(time.monotonic())
+            return self._used
+
+    def retry_after(self):
+        """
+        Seconds until usage falls below the budget, 0 when it already is (or there is no budget).
+        """
+        if not self.budget:
+            return 0.0
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            if self._used < self.budget:
+                return 0.0
+            remaining = self._used
+            for recorded_at, tokens in self._entries:
+                remaining -= tokens
+                if remaining < self.budget:
+                    return recorded_at + self.window - now
+            return self.window
+
+    def snapshot(self):
+        used = self.used()
+        return {
+            "budget": self.budget or None,
+            "window_seconds": self.window,
+            "used": used,
+            "remaining": max(0, self.budget - used) if self.budget else None
+        }
+
+
+class Lane:
+    """
+    Concurrency limit with a bounded FIFO wait queue. Used only from the event loop.
+    """
+
+    def __init__(self, name: str, limit: int, queue_size: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.active = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.queued = 0
+        # Moving average of how long admitted requests hold a slot, for Retry-After
+        self.average_duration = None
+
+    def retry_after(self):
+        average = self.average_duration or 1.0
+        return average * (len(self._waiters) / max(1, self.limit) + 1)
+
+    async def acquire(self, timeout: float):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise Rejected("queue_full", self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            raise Rejected("queue_timeout", self.retry_after())
+        except asyncio.CancelledError:
+            # The client went away; a slot handed over in the meantime is passed on
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            raise
+        finally:
+            if waiter in self._waiters:
+                self._waiters.remove(waiter)
+        self.admitted += 1
+
+    def release(self, duration: float = None):
+        if duration is not None:
+            self.average_duration = duration if self.average_duration is None else \
+                0.8 * self.average_duration + 0.2 * duration
+        # The slot goes straight to the longest waiting request, if any
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def snapshot(self):
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "active": self.active,
+            "waiting": len(self._waiters),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "average_duration_seconds": self.average_duration
+        }
+
+
+class AdmissionController:
+    def __init__(self, lanes, token_budget: TokenBudget, enabled=ADMISSION_CONTROL, queue_timeout=ADMISSION_QUEUE_TIMEOUT):
+        self.lanes = {lane.name: lane for lane in lanes}
+        self.token_budget = token_budget
+        self.enabled = enabled
+        self.queue_timeout = queue_timeout
+
+    def _reject(self, lane: str, rejected: Rejected):
+        admission_rejections.inc(lane=lane, reason=rejected.reason)
+        retry_after = max(1, math.ceil(rejected.retry_after))
+        logging.error(f"Rejected {lane} request: {rejected.reason}, retry after {retry_after}s")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Server is busy ({rejected.reason}). Retry in {retry_after} seconds.",
+            headers={"Retry-After": str(retry_after)}
+        )
+
+    async def admit(self, lane: str, concurrency=True):
+        """
+        Waits for a slot in `lane`; raises HTTPException 429 with Retry-After when the
+        queue is full, the wait times out or the token budget is spent.
+        """
+        if not self.enabled:
+            return False
+        budget_wait = self.token_budget.retry_after()
+        if budget_wait > 0:
+            self._reject(lane, Rejected("token_budget", budget_wait))
+        if not concurrency:
+            return False
+        try:
+            await self.lanes[lane].acquire(self.queue_timeout)
+        except Rejected as rejected:
+            self._reject(lane, rejected)
+        return True
+
+    def release(self, lane: str, duration: float = None):
+        self.lanes[lane].release(duration)
+
+    @asynccontextmanager
+    async def slot(self, lane: str, concurrency=True):
+        """
+        Holds a slot of `lane` for the body of the `async with` block.
+        """
+        admitted = await self.admit(lane, concurrency)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            if admitted:
+                self.release(lane, time.monotonic() - started)
+
+    def snapshot(self):
+        return {
+            "enabled": self.enabled,
+            "queue_timeout_seconds": self.queue_timeout,
+            "lanes": {name: lane.snapshot() for name, lane in self.lanes.items()},
+            "gemini_tokens": self.token_budget.snapshot()
+        }
+
+
+token_budget = TokenBudget()
+admission_controller = AdmissionController(
+    [
+        Lane("audio", ADMISSION_AUDIO_CONCURRENCY, ADMISSION_AUDIO_QUEUE),
+        Lane("text", ADMISSION_TEXT_CONCURRENCY, ADMISSION_TEXT_QUEUE),
+    ],
+    token_budget
+)
+
+
+def admission(lane: str, concurrency=True):
+    """
+    Route dependency holding a slot of `lane` for the duration of the request.
+    With `concurrency=False` it only checks the token budget: audio endpoints use that
+    to reject early and take the slot themselves once the upload has been read, so a
+    slow upload does not hold an audio slot. Jobs are bounded by the job queue instead.
+    """
+    async def dependency(request: Request):
+        async with admission_controller.slot(lane, concurrency):
+            yield
+    return dependency
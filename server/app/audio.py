@@ -1,57 +1,246 @@
 import os
+import json
+import asyncio
+import hashlib
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 import google.generativeai as genai
-from .processing import process_text_and_get_response
+from google.generativeai import client as genai_client
+from .processing import process_text_and_get_response, process_extracted_data, current_responses, is_final
+from .prompts import build_audio_extraction_prompt, parse_extraction_response, cache_extraction
 from .integrations.notionConnector import create_notion_page
+from .cache import LRUCache
+from .uploads import AudioUpload
+from .long_audio import ChunkedTranscriber, SegmentationError, LONG_AUDIO_ENABLED, LONG_AUDIO_MIN_BYTES
+from .lazy import Lazy
+from .metrics import timed_stage
 
-genai.configure(api_key=os.getenv("GOOGLE_AI_API_KEY"))
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+GEMINI_AUDIO_MODEL = os.getenv("GEMINI_AUDIO_MODEL", "gemini-2.5-flash")
+
+def _configure_genai():
+    endpoint_options = {}
+    if GEMINI_API_ENDPOINT:
+        endpoint_options = {"client_options": {"api_endpoint": GEMINI_API_ENDPOINT}, "transport": "rest"}
+        # File API uploads find their upload URL in a discovery document the SDK always fetches from googleapis.com
+        genai_client.GENAI_API_DISCOVERY_URL = f"{GEMINI_API_ENDPOINT.rstrip('/')}/$discovery/rest"
+    genai.configure(api_key=os.getenv("GOOGLE_AI_API_KEY"), **endpoint_options)
+
+genai_configured = Lazy(_configure_genai)
 
 NOTION_TRANSCRIPTION_PAGE_ID = os.getenv("NOTION_TRANSCRIPTION_PAGE_ID")
+AUDIO_MAX_WORKERS = int(os.getenv("AUDIO_MAX_WORKERS", "2"))
+TRANSCRIPTION_CACHE_MAX_BYTES = int(os.getenv("TRANSCRIPTION_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+AUDIO_RESPONSE_CACHE_MAX_BYTES = int(os.getenv("AUDIO_RESPONSE_CACHE_MAX_BYTES", str(8 * 1024 * 1024)))
+# Transcribe and extract in a single model call for audio commands
+AUDIO_SINGLE_PASS = os.getenv("AUDIO_SINGLE_PASS", "false").lower() == "true"
 
-def process_audio(audio_bytes: bytes):
-    logging.debug("Transcribing audio with Gemini.")
+TRANSCRIPTION_PROMPT = "Dokonaj transkrypcji tego pliku audio:"
+CONVERSATION_PROMPT = "Dokonaj transkrypcji tego pliku audio. Zwróć uwagę że jest to konwersacja między dwiema osboami, rozdziel w widoczny sposób kwestie obydwu z nich:"
+
+# Phones retry uploads on flaky connections, the same audio must not be transcribed
+# and saved to Notion twice. Bounded by the total size of stored transcriptions.
+transcription_cache = LRUCache(
+    max_bytes=TRANSCRIPTION_CACHE_MAX_BYTES,
+    size_of=lambda transcription: len(transcription.encode("utf-8"))
+)
+# Responses of fully processed audio commands: a retried upload gets the same response
+# instead of creating its tasks and events again. Writes queued in the outbox are looked up
+# again on every hit; responses with writes still pending at their deadline are not cached.
+audio_response_cache = LRUCache(
+    max_bytes=AUDIO_RESPONSE_CACHE_MAX_BYTES,
+    size_of=lambda response: len(json.dumps(response, ensure_ascii=False, default=str).encode("utf-8"))
+)
+
+# Audio jobs run on their own pool, so long transcriptions neither block the event loop
+# nor take threads from the default pool that serves text commands.
+audio_executor = ThreadPoolExecutor(max_workers=AUDIO_MAX_WORKERS, thread_name_prefix="audio")
+
+async def process_audio_async(audio, on_stage=None):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(audio_executor, process_audio, audio, on_stage)
+
+def as_audio_upload(audio):
+    if isinstance(audio, AudioUpload):
+        return audio
+    return AudioUpload.from_bytes(audio)
+
+def transcription_cache_key(upload: AudioUpload, prompt: str):
+    return hashlib.sha256(f"{GEMINI_AUDIO_MODEL}\0{prompt}\0{upload.hexdigest()}".encode("utf-8")).hexdigest()
+
+def generate_from_audio(upload: AudioUpload, prompt: str, generation_config=None):
+    """
+    Small uploads are sent inline, uploads spooled to disk are streamed
+    from their file through the Gemini File API instead of being read into memory.
+    """
+    genai_configured.get()
+    model = genai.GenerativeModel(GEMINI_AUDIO_MODEL, generation_config=generation_config)
+
+    if upload.in_memory:
+        audio_file = {"mime_type": "audio/3gpp", "data": upload.getvalue()}
+        return model.generate_content([prompt, audio_file])
 
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    audio_file = {"mime_type": "audio/3gpp", "data": audio_bytes}
-    
-    response = model.generate_content(
-        ["Dokonaj transkrypcji tego pliku audio:", audio_file]
+    audio_file = genai.upload_file(path=upload.path, mime_type="audio/3gpp")
+    try:
+        return model.generate_content([prompt, audio_file])
+    finally:
+        try:
+            genai.delete_file(audio_file.name)
+        except Exception as e:
+            logging.error(f"Could not delete uploaded audio file: {e}")
+
+@timed_stage("transcription_segment")
+def transcribe_segment(segment, prompt: str):
+    return generate_from_audio(AudioUpload.from_bytes(segment.data), prompt).text
+
+chunked_transcriber = Lazy(lambda: ChunkedTranscriber(transcribe_segment))
+
+def is_long_audio(upload: AudioUpload):
+    return LONG_AUDIO_ENABLED and upload.size > LONG_AUDIO_MIN_BYTES
+
+@timed_stage("transcription")
+def transcribe_audio(upload: AudioUpload, prompt: str, on_progress=None):
+    """
+    Long recordings are transcribed in parallel segments, falling back to a single call
+    when they cannot be split.
+    """
+    if is_long_audio(upload):
+        try:
+            return chunked_transcriber.get().transcribe(upload, prompt, on_progress)
+        except SegmentationError as e:
+            logging.error(f"{e}, transcribing the recording in one call.")
+    return generate_from_audio(upload, prompt).text
+
+@timed_stage("transcription_and_extraction")
+def transcribe_and_extract_audio(upload: AudioUpload):
+    """
+    Single-pass mode: one model call returns both the transcription and the extracted data.
+    """
+    response = generate_from_audio(
+        upload,
+        build_audio_extraction_prompt(),
+        generation_config={"response_mime_type": "application/json"}
     )
-    
-    transcription = response.text
-    logging.debug("Transcription successful.")
+    if not response or not response.text:
+        logging.error("No response from Gemini")
+        raise ValueError("No response from Gemini")
+    logging.debug(f"Gemini response: {response.text}")
+    data = parse_extraction_response(response.text)
+    transcription = data.pop("transcription", "") or ""
+    usage = response.usage_metadata
+    total_tokens = usage.total_token_count if usage else 0
+    return transcription, data, total_tokens
 
-    # Save transcription to Notion
+def save_transcription(cache_key: str, transcription: str, on_stage=None, progress=None):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    notion_page_data = {
+        "title": f"Transcription - {now}",
+        "content": transcription
+    }
+    if on_stage:
+        on_stage("saving_transcription")
+    create_notion_page(notion_page_data, NOTION_TRANSCRIPTION_PAGE_ID)
+    logging.debug("Transcription saved to Notion.")
+    transcription_cache.put(cache_key, transcription)
+    if progress:
+        progress.save("transcription", transcription)
+
+def cache_audio_response(cache_key: str, response: dict):
+    if is_final(response.get("integrations", [])):
+        audio_response_cache.put(cache_key, response)
+
+def cached_audio_response(cache_key: str):
+    response = audio_response_cache.get(cache_key)
+    if response is not None and response.get("integrations"):
+        response = {**response, "integrations": current_responses(response["integrations"])}
+    return response
+
+def process_audio_single_pass(audio: AudioUpload, cache_key: str, on_stage=None, on_progress=None, progress=None):
+    transcription, data, total_tokens = transcribe_and_extract_audio(audio)
+    logging.debug("Transcription and extraction successful.")
+    if on_progress:
+        on_progress("transcription", {"transcription": transcription})
+    if not transcription:
+        logging.debug("Empty transcription, nothing to process.")
+        return {"transcription": ""}
+
+    if progress:
+        progress.save("extraction", {"data": data, "total_tokens": total_tokens})
+    save_transcription(cache_key, transcription, on_stage, progress)
+    # An upload retried before processing finished takes the regular path, which then finds this extraction in the cache
+    cache_extraction(transcription, data)
+    response_data = process_extracted_data(
+        data, total_tokens, on_stage=on_stage, on_progress=on_progress, progress=progress
+    )
+    logging.debug("Finished processing transcription.")
+    response = {"transcription": transcription, **response_data}
+    cache_audio_response(cache_key, response)
+    return response
+
+def process_audio(audio, on_stage=None, on_progress=None, progress=None):
+    """
+    `audio` is either raw bytes or an AudioUpload.
+    `on_stage` is an optional callable invoked with the name of each stage as it starts,
+    `on_progress` with an event name and its data as results become available.
+    `progress` is the JobProgress of an audio job: a resumed job skips the transcription,
+    Notion save, extraction and writes its earlier run recorded.
+    """
+    audio = as_audio_upload(audio)
+    logging.debug("Transcribing audio with Gemini.")
+    if on_stage:
+        on_stage("transcribing")
+
+    cache_key = transcription_cache_key(audio, TRANSCRIPTION_PROMPT)
+    response = cached_audio_response(cache_key)
+    if response is not None:
+        logging.debug("Audio already processed, returning its response.")
+        if on_progress:
+            on_progress("transcription", {"transcription": response["transcription"]})
+        return response
+
+    transcription = transcription_cache.get(cache_key)
+    if transcription is None and progress:
+        transcription = progress.get("transcription")
+    cached = transcription is not None
+    if cached:
+        # Saved before, but its processing did not finish
+        logging.debug("Transcription cache hit, skipping transcription and Notion save.")
+    elif AUDIO_SINGLE_PASS and not is_long_audio(audio):
+        return process_audio_single_pass(audio, cache_key, on_stage, on_progress, progress)
+    else:
+        transcription = transcribe_audio(audio, TRANSCRIPTION_PROMPT, on_progress)
+        logging.debug("Transcription successful.")
+    if on_progress:
+        on_progress("transcription", {"transcription": transcription})
+
+    # Save transcription to Notion, a cached transcription has already been saved
     if transcription:
-        now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        notion_page_data = {
-            "title": f"Transcription - {now}",
-            "content": transcription
-        }
-        create_notion_page(notion_page_data, NOTION_TRANSCRIPTION_PAGE_ID)
-        logging.debug("Transcription saved to Notion.")
+        if not cached:
+            save_transcription(cache_key, transcription, on_stage, progress)
 
         logging.debug("Processing transcription.")
-        response_data = process_text_and_get_response(transcription)
+        response_data = process_text_and_get_response(
+            transcription, on_stage=on_stage, on_progress=on_progress, progress=progress
+        )
         logging.debug("Finished processing transcription.")
-        return {"transcription": transcription, **response_data}
+        response = {"transcription": transcription, **response_data}
+        cache_audio_response(cache_key, response)
+        return response
     else:
         logging.debug("Empty transcription, nothing to process.")
         return {"transcription": ""}
 
-def process_conversation(audio_bytes: bytes):
+def process_conversation(audio):
+    audio = as_audio_upload(audio)
     logging.debug("Transcribing conversation with Gemini.")
-    model = genai.GenerativeModel('gemini-2.5-flash')
-    
-    audio_file = {"mime_type": "audio/3gpp", "data": audio_bytes}
-    
-    response = model.generate_content(
-        ["Dokonaj transkrypcji tego pliku audio. Zwróć uwagę że jest to konwersacja między dwiema osboami, rozdziel w widoczny sposób kwestie obydwu z nich:", audio_file]
-    )
-    
-    transcription = response.text
+    cache_key = transcription_cache_key(audio, CONVERSATION_PROMPT)
+    cached = transcription_cache.get(cache_key)
+    if cached is not None:
+        logging.debug("Conversation already transcribed and saved.")
+        return {"transcription": cached}
+
+    transcription = transcribe_audio(audio, CONVERSATION_PROMPT)
     logging.debug("Transcription successful.")
 
     # Save transcription to Notion
@@ -63,6 +252,7 @@ def process_conversation(audio_bytes: bytes):
         }
         create_notion_page(notion_page_data, NOTION_TRANSCRIPTION_PAGE_ID)
         logging.debug("Transcription saved to Notion.")
+        transcription_cache.put(cache_key, transcription)
 
         return {"transcription": transcription}
     else:
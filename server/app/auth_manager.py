@@ -1,36 +1,131 @@
 import os
 import json
+import logging
+import tempfile
+import threading
+from datetime import datetime, timezone
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 
+GOOGLE_TOKEN_PATH = os.getenv("GOOGLE_TOKEN_PATH", "token.json")
+GOOGLE_CREDENTIALS_PATH = os.getenv("GOOGLE_CREDENTIALS_PATH", "credentials.json")
+# Optional root URL overriding googleapis.com, e.g. for a local stand-in server
+GOOGLE_API_ENDPOINT = os.getenv("GOOGLE_API_ENDPOINT")
+# Optional OAuth token endpoint; google-auth ignores the token_uri saved in the token file
+GOOGLE_TOKEN_URI = os.getenv("GOOGLE_TOKEN_URI")
+# Google accepts up to 1000 calls per batch request, but recommends keeping batches small
+GOOGLE_BATCH_MAX_REQUESTS = int(os.getenv("GOOGLE_BATCH_MAX_REQUESTS", "50"))
+# A background thread refreshes the access token this many seconds before it expires,
+# earlier than google-auth would on a request path (3m45s)
+GOOGLE_TOKEN_RENEWAL = os.getenv("GOOGLE_TOKEN_RENEWAL", "true").lower() == "true"
+# (at most half the token's lifetime, so short-lived tokens are not renewed in a loop)
+GOOGLE_TOKEN_RENEW_MARGIN = float(os.getenv("GOOGLE_TOKEN_RENEW_MARGIN", "600"))
+GOOGLE_TOKEN_RENEW_RETRY_DELAY = 30.0
+# Shortest wait between two checks of the renewer, whatever the token's expiry
+GOOGLE_TOKEN_RENEW_MIN_DELAY = 1.0
+# The renewer also picks up credentials loaded or replaced in the meantime
+GOOGLE_TOKEN_RENEW_CHECK_INTERVAL = 60.0
+
+def _utcnow():
+    # google-auth keeps expiry as a naive UTC datetime
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+class ManagedCredentials(Credentials):
+    """
+    Credentials whose refreshes, including the ones google-auth triggers itself on
+    request paths (expired token, 401 response), go through the auth manager.
+    """
+    manager = None
+
+    def refresh(self, request):
+        if self.manager is None:
+            return super().refresh(request)
+        self.manager.refresh(self, request)
+
 class GoogleAuthManager:
     SCOPES = [
         'https://www.googleapis.com/auth/calendar',
         'https://www.googleapis.com/auth/tasks'
     ]
     
-    def __init__(self, token_path="token.json", credentials_path="credentials.json"):
+    def __init__(self, token_path=GOOGLE_TOKEN_PATH, credentials_path=GOOGLE_CREDENTIALS_PATH):
         self.token_path = token_path
         self.credentials_path = credentials_path
         self._credentials = None
+        # Held while credentials are loaded or refreshed, so only one caller does it
+        self._lock = threading.RLock()
+        self._renewer = None
+        self._stop = threading.Event()
+        self._refreshed_at = None
+        self.refresh_count = 0
+    
+    def _manage(self, creds):
+        if not isinstance(creds, ManagedCredentials):
+            creds = ManagedCredentials.from_authorized_user_info(json.loads(creds.to_json()), self.SCOPES)
+        if GOOGLE_TOKEN_URI:
+            expiry = creds.expiry
+            creds = creds.with_token_uri(GOOGLE_TOKEN_URI)
+            creds.expiry = expiry
+        creds.manager = self
+        return creds
+    
+    def _load(self):
+        if not os.path.exists(self.token_path):
+            return None
+        return self._manage(ManagedCredentials.from_authorized_user_file(self.token_path, self.SCOPES))
+    
+    def _save(self, creds):
+        """
+        Writes the token file atomically: a reader never sees a partly written file.
+        """
+        directory = os.path.dirname(os.path.abspath(self.token_path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".token-", suffix=".json")
+        try:
+            with os.fdopen(fd, 'w') as token:
+                token.write(creds.to_json())
+                token.flush()
+                os.fsync(token.fileno())
+            os.replace(temp_path, self.token_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+    
+    def refresh(self, creds, request=None):
+        """
+        Single-flight refresh: callers arriving while a refresh is in progress wait for it
+        and use its token instead of refreshing again.
+        """
+        stale_token = creds.token
+        with self._lock:
+            if creds.token != stale_token and creds.valid:
+                return
+            Credentials.refresh(creds, request or Request())
+            self._refreshed_at = _utcnow()
+            self.refresh_count += 1
+            self._save(creds)
     
     def get_credentials(self):
-        if self._credentials and self._credentials.valid:
-            return self._credentials
+        creds = self._credentials
+        if creds and creds.valid:
+            return creds
         
-        creds = None
-        
-        if os.path.exists(self.token_path):
-            creds = Credentials.from_authorized_user_file(self.token_path, self.SCOPES)
-        
-        if not creds or not creds.valid:
+        with self._lock:
+            # Another caller may have loaded or refreshed the credentials while this one waited
+            creds = self._credentials or self._load()
+            if creds and creds.valid:
+                self._credentials = creds
+                return creds
+            
             if creds and creds.expired and creds.refresh_token:
                 try:
-                    creds.refresh(Request())
+                    self.refresh(creds)
                 except Exception as e:
                     print(f"Token refresh failed: {e}")
                     creds = None
+            else:
+                creds = None
             
             if not creds:
                 if not os.path.exists(self.credentials_path):
@@ -38,14 +133,63 @@ class GoogleAuthManager:
                 
                 flow = InstalledAppFlow.from_client_secrets_file(
                     self.credentials_path, self.SCOPES)
-                creds = flow.run_local_server(port=0)
+                creds = self._manage(flow.run_local_server(port=0))
+                # Save the credentials for the next run
+                self._save(creds)
             
-            # Save the credentials for the next run
-            with open(self.token_path, 'w') as token:
-                token.write(creds.to_json())
-        
-        self._credentials = creds
-        return creds
+            self._credentials = creds
+            return creds
+    
+    def _renew_in(self, creds):
+        """
+        Seconds until `creds` should be renewed, negative when overdue.
+        """
+        margin = GOOGLE_TOKEN_RENEW_MARGIN
+        if self._refreshed_at and creds.expiry > self._refreshed_at:
+            margin = min(margin, (creds.expiry - self._refreshed_at).total_seconds() / 2)
+        return (creds.expiry - _utcnow()).total_seconds() - margin
+
+    def _just_renewed(self):
+        return self._refreshed_at is not None and (_utcnow() - self._refreshed_at).total_seconds() < GOOGLE_TOKEN_RENEW_MIN_DELAY
+
+    def _renew_delay(self):
+        creds = self._credentials
+        if creds is None or creds.expiry is None:
+            return GOOGLE_TOKEN_RENEW_CHECK_INTERVAL
+        return max(GOOGLE_TOKEN_RENEW_MIN_DELAY, min(self._renew_in(creds), GOOGLE_TOKEN_RENEW_CHECK_INTERVAL))
+    
+    def _renew(self):
+        while not self._stop.is_set():
+            try:
+                with self._lock:
+                    if self._credentials is None:
+                        # Only an existing token is renewed, never the interactive flow
+                        self._credentials = self._load()
+                creds = self._credentials
+                if (creds and creds.refresh_token and creds.expiry and self._renew_in(creds) <= 0
+                        and not self._just_renewed()):
+                    logging.debug("Renewing Google access token.")
+                    self.refresh(creds)
+            except Exception as e:
+                logging.error(f"Could not renew Google access token: {e}")
+                self._stop.wait(GOOGLE_TOKEN_RENEW_RETRY_DELAY)
+                continue
+            self._stop.wait(self._renew_delay())
+    
+    def start_renewer(self):
+        """
+        Starts the background thread that refreshes the token before it expires,
+        so request paths don't pay for a refresh.
+        """
+        with self._lock:
+            if self._renewer and self._renewer.is_alive():
+                return
+            self._stop.clear()
+            self._renewer = threading.Thread(target=self._renew, name="google-token-renewer", daemon=True)
+            self._renewer.start()
+    
+    def stop_renewer(self):
+        self._stop.set()
     
     def check_scopes(self):
         """
@@ -79,10 +223,70 @@ class GoogleAuthManager:
         """
         Force re-authentication by removing the token file.
         """
-        if os.path.exists(self.token_path):
-            os.remove(self.token_path)
-        self._credentials = None
-        return self.get_credentials()
+        with self._lock:
+            if os.path.exists(self.token_path):
+                os.remove(self.token_path)
+            self._credentials = None
+            return self.get_credentials()
 
 # Global auth manager instance
-auth_manager = GoogleAuthManager()
\ No newline at end of file
+auth_manager = GoogleAuthManager()
+
+_thread_http = threading.local()
+
+def _authorized_http(credentials):
+    """
+    httplib2 connections are not thread-safe and the connectors run on a thread pool,
+    so every thread gets its own authorized connection, reused across its requests.
+    """
+    import httplib2
+    import google_auth_httplib2
+    cached = getattr(_thread_http, "value", None)
+    if cached is None or cached[0] is not credentials:
+        cached = _thread_http.value = (credentials, google_auth_httplib2.AuthorizedHttp(credentials, http=httplib2.Http()))
+    return cached[1]
+
+def build_service(name: str, version: str, service_path: str = ""):
+    """
+    Builds a Google API client with the shared credentials.
+    `service_path` is appended to GOOGLE_API_ENDPOINT when it is set, since the
+    endpoint override replaces the API's base URL including its service path.
+    """
+    from googleapiclient.discovery import build
+    from googleapiclient.http import HttpRequest
+    credentials = auth_manager.get_credentials()
+
+    def build_request(http, *args, **kwargs):
+        return HttpRequest(_authorized_http(credentials), *args, **kwargs)
+
+    client_options = None
+    if GOOGLE_API_ENDPOINT:
+        client_options = {"api_endpoint": GOOGLE_API_ENDPOINT.rstrip("/") + "/" + service_path}
+    return build(
+        name, version,
+        http=_authorized_http(credentials),
+        requestBuilder=build_request,
+        client_options=client_options
+    )
+
+def execute_batch(service, requests, batch_path: str):
+    """
+    Sends API requests in Google batch HTTP requests of up to GOOGLE_BATCH_MAX_REQUESTS calls.
+    `batch_path` is the API's batch path from its discovery document, used with GOOGLE_API_ENDPOINT.
+    Returns a `(response, exception)` pair per request, in order.
+    """
+    from googleapiclient.http import BatchHttpRequest
+    results = [None] * len(requests)
+
+    def callback(request_id, response, exception):
+        results[int(request_id)] = (response, exception)
+
+    for start in range(0, len(requests), GOOGLE_BATCH_MAX_REQUESTS):
+        if GOOGLE_API_ENDPOINT:
+            batch = BatchHttpRequest(callback=callback, batch_uri=GOOGLE_API_ENDPOINT.rstrip("/") + "/" + batch_path)
+        else:
+            batch = service.new_batch_http_request(callback=callback)
+        for index in range(start, min(start + GOOGLE_BATCH_MAX_REQUESTS, len(requests))):
+            batch.add(requests[index], request_id=str(index))
+        batch.execute()
+    return results
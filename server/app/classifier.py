@@ -0,0 +1,65 @@
+import os
+import re
+
+# Messages longer than this usually mix several kinds of items, they always get the full prompt
+CLASSIFIER_MAX_WORDS = int(os.getenv("CLASSIFIER_MAX_WORDS", "60"))
+
+ALL_CATEGORIES = ("tasks", "events", "notes", "shopping_lists")
+
+# Polish keyword stems signalling each category
+CATEGORY_PATTERNS = {
+    "shopping_lists": re.compile(
+        r"\b(kup\w*|dokup\w*|zakup\w*|zakupy|sklep\w*|list\w* zakup\w*|biedronk\w*|lidl\w*|żabk\w*|market\w*)\b",
+        re.IGNORECASE
+    ),
+    "events": re.compile(
+        r"\b(spotkani\w*|wizyt\w*|zebrani\w*|kalendarz\w*|wydarzeni\w*|urodzin\w*|konferencj\w*|rezerwacj\w*|"
+        r"lekarz\w*|dentyst\w*|termin\w*|randk\w*|koncert\w*|kino|kolacj\w*|obiad\w*|trening\w*|"
+        r"codziennie|co tydzień|co miesiąc|w każd\w+)\b",
+        re.IGNORECASE
+    ),
+    "tasks": re.compile(
+        r"\b(przypomnij\w*|przypomnienie|zadani\w*|muszę|musisz|trzeba|do zrobienia|zadzwo\w+|wyślij|wysła\w+|"
+        r"zapła\w+|opła\w+|napisz|napisać|sprawdź|sprawdzić|załatw\w*|odebra\w+|odbierz|oddaj|oddać|zrób|zrobić)\b",
+        re.IGNORECASE
+    ),
+    "notes": re.compile(
+        r"\b(notatk\w*|zanotuj|zapisz|zapamiętaj|pomysł\w*|przepis\w*|podsumuj|podsumowanie|streść|wymyśl|opisz)\b",
+        re.IGNORECASE
+    ),
+}
+
+# Dates and times make tasks and events hard to tell apart
+TEMPORAL_PATTERN = re.compile(
+    r"\b(dziś|dzisiaj|jutro|pojutrze|rano|wieczorem|po południu|poniedział\w*|wtor\w*|środ\w*|czwart\w*|piąt\w*|"
+    r"sobot\w*|niedziel\w*|tydzie\w*|tygodni\w*|miesiąc\w*|godzin\w*|o \d{1,2}|\d{1,2}[:.]\d{2}|\d{1,2}[./-]\d{1,2})\b",
+    re.IGNORECASE
+)
+
+
+class Classification:
+    def __init__(self, categories, confident, reason):
+        self.categories = categories
+        self.confident = confident
+        self.reason = reason
+
+    def __repr__(self):
+        return f"Classification(categories={self.categories}, confident={self.confident}, reason={self.reason!r})"
+
+
+def classify_message(message: str):
+    """
+    Cheap keyword pre-classification of a message into the extraction categories it likely contains.
+    Falls back to all categories when it is not confident.
+    """
+    if len(message.split()) > CLASSIFIER_MAX_WORDS:
+        return Classification(ALL_CATEGORIES, False, "long message")
+
+    matched = {category for category, pattern in CATEGORY_PATTERNS.items() if pattern.search(message)}
+    if not matched:
+        return Classification(ALL_CATEGORIES, False, "no keywords")
+
+    if matched & {"tasks", "events"} and TEMPORAL_PATTERN.search(message):
+        matched |= {"tasks", "events"}
+
+    return Classification(tuple(category for category in ALL_CATEGORIES if category in matched), True, "keywords")
@@ -0,0 +1,425 @@
+import os
+import re
+import html
+import time
+import email
+import imaplib
+import sqlite3
+import logging
+import threading
+from email import policy
+from email.utils import parseaddr
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from .classifier import CATEGORY_PATTERNS
+from .processing import process_batch_text
+from .lazy import Lazy
+
+EMAIL_INGEST_ENABLED = os.getenv("EMAIL_INGEST_ENABLED", "false").lower() == "true"
+IMAP_HOST = os.getenv("IMAP_HOST")
+IMAP_PORT = int(os.getenv("IMAP_PORT", "993"))
+IMAP_SSL = os.getenv("IMAP_SSL", "true").lower() == "true"
+IMAP_USER = os.getenv("IMAP_USER")
+IMAP_PASSWORD = os.getenv("IMAP_PASSWORD")
+IMAP_MAILBOX = os.getenv("IMAP_MAILBOX", "INBOX")
+EMAIL_DB_PATH = os.getenv("EMAIL_DB_PATH", "email.db")
+EMAIL_POLL_INTERVAL = float(os.getenv("EMAIL_POLL_INTERVAL", "60"))
+# The first poll ingests mail from this many days back; 0 starts with mail arriving after it
+EMAIL_BACKFILL_DAYS = int(os.getenv("EMAIL_BACKFILL_DAYS", "0"))
+# UIDs per FETCH command, and messages per batch extraction
+EMAIL_FETCH_BATCH = int(os.getenv("EMAIL_FETCH_BATCH", "500"))
+EMAIL_PROCESS_BATCH = int(os.getenv("EMAIL_PROCESS_BATCH", "50"))
+# Batches in progress at once, so one batch is extracted while the items of another are written
+EMAIL_PROCESS_CONCURRENCY = int(os.getenv("EMAIL_PROCESS_CONCURRENCY", "2"))
+# Messages whose extraction failed are fetched again on later polls, waiting
+# EMAIL_POLL_INTERVAL * 2^(attempts - 1) seconds before each retry
+EMAIL_MAX_ATTEMPTS = int(os.getenv("EMAIL_MAX_ATTEMPTS", "6"))
+# Only the beginning of each message is downloaded, which skips most attachments
+EMAIL_MAX_BYTES = int(os.getenv("EMAIL_MAX_BYTES", str(64 * 1024)))
+EMAIL_MAX_CHARS = int(os.getenv("EMAIL_MAX_CHARS", "4000"))
+# Comma separated addresses or @domains; empty accepts every sender
+EMAIL_ALLOWED_SENDERS = [
+    sender.strip().lower() for sender in os.getenv("EMAIL_ALLOWED_SENDERS", "").split(",") if sender.strip()
+]
+# Skip messages without any of the classifier's keywords
+EMAIL_REQUIRE_KEYWORDS = os.getenv("EMAIL_REQUIRE_KEYWORDS", "true").lower() == "true"
+
+HEADER_FIELDS = "FROM SUBJECT DATE MESSAGE-ID LIST-ID LIST-UNSUBSCRIBE PRECEDENCE AUTO-SUBMITTED"
+AUTOMATED_SENDER_PATTERN = re.compile(r"^(no-?reply|do-?not-?reply|mailer-daemon|postmaster|notifications?|newsletter)\b")
+FETCH_UID_PATTERN = re.compile(rb"UID (\d+)")
+TAG_PATTERN = re.compile(r"<(script|style)\b.*?</\1>|<[^>]+>", re.IGNORECASE | re.DOTALL)
+# IMAP dates use English month names whatever the locale
+MONTHS = ("Jan", "Feb", "Mar", "Apr", "May", "Jun", "Jul", "Aug", "Sep", "Oct", "Nov", "Dec")
+
+
+def uid_set(uids):
+    """
+    Sorted UIDs as an IMAP sequence set, consecutive runs as ranges: 1:3,7,9:10
+    """
+    ranges = []
+    for uid in sorted(uids):
+        if ranges and uid == ranges[-1][1] + 1:
+            ranges[-1][1] = uid
+        else:
+            ranges.append([uid, uid])
+    return ",".join(str(first) if first == last else f"{first}:{last}" for first, last in ranges)
+
+
+def fetched_items(data):
+    """
+    (uid, payload) pairs of a UID FETCH response with one literal per message.
+    """
+    items = []
+    for index, item in enumerate(data):
+        if not isinstance(item, tuple):
+            continue
+        match = FETCH_UID_PATTERN.search(item[0])
+        # Some servers send the UID after the literal
+        if not match and index + 1 < len(data) and isinstance(data[index + 1], bytes):
+            match = FETCH_UID_PATTERN.search(data[index + 1])
+        if match:
+            items.append((int(match.group(1)), item[1]))
+    return items
+
+
+def skip_reason(headers):
+    """
+    Why a message is not worth extracting, judged from its headers only, or None.
+    """
+    address = parseaddr(str(headers.get("From", "")))[1].lower()
+    if EMAIL_ALLOWED_SENDERS and not any(
+        address == sender or (sender.startswith("@") and address.endswith(sender)) for sender in EMAIL_ALLOWED_SENDERS
+    ):
+        return "sender"
+    if headers.get("List-Id") or headers.get("List-Unsubscribe"):
+        return "mailing_list"
+    if str(headers.get("Precedence", "")).lower() in ("bulk", "list", "junk"):
+        return "bulk"
+    if str(headers.get("Auto-Submitted", "no")).lower() != "no":
+        return "automated"
+    if AUTOMATED_SENDER_PATTERN.match(address.split("@")[0]):
+        return "automated"
+    return None
+
+
+def _part_text(part):
+    try:
+        return part.get_content()
+    except (LookupError, ValueError, AssertionError):
+        # Unknown charsets and messages cut at EMAIL_MAX_BYTES
+        payload = part.get_payload(decode=True) or b""
+        return payload.decode("utf-8", errors="replace")
+
+
+def message_text(message):
+    """
+    Plain text of a message, from HTML when there is no text part, without quoted
+    replies and the signature.
+    """
+    part = message.get_body(preferencelist=("plain", "html"))
+    if part is None:
+        return ""
+    text = _part_text(part)
+    if part.get_content_subtype() == "html":
+        text = html.unescape(TAG_PATTERN.sub(" ", text))
+    text = text.split("\n-- \n", 1)[0]
+    lines = [line.rstrip() for line in text.splitlines() if not line.lstrip().startswith(">")]
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def has_keywords(text: str):
+    return any(pattern.search(text) for pattern in CATEGORY_PATTERNS.values())
+
+
+class EmailStore:
+    """
+    SQLite (WAL) checkpoint per mailbox (UIDVALIDITY and the last UID seen) and the
+    outcome of every message seen, by Message-ID. Failed messages count as seen only
+    once they used up EMAIL_MAX_ATTEMPTS.
+    """
+
+    def __init__(self, path=EMAIL_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS mailbox_state (
+                mailbox TEXT PRIMARY KEY,
+                uidvalidity INTEGER NOT NULL,
+                last_uid INTEGER NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS messages (
+                message_id TEXT PRIMARY KEY,
+                mailbox TEXT NOT NULL,
+                uidvalidity INTEGER NOT NULL,
+                uid INTEGER NOT NULL,
+                subject TEXT,
+                status TEXT NOT NULL,
+                reason TEXT,
+                attempts INTEGER NOT NULL DEFAULT 1,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_status ON messages (status);
+        """)
+        self._conn.commit()
+
+    def get_state(self, mailbox: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT uidvalidity, last_uid, updated_at FROM mailbox_state WHERE mailbox = ?", (mailbox,)
+            ).fetchone()
+        return {"uidvalidity": row[0], "last_uid": row[1], "updated_at": row[2]} if row else None
+
+    def seen(self, message_ids):
+        message_ids = list(message_ids)
+        with self._lock:
+            return {
+                row[0] for row in self._conn.execute(
+                    f"SELECT message_id FROM messages WHERE message_id IN ({','.join('?' * len(message_ids))}) "
+                    "AND (status != 'failed' OR attempts >= ?)",
+                    (*message_ids, EMAIL_MAX_ATTEMPTS)
+                )
+            } if message_ids else set()
+
+    def retry_uids(self, mailbox: str, uidvalidity: int, interval: float):
+        """
+        UIDs of failed messages due for another attempt.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT uid FROM messages WHERE mailbox = ? AND uidvalidity = ? AND status = 'failed' "
+                "AND attempts < ? AND updated_at <= ? - ? * (1 << (attempts - 1)) ORDER BY uid",
+                (mailbox, uidvalidity, EMAIL_MAX_ATTEMPTS, time.time(), interval)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def checkpoint(self, mailbox: str, uidvalidity: int, last_uid: int, messages=()):
+        """
+        Records the outcome of `messages` and moves the checkpoint in one transaction.
+        """
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO messages (message_id, mailbox, uidvalidity, uid, subject, status, reason, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?) ON CONFLICT (message_id) DO UPDATE SET "
+                "mailbox = excluded.mailbox, uidvalidity = excluded.uidvalidity, uid = excluded.uid, "
+                "status = excluded.status, reason = excluded.reason, attempts = attempts + 1, updated_at = excluded.updated_at",
+                [
+                    (message["message_id"], mailbox, uidvalidity, message["uid"], message.get("subject"),
+                     message["status"], message.get("reason"), now, now)
+                    for message in messages
+                ]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO mailbox_state (mailbox, uidvalidity, last_uid, updated_at) VALUES (?, ?, ?, ?)",
+                (mailbox, uidvalidity, last_uid, now)
+            )
+
+    def counts(self):
+        with self._lock:
+            statuses = dict(self._conn.execute("SELECT status, COUNT(*) FROM messages GROUP BY status").fetchall())
+            reasons = dict(self._conn.execute(
+                "SELECT reason, COUNT(*) FROM messages WHERE status = 'skipped' GROUP BY reason"
+            ).fetchall())
+        return {"messages": statuses, "skipped": reasons}
+
+
+class EmailIngestor:
+    """
+    Polls an IMAP mailbox for new messages and sends the relevant ones to batch extraction.
+    Only UIDs above the checkpoint are fetched: headers of all of them in bulk first, then
+    the beginning of the messages passing the header prefilter. Messages whose extraction
+    failed are fetched again on later polls. When the mailbox's UIDVALIDITY changes,
+    recent mail is scanned again and known Message-IDs are skipped.
+    """
+
+    def __init__(self, store: EmailStore, mailbox=IMAP_MAILBOX, interval=EMAIL_POLL_INTERVAL):
+        self.store = store
+        self.mailbox = mailbox
+        self.interval = interval
+        self.last_poll = None
+        self._poll_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def connect(self):
+        connection = imaplib.IMAP4_SSL(IMAP_HOST, IMAP_PORT) if IMAP_SSL else imaplib.IMAP4(IMAP_HOST, IMAP_PORT)
+        connection.login(IMAP_USER, IMAP_PASSWORD)
+        status, data = connection.select(f'"{self.mailbox}"', readonly=True)
+        if status != "OK":
+            raise RuntimeError(f"Could not select {self.mailbox}: {data}")
+        return connection
+
+    @staticmethod
+    def _response_number(connection, code):
+        status, data = connection.response(code)
+        return int(data[0]) if data and data[0] else None
+
+    @staticmethod
+    def _search(connection, *criteria):
+        status, data = connection.uid("SEARCH", *criteria)
+        if status != "OK":
+            raise RuntimeError(f"IMAP search failed: {data}")
+        return [int(uid) for uid in data[0].split()] if data and data[0] else []
+
+    def _since(self, days: float):
+        date = datetime.now() - timedelta(days=days)
+        return f"{date.day:02d}-{MONTHS[date.month - 1]}-{date.year}"
+
+    def new_uids(self, connection, state, uidvalidity):
+        """
+        UIDs to fetch and the checkpoint they start from; an empty list with
+        a checkpoint at UIDNEXT - 1 when mail before now should not be ingested.
+        """
+        if state and state["uidvalidity"] == uidvalidity:
+            # n:* always matches the highest UID, even when it is below n
+            uids = self._search(connection, "UID", f"{state['last_uid'] + 1}:*")
+            return [uid for uid in uids if uid > state["last_uid"]], state["last_uid"]
+        if state:
+            logging.debug(f"UIDVALIDITY of {self.mailbox} changed, scanning mail since the last poll again.")
+            days = (time.time() - state["updated_at"]) / 86400 + 1
+            return self._search(connection, "SINCE", self._since(days)), 0
+        if EMAIL_BACKFILL_DAYS:
+            return self._search(connection, "SINCE", self._since(EMAIL_BACKFILL_DAYS)), 0
+        uidnext = self._response_number(connection, "UIDNEXT")
+        return [], uidnext - 1 if uidnext else max(self._search(connection, "ALL"), default=0)
+
+    def _fetch(self, connection, uids, items):
+        status, data = connection.uid("FETCH", uid_set(uids), f"(UID {items})")
+        if status != "OK":
+            raise RuntimeError(f"IMAP fetch failed: {data}")
+        return fetched_items(data)
+
+    def fetch_chunk(self, connection, uids, uidvalidity):
+        """
+        Headers of `uids`, then the text of the messages worth extracting.
+        Returns every message with its status; `text` is set on those to extract.
+        """
+        messages = {}
+        for uid, header_bytes in self._fetch(connection, uids, f"BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})]"):
+            headers = email.message_from_bytes(header_bytes, policy=policy.default)
+            messages[uid] = {
+                "uid": uid,
+                "message_id": str(headers.get("Message-ID") or f"<{uidvalidity}.{uid}@{self.mailbox}>").strip(),
+                "subject": str(headers.get("Subject", "")),
+                "sender": str(headers.get("From", "")),
+                "status": "skipped",
+                "reason": skip_reason(headers)
+            }
+
+        seen = self.store.seen(message["message_id"] for message in messages.values())
+        for message in messages.values():
+            if message["message_id"] in seen:
+                message["reason"] = "seen"
+        wanted = [uid for uid, message in messages.items() if not message["reason"]]
+        if not wanted:
+            return list(messages.values())
+
+        for uid, raw in self._fetch(connection, wanted, f"BODY.PEEK[]<0.{EMAIL_MAX_BYTES}>"):
+            message = messages[uid]
+            text = message_text(email.message_from_bytes(raw, policy=policy.default))
+            if not text and not message["subject"]:
+                message["reason"] = "empty"
+            elif EMAIL_REQUIRE_KEYWORDS and not has_keywords(f"{message['subject']}\n{text}"):
+                message["reason"] = "no_keywords"
+            else:
+                message["text"] = f"E-mail od: {message['sender']}\nTemat: {message['subject']}\n\n{text}"[:EMAIL_MAX_CHARS]
+        return list(messages.values())
+
+    def process(self, messages):
+        """
+        Extracts the messages that passed the prefilter, EMAIL_PROCESS_BATCH at a time.
+        """
+        pending = [message for message in messages if message.get("text")]
+        batches = [pending[i:i + EMAIL_PROCESS_BATCH] for i in range(0, len(pending), EMAIL_PROCESS_BATCH)]
+        if not batches:
+            return
+        with ThreadPoolExecutor(max_workers=EMAIL_PROCESS_CONCURRENCY, thread_name_prefix="email-extraction") as pool:
+            results = pool.map(lambda batch: process_batch_text([message["text"] for message in batch]), batches)
+            for batch, result in zip(batches, results):
+                for message, outcome in zip(batch, result["results"]):
+                    if outcome["success"]:
+                        message["status"], message["reason"] = "processed", None
+                    elif "integrations" in outcome:
+                        # Extracted, but some writes failed; retrying would create the other items again
+                        message["status"], message["reason"] = "write_failed", outcome["error"]
+                    else:
+                        message["status"], message["reason"] = "failed", outcome.get("error")
+
+    def poll(self):
+        """
+        Ingests the mail that arrived since the last poll; one poll runs at a time.
+        The checkpoint moves after each chunk, so an interrupted backfill resumes where it stopped.
+        While a chunk is extracted, the next one is fetched.
+        """
+        with self._poll_lock:
+            started = time.perf_counter()
+            stats = {"fetched": 0, "processed": 0, "failed": 0, "write_failed": 0, "skipped": 0, "retried": 0}
+            connection = self.connect()
+            try:
+                uidvalidity = self._response_number(connection, "UIDVALIDITY")
+                state = self.store.get_state(self.mailbox)
+                uids, last_uid = self.new_uids(connection, state, uidvalidity)
+                if state and state["uidvalidity"] == uidvalidity:
+                    retries = self.store.retry_uids(self.mailbox, uidvalidity, self.interval)
+                    stats["retried"] = len(retries)
+                    uids = sorted(set(uids) | set(retries))
+                chunks = [uids[i:i + EMAIL_FETCH_BATCH] for i in range(0, len(uids), EMAIL_FETCH_BATCH)]
+                if not chunks:
+                    self.store.checkpoint(self.mailbox, uidvalidity, last_uid)
+                with ThreadPoolExecutor(max_workers=1, thread_name_prefix="imap-fetch") as fetcher:
+                    upcoming = fetcher.submit(self.fetch_chunk, connection, chunks[0], uidvalidity) if chunks else None
+                    for index, chunk in enumerate(chunks):
+                        messages = upcoming.result()
+                        if index + 1 < len(chunks):
+                            upcoming = fetcher.submit(self.fetch_chunk, connection, chunks[index + 1], uidvalidity)
+                        self.process(messages)
+                        last_uid = max(last_uid, max(chunk))
+                        # Known messages keep the outcome recorded when they were first seen
+                        self.store.checkpoint(
+                            self.mailbox, uidvalidity, last_uid, [message for message in messages if message["reason"] != "seen"]
+                        )
+                        stats["fetched"] += len(chunk)
+                        for message in messages:
+                            stats[message["status"]] += 1
+            finally:
+                try:
+                    connection.logout()
+                except Exception as e:
+                    logging.error(f"Could not log out of IMAP: {e}")
+            stats.update(uidvalidity=uidvalidity, last_uid=last_uid, duration_seconds=round(time.perf_counter() - started, 3))
+            self.last_poll = {"finished_at": time.time(), **stats}
+            return stats
+
+    def request_poll(self):
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                logging.error(f"Could not poll {self.mailbox}: {e}")
+                self.last_poll = {"finished_at": time.time(), "error": str(e)}
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="email-ingest", daemon=True)
+        self._thread.start()
+
+    def snapshot(self):
+        return {
+            "mailbox": self.mailbox,
+            "checkpoint": self.store.get_state(self.mailbox),
+            **self.store.counts(),
+            "last_poll": self.last_poll
+        }
+
+
+# Created on first use, only when EMAIL_INGEST_ENABLED
+email_ingestor = Lazy(lambda: EmailIngestor(EmailStore()))
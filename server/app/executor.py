@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+INTEGRATION_MAX_WORKERS = int(os.getenv("INTEGRATION_MAX_WORKERS", "32"))
+INTEGRATION_CALL_TIMEOUT = float(os.getenv("INTEGRATION_CALL_TIMEOUT", "30"))
+
+# Maximum number of simultaneous calls per remote service, shared by all requests.
+# The defaults let the requests admitted at once (ADMISSION_TEXT_CONCURRENCY and
+# ADMISSION_AUDIO_CONCURRENCY) write their items without queueing behind each other.
+INTEGRATION_CONCURRENCY = {
+    "google_tasks": int(os.getenv("GOOGLE_TASKS_CONCURRENCY", "16")),
+    "google_calendar": int(os.getenv("GOOGLE_CALENDAR_CONCURRENCY", "16")),
+    "notion": int(os.getenv("NOTION_CONCURRENCY", "12")),
+}
+
+
+class IntegrationCall:
+    def __init__(self, integration: str, func, *args, **kwargs):
+        self.integration = integration
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.started = threading.Event()
+        self.submitted_at = None
+        self.started_at = None
+
+
+class IntegrationExecutor:
+    """
+    Runs connector writes on a bounded thread pool.
+    Calls of a limited integration wait in its own queue and only reach the pool below
+    the integration's limit, so a busy integration never holds pool threads needed by
+    others. Waiting for a call is bounded by a timeout measured from submission, which
+    covers the time spent queued; the call itself is never cancelled.
+    """
+
+    def __init__(self, max_workers=INTEGRATION_MAX_WORKERS, call_timeout=INTEGRATION_CALL_TIMEOUT, concurrency=None):
+        self.call_timeout = call_timeout
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="integration")
+        self._limits = dict(concurrency or INTEGRATION_CONCURRENCY)
+        self._active = {name: 0 for name in self._limits}
+        self._queues = {name: deque() for name in self._limits}
+        self._lock = threading.Lock()
+
+    def _enqueue(self, integration: str, job):
+        limit = self._limits.get(integration)
+        if limit is None:
+            self._pool.submit(job)
+            return
+        with self._lock:
+            if self._active[integration] >= limit:
+                self._queues[integration].append(job)
+                return
+            self._active[integration] += 1
+        self._pool.submit(self._execute, integration, job)
+
+    def _execute(self, integration: str, job):
+        # Runs jobs of a limited integration, then hands its slot to the next queued one
+        while job:
+            try:
+                job()
+            finally:
+                with self._lock:
+                    if self._queues[integration]:
+                        job = self._queues[integration].popleft()
+                    else:
+                        job = None
+                        self._active[integration] -= 1
+
+    def submit(self, call: IntegrationCall):
+        future = Future()
+        call.submitted_at = time.monotonic()
+
+        def job():
+            if not future.set_running_or_notify_cancel():
+                return
+            call.started_at = time.monotonic()
+            call.started.set()
+            try:
+                future.set_result(call.func(*call.args, **call.kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+
+        self._enqueue(call.integration, job)
+        return future
+
+    def submit_batch(self, calls, func):
+        """
+        Runs calls of one integration as a single `func` call taking the first argument
+        of every call and returning a result per call. Returns a future per call,
+        awaited with `wait` like the futures of separately submitted calls.
+        """
+        futures = [Future() for _ in calls]
+        submitted_at = time.monotonic()
+        for call in calls:
+            call.submitted_at = submitted_at
+
+        def job():
+            running = [(call, future) for call, future in zip(calls, futures) if future.set_running_or_notify_cancel()]
+            if not running:
+                return
+            started_at = time.monotonic()
+            for call, _ in running:
+                call.started_at = started_at
+                call.started.set()
+            try:
+                results = func([call.args[0] for call, _ in running])
+            except BaseException as e:
+                for _, future in running:
+                    future.set_exception(e)
+                return
+            for (_, future), result in zip(running, results):
+                future.set_result(result)
+
+        self._enqueue(calls[0].integration, job)
+        return futures
+
+    def _pending(self, call: IntegrationCall):
+        state = "running" if call.started.is_set() else "queued"
+        logging.error(f"{call.integration} call still {state} after {self.call_timeout}s")
+        return {
+            'pending': True,
+            'status': state,
+            'detail': f'{call.integration} call still {state} after {self.call_timeout}s, it may still complete'
+        }
+
+    def wait(self, call: IntegrationCall, future):
+        """
+        Returns the call result, or an error dict in the connectors' format when the call
+        raised. A call not finished within the timeout keeps going and may still create
+        its item, so it is reported as pending instead of failed.
+        """
+        deadline = call.submitted_at + self.call_timeout
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            return self._pending(call)
+        except Exception as e:
+            logging.error(f"{call.integration} call failed: {e}")
+            return {
+                'success': False,
+                'error': f'{call.integration} call failed: {e}'
+            }
+
+    def run_all(self, calls):
+        """
+        Submits all calls at once and returns their results in the order of `calls`.
+        """
+        futures = [self.submit(call) for call in calls]
+        return [self.wait(call, future) for call, future in zip(calls, futures)]
+
+
+integration_executor = IntegrationExecutor()
@@ -1,45 +1,127 @@
 import os
-import re
-from langchain_google_community.calendar.create_event import CalendarCreateEvent
-from ..auth_manager import auth_manager
+from datetime import datetime, timedelta
+from ..auth_manager import build_service, execute_batch
+from ..lazy import Lazy
+from ..metrics import timed_connector
 
 CALENDAR_ID = os.getenv("CALENDAR_ID", "primary")
+CALENDAR_TIMEZONE = os.getenv("CALENDAR_TIMEZONE", "Europe/Warsaw")
+# Batch path of the Calendar API discovery document
+CALENDAR_BATCH_PATH = "batch/calendar/v3"
 
-# Ensure we have proper authentication before initializing
-try:
-    auth_manager.get_credentials()  # This ensures we have all required scopes
-    createCalendarEventTool = CalendarCreateEvent()
-except Exception as e:
-    print(f"Warning: Could not initialize calendar tool: {e}")
-    createCalendarEventTool = None
+# Keys of the recurrence object in the extraction, in RRULE order
+RRULE_KEYS = ("FREQ", "INTERVAL", "COUNT", "UNTIL", "BYDAY")
 
-def create_calendar_event(data_item):
-    if not createCalendarEventTool:
-        return {
-            'success': False,
-            'error': 'Calendar tool not initialized'
-        }
-    
-    event_payload = {
-        "calendar_id": CALENDAR_ID,
+def _create_calendar_service():
+    # Uses the shared credentials, which have all required scopes
+    return build_service('calendar', 'v3', 'calendar/v3/')
+
+# Created on first use, a failed initialization is retried on the next call
+calendar_service = Lazy(_create_calendar_service)
+
+def build_rrule(recurrence):
+    """
+    Builds the event's recurrence list from the extracted recurrence object,
+    e.g. {"FREQ": "WEEKLY", "COUNT": 10, "BYDAY": "FR"} -> ["RRULE:FREQ=WEEKLY;COUNT=10;BYDAY=FR"].
+    """
+    if isinstance(recurrence, str):
+        return [recurrence if recurrence.startswith("RRULE:") else f"RRULE:{recurrence}"]
+    parts = [
+        f"{key}={recurrence[key]}"
+        for key in RRULE_KEYS
+        if recurrence.get(key) not in (None, "")
+    ]
+    return [f"RRULE:{';'.join(parts)}"]
+
+def build_event_body(data_item):
+    """
+    Raises ValueError when the start or end is not a valid date and time.
+    """
+    start = datetime.fromisoformat(data_item["start_datetime"])
+    end_datetime = data_item.get("end_datetime")
+    end = datetime.fromisoformat(end_datetime) if end_datetime else start + timedelta(hours=1)
+
+    event_body = {
         "summary": data_item.get("title", "No Title"),
-        "start_datetime": data_item.get("start_datetime"),
-        "end_datetime": data_item.get("end_datetime"),
-        "timezone": "Europe/Warsaw",
-        "description": data_item.get("description", "No Description")
+        "description": data_item.get("description", "No Description"),
+        "start": {"dateTime": start.isoformat(), "timeZone": CALENDAR_TIMEZONE},
+        "end": {"dateTime": end.isoformat(), "timeZone": CALENDAR_TIMEZONE}
     }
-
     if data_item.get("recurrence"):
-        event_payload["recurrence"] = data_item["recurrence"]
+        event_body["recurrence"] = build_rrule(data_item["recurrence"])
+    return event_body
 
-    result_string = createCalendarEventTool.invoke(event_payload)
-    
-    # Extract URL using regex
-    match = re.search(r'https?://[\S]+', result_string)
-    link = match.group(0) if match else None
+def _insert_request(service, data_item):
+    return service.events().insert(calendarId=CALENDAR_ID, body=build_event_body(data_item))
 
+def _result(result):
     return {
         'success': True,
-        'link': link,
-        'event_data': result_string
-    }
\ No newline at end of file
+        'event_id': result.get('id'),
+        'link': result.get('htmlLink'),
+        'summary': result.get('summary'),
+        'start': result.get('start', {}).get('dateTime'),
+        'end': result.get('end', {}).get('dateTime'),
+        'status': result.get('status')
+    }
+
+def _error(data_item, e):
+    return {
+        'success': False,
+        'error': f'Failed to create event: {e}',
+        'event_data': data_item,
+        # HTTP status of API errors, None for network errors; invalid event data is a client error
+        'status_code': 400 if isinstance(e, (KeyError, ValueError)) else getattr(getattr(e, 'resp', None), 'status', None)
+    }
+
+def _get_service():
+    try:
+        return calendar_service.get()
+    except Exception as e:
+        print(f"Warning: Could not initialize calendar service: {e}")
+        return None
+
+def _unavailable():
+    return {
+        'success': False,
+        'error': 'Calendar service not initialized'
+    }
+
+@timed_connector("create_calendar_event")
+def create_calendar_event(data_item):
+    service = _get_service()
+    if service is None:
+        return _unavailable()
+
+    try:
+        return _result(_insert_request(service, data_item).execute())
+    except Exception as e:
+        return _error(data_item, e)
+
+@timed_connector("create_calendar_events")
+def create_calendar_events(data_items):
+    """
+    Creates all events in Google batch HTTP requests instead of a round trip per event.
+    Returns a result per item, in order.
+    """
+    service = _get_service()
+    if service is None:
+        return [_unavailable() for _ in data_items]
+
+    results = [None] * len(data_items)
+    requests, positions = [], []
+    for position, data_item in enumerate(data_items):
+        try:
+            requests.append(_insert_request(service, data_item))
+            positions.append(position)
+        except Exception as e:
+            results[position] = _error(data_item, e)
+
+    try:
+        responses = execute_batch(service, requests, CALENDAR_BATCH_PATH) if requests else []
+    except Exception as e:
+        responses = [(None, e)] * len(requests)
+
+    for position, (response, exception) in zip(positions, responses):
+        results[position] = _error(data_items[position], exception) if exception else _result(response)
+    return results
@@ -1,6 +1,10 @@
 from datetime import datetime
-from googleapiclient.discovery import build
-from ..auth_manager import auth_manager
+from ..auth_manager import auth_manager, build_service, execute_batch
+from ..lazy import Lazy
+from ..metrics import timed_connector
+
+# Batch path of the Tasks API discovery document
+TASKS_BATCH_PATH = "batch"
 
 class GoogleTasksService:    
     def __init__(self):
@@ -10,8 +14,7 @@ class GoogleTasksService:
     
     def _initialize_service(self):
         try:
-            creds = auth_manager.get_credentials()
-            self.service = build('tasks', 'v1', credentials=creds)
+            self.service = build_service('tasks', 'v1')
             self._get_default_tasklist()
         except Exception as e:
             print(f"Failed to initialize Tasks service: {e}")
@@ -32,76 +35,119 @@ class GoogleTasksService:
         except Exception as e:
             print(f"Error getting task lists: {e}")
     
-    def create_task(self, data_item):
+    def _ensure_service(self):
         if not self.service or not self.default_tasklist_id:
-            scope_check = auth_manager.check_scopes()
-            if not scope_check.get('has_tasks', False):
-                return {
-                    'success': False,
-                    'error': 'Missing Google Tasks permissions. Please re-authenticate.',
-                    'task_data': data_item,
-                    'fix': 'Run: auth_manager.force_reauth()'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': 'Tasks service not properly initialized',
-                    'task_data': data_item
-                }
+            # Google may have been unreachable when the service was first created
+            self._initialize_service()
+        return bool(self.service and self.default_tasklist_id)
+
+    def _unavailable(self, data_item):
+        scope_check = auth_manager.check_scopes()
+        if not scope_check.get('has_tasks', False):
+            return {
+                'success': False,
+                'error': 'Missing Google Tasks permissions. Please re-authenticate.',
+                'task_data': data_item,
+                'fix': 'Run: auth_manager.force_reauth()'
+            }
+        else:
+            return {
+                'success': False,
+                'error': 'Tasks service not properly initialized',
+                'task_data': data_item
+            }
+
+    def _insert_request(self, data_item):
+        task_body = {
+            'title': data_item.get('title', 'No Title'),
+        }
         
-        try:
-            task_body = {
-                'title': data_item.get('title', 'No Title'),
+        # Add description as notes
+        description = data_item.get('description')
+        if description:
+            task_body['notes'] = description
+        
+        # Add due date
+        due_date = data_item.get('due_date')
+        if due_date:
+            try:
+                if isinstance(due_date, str):
+                    parsed_date = datetime.strptime(due_date, '%Y-%m-%d')
+                    task_body['due'] = parsed_date.strftime('%Y-%m-%dT00:00:00.000Z')
+            except ValueError as e:
+                print(f"Invalid due date format: {due_date}. Expected YYYY-MM-DD")
+        
+        return self.service.tasks().insert(
+            tasklist=self.default_tasklist_id,
+            body=task_body
+        )
+
+    def _result(self, result):
+        return {
+            'success': True,
+            'task_id': result.get('id'),
+            'title': result.get('title'),
+            'due': result.get('due'),
+            'status': result.get('status'),
+            'webViewLink': result.get('webViewLink')
+        }
+
+    def _error(self, data_item, e):
+        error_msg = str(e)
+        if "insufficient authentication scopes" in error_msg.lower():
+            return {
+                'success': False,
+                'error': 'Insufficient authentication scopes for Google Tasks',
+                'task_data': data_item,
+                'fix': 'Delete token.json and restart the application to re-authenticate',
+                'status_code': 403
             }
-            
-            # Add description as notes
-            description = data_item.get('description')
-            if description:
-                task_body['notes'] = description
-            
-            # Add due date
-            due_date = data_item.get('due_date')
-            if due_date:
-                try:
-                    if isinstance(due_date, str):
-                        parsed_date = datetime.strptime(due_date, '%Y-%m-%d')
-                        task_body['due'] = parsed_date.strftime('%Y-%m-%dT00:00:00.000Z')
-                except ValueError as e:
-                    print(f"Invalid due date format: {due_date}. Expected YYYY-MM-DD")
-            
-            # Create the task
-            result = self.service.tasks().insert(
-                tasklist=self.default_tasklist_id,
-                body=task_body
-            ).execute()
-            
+        else:
             return {
-                'success': True,
-                'task_id': result.get('id'),
-                'title': result.get('title'),
-                'due': result.get('due'),
-                'status': result.get('status'),
-                'webViewLink': result.get('webViewLink')
+                'success': False,
+                'error': f'Failed to create task: {error_msg}',
+                'task_data': data_item,
+                'status_code': getattr(getattr(e, 'resp', None), 'status', None)
             }
-            
+
+    def create_task(self, data_item):
+        if not self._ensure_service():
+            return self._unavailable(data_item)
+        
+        try:
+            return self._result(self._insert_request(data_item).execute())
         except Exception as e:
-            error_msg = str(e)
-            if "insufficient authentication scopes" in error_msg.lower():
-                return {
-                    'success': False,
-                    'error': 'Insufficient authentication scopes for Google Tasks',
-                    'task_data': data_item,
-                    'fix': 'Delete token.json and restart the application to re-authenticate'
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f'Failed to create task: {error_msg}',
-                    'task_data': data_item
-                }
+            return self._error(data_item, e)
+
+    def create_tasks(self, data_items):
+        """
+        Creates all tasks in Google batch HTTP requests instead of a round trip per task.
+        Returns a result per item, in order.
+        """
+        if not self._ensure_service():
+            return [self._unavailable(data_item) for data_item in data_items]
 
-# Initialize the service
-tasks_service = GoogleTasksService()
+        try:
+            responses = execute_batch(
+                self.service,
+                [self._insert_request(data_item) for data_item in data_items],
+                TASKS_BATCH_PATH
+            )
+        except Exception as e:
+            return [self._error(data_item, e) for data_item in data_items]
 
+        return [
+            self._error(data_item, exception) if exception else self._result(response)
+            for data_item, (response, exception) in zip(data_items, responses)
+        ]
+
+# Initialized on first use, not at import time
+tasks_service = Lazy(GoogleTasksService)
+
+@timed_connector("create_google_task")
 def create_google_task(data_item):
-    return tasks_service.create_task(data_item)
\ No newline at end of file
+    return tasks_service.get().create_task(data_item)
+
+@timed_connector("create_google_tasks")
+def create_google_tasks(data_items):
+    return tasks_service.get().create_tasks(data_items)
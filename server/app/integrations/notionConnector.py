@@ -1,19 +1,110 @@
 import os
+import re
+import json
+import logging
 from notion_client import Client
+from notion_client.client import RetryOptions
+from ..lazy import Lazy
+from ..metrics import timed_connector
 
 NOTION_API_KEY = os.getenv("NOTION_API_KEY")
+NOTION_BASE_URL = os.getenv("NOTION_BASE_URL", "https://api.notion.com")
+# Notion API limits: characters per rich_text item, rich_text items per block,
+# blocks per request and request payload size
+NOTION_TEXT_LIMIT = 2000
+NOTION_RICH_TEXT_ITEMS = 100
+NOTION_BLOCKS_PER_REQUEST = int(os.getenv("NOTION_BLOCKS_PER_REQUEST", "100"))
+NOTION_MAX_REQUEST_BYTES = int(os.getenv("NOTION_MAX_REQUEST_BYTES", str(400 * 1024)))
+# The SDK retries rate limited (429) requests, backing off exponentially unless Notion sends Retry-After
+NOTION_MAX_RETRIES = int(os.getenv("NOTION_MAX_RETRIES", "5"))
+NOTION_RETRY_BASE_DELAY = float(os.getenv("NOTION_RETRY_BASE_DELAY", "1.0"))
 
-notion = Client(auth=NOTION_API_KEY)
+# Dash lists, as the extraction prompt asks for in notes and shopping lists
+BULLET_PATTERN = re.compile(r"^\s*[-*•]\s+(.*)$")
 
+notion = Lazy(lambda: Client(
+    auth=NOTION_API_KEY,
+    base_url=NOTION_BASE_URL,
+    retry=RetryOptions(max_retries=NOTION_MAX_RETRIES, initial_retry_delay_ms=int(NOTION_RETRY_BASE_DELAY * 1000))
+))
+
+def _text_length(text: str):
+    # Notion counts UTF-16 code units
+    return len(text.encode("utf-16-le")) // 2
+
+def split_text(text: str, limit: int = NOTION_TEXT_LIMIT):
+    """
+    Splits text into pieces of at most `limit` characters, at whitespace where possible.
+    """
+    pieces = []
+    while _text_length(text) > limit:
+        candidate = text[:limit]
+        while _text_length(candidate) > limit:
+            candidate = candidate[:-1]
+        cut = candidate.rfind(" ") + 1
+        if cut <= len(candidate) // 2:
+            cut = len(candidate)
+        pieces.append(text[:cut])
+        text = text[cut:]
+    if text:
+        pieces.append(text)
+    return pieces
+
+def build_blocks(content: str):
+    """
+    One block per non-empty line: dash list items become bulleted list items, other
+    lines paragraphs. Long lines are split into several rich_text items, or blocks.
+    """
+    blocks = []
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        match = BULLET_PATTERN.match(line)
+        block_type = "bulleted_list_item" if match else "paragraph"
+        pieces = split_text(match.group(1) if match else line.strip())
+        for start in range(0, len(pieces), NOTION_RICH_TEXT_ITEMS):
+            blocks.append({
+                "object": "block",
+                "type": block_type,
+                block_type: {
+                    "rich_text": [
+                        {"type": "text", "text": {"content": piece}}
+                        for piece in pieces[start:start + NOTION_RICH_TEXT_ITEMS]
+                    ]
+                }
+            })
+    return blocks
+
+def batch_blocks(blocks):
+    """
+    Groups blocks into requests within the block count and payload size limits.
+    """
+    batches, batch, batch_bytes = [], [], 0
+    for block in blocks:
+        size = len(json.dumps(block, ensure_ascii=False).encode("utf-8"))
+        if batch and (len(batch) >= NOTION_BLOCKS_PER_REQUEST or batch_bytes + size > NOTION_MAX_REQUEST_BYTES):
+            batches.append(batch)
+            batch, batch_bytes = [], 0
+        batch.append(block)
+        batch_bytes += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+@timed_connector("create_notion_page")
 def create_notion_page(data: dict, parent_id: str):
     """
     Accepts structured data and creates a regular Notion page using the official Notion SDK.
     `data` should contain at least 'title' and optionally 'content'.
+    Content beyond the first request's blocks is appended in order, batch by batch;
+    if that fails, the incomplete page is archived and the error raised.
     """
     title = data.get("title", "Untitled")
     content = data.get("content", "")
+    client = notion.get()
+    batches = batch_blocks(build_blocks(content))
 
-    result = notion.pages.create(
+    result = client.pages.create(
         parent={"type": "page_id", "page_id": parent_id},
         properties={
             "title": [
@@ -23,23 +114,23 @@ def create_notion_page(data: dict, parent_id: str):
                 }
             ]
         },
-        children=[
-            {
-                "object": "block",
-                "type": "paragraph",
-                "paragraph": {
-                    "rich_text": [
-                        {
-                            "type": "text",
-                            "text": {"content": content}
-                        }
-                    ]
-                }
-            }
-        ]
+        children=batches[0] if batches else []
     )
+
+    try:
+        # Appends to one parent are ordered, so the remaining batches go one after another
+        for batch in batches[1:]:
+            client.blocks.children.append(block_id=result["id"], children=batch)
+    except Exception as e:
+        logging.error(f"Could not append content to Notion page {result.get('url')}: {e}")
+        try:
+            client.pages.update(page_id=result["id"], archived=True)
+        except Exception as archive_error:
+            logging.error(f"Could not archive incomplete Notion page {result.get('url')}: {archive_error}")
+        raise
+
     return {
         'success': True,
         'url': result.get('url'),
         'page_data': result
-    }
\ No newline at end of file
+    }
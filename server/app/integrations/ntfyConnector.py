@@ -1,10 +1,20 @@
 
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from ..metrics import timed_connector
 
 NTFY_CHANNEL = os.getenv("NTFY_CHANNEL")
-NTFY_URL = f"https://ntfy.sh/{NTFY_CHANNEL}"
+NTFY_SERVER = os.getenv("NTFY_SERVER", "https://ntfy.sh")
+NTFY_URL = f"{NTFY_SERVER.rstrip('/')}/{NTFY_CHANNEL}"
+NTFY_TIMEOUT = float(os.getenv("NTFY_TIMEOUT", "10"))
 
+# One pooled session for all notifications, so connections to ntfy are reused
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+session.mount("https://", HTTPAdapter(pool_connections=1, pool_maxsize=4))
+
+@timed_connector("send_ntfy_notification")
 def send_ntfy_notification(message: str, title: str = None, tags: list = None, actions: list = None):
     """
     Sends a notification to ntfy.sh channel.
@@ -23,5 +33,5 @@ def send_ntfy_notification(message: str, title: str = None, tags: list = None, a
     if actions:
         headers["Actions"] = "; ".join(actions).encode('utf-8')
 
-    response = requests.post(NTFY_URL, data=message.encode('utf-8'), headers=headers)
+    response = session.post(NTFY_URL, data=message.encode('utf-8'), headers=headers, timeout=NTFY_TIMEOUT)
     return response
@@ -0,0 +1,192 @@
+import os
+import json
+import time
+import uuid
+import queue
+import sqlite3
+import logging
+import threading
+
+JOBS_DB_PATH = os.getenv("JOBS_DB_PATH", "jobs.db")
+JOBS_MAX_WORKERS = int(os.getenv("JOBS_MAX_WORKERS", "2"))
+JOBS_MAX_PENDING = int(os.getenv("JOBS_MAX_PENDING", "50"))
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobStore:
+    """
+    SQLite-backed job state. The payload and the progress of its stages are kept
+    only until the job finishes, so unfinished jobs can be resumed after a restart.
+    """
+
+    def __init__(self, path=JOBS_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                status TEXT NOT NULL,
+                stage TEXT,
+                payload BLOB,
+                progress TEXT,
+                result TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        columns = [row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")]
+        if "progress" not in columns:
+            # Databases created before stage progress was kept
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN progress TEXT")
+        self._conn.commit()
+
+    def create(self, kind: str, payload: bytes):
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (id, kind, status, stage, payload, created_at, updated_at) VALUES (?, ?, 'queued', 'queued', ?, ?, ?)",
+                (job_id, kind, payload, now, now)
+            )
+            self._conn.commit()
+        return job_id
+
+    def update(self, job_id: str, **fields):
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+            self._conn.commit()
+
+    def get(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, kind, status, stage, result, error, created_at, updated_at FROM jobs WHERE id = ?",
+                (job_id,)
+            ).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "kind": row[1],
+            "status": row[2],
+            "stage": row[3],
+            "result": json.loads(row[4]) if row[4] else None,
+            "error": row[5],
+            "created_at": row[6],
+            "updated_at": row[7]
+        }
+
+    def load_payload(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT kind, payload FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return row
+
+    def load_progress(self, job_id: str):
+        with self._lock:
+            row = self._conn.execute("SELECT progress FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row and row[0] else {}
+
+    def unfinished(self):
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id FROM jobs WHERE status IN ('queued', 'running') ORDER BY created_at"
+            ).fetchall()
+        return [row[0] for row in rows]
+
+
+class JobProgress:
+    """
+    Results of the stages a job has completed, by stage name. A resumed job reads them
+    back and skips those stages instead of repeating their writes.
+    """
+
+    def __init__(self, store: JobStore, job_id: str):
+        self.store = store
+        self.job_id = job_id
+        self._stages = store.load_progress(job_id)
+
+    def get(self, stage: str, default=None):
+        return self._stages.get(stage, default)
+
+    def save(self, stage: str, result):
+        self._stages[stage] = result
+        self.store.update(self.job_id, progress=json.dumps(self._stages, ensure_ascii=False, default=str))
+
+
+class JobQueue:
+    def __init__(self, store: JobStore, handlers: dict, max_workers=JOBS_MAX_WORKERS, max_pending=JOBS_MAX_PENDING):
+        self.store = store
+        self.handlers = handlers
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self._queue = queue.Queue()
+        self._workers = []
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts the worker threads and re-enqueues jobs left unfinished by a previous run.
+        """
+        with self._start_lock:
+            if self._workers:
+                return
+            for job_id in self.store.unfinished():
+                logging.debug(f"Resuming job {job_id}.")
+                self.store.update(job_id, status="queued", stage="queued")
+                self._queue.put(job_id)
+            for i in range(self.max_workers):
+                worker = threading.Thread(target=self._work, name=f"job-worker-{i}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, kind: str, payload: bytes):
+        if kind not in self.handlers:
+            raise ValueError(f"Unknown job kind: {kind}")
+        if self._queue.qsize() >= self.max_pending:
+            raise JobQueueFull("Too many pending jobs")
+        self.start()
+        job_id = self.store.create(kind, payload)
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id: str):
+        return self.store.get(job_id)
+
+    def _work(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            finally:
+                self._queue.task_done()
+
+    def _run(self, job_id: str):
+        row = self.store.load_payload(job_id)
+        if not row:
+            return
+        kind, payload = row
+        self.store.update(job_id, status="running", stage="started")
+        try:
+            result = self.handlers[kind](
+                payload,
+                on_stage=lambda stage: self.store.update(job_id, stage=stage),
+                progress=JobProgress(self.store, job_id)
+            )
+            self.store.update(
+                job_id, status="done", stage="done", result=json.dumps(result, ensure_ascii=False, default=str),
+                payload=None, progress=None
+            )
+            logging.debug(f"Job {job_id} finished.")
+        except Exception as e:
+            logging.error(f"Job {job_id} failed: {e}")
+            self.store.update(job_id, status="failed", stage="failed", error=str(e), payload=None, progress=None)
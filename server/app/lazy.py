@@ -0,0 +1,27 @@
+import threading
+
+
+class Lazy:
+    """
+    Creates a value with `factory` on first use and reuses it afterwards.
+    Thread-safe; if the factory raises, nothing is cached and the next call retries.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._lock = threading.Lock()
+        self._initialized = False
+        self._value = None
+
+    @property
+    def initialized(self):
+        return self._initialized
+
+    def get(self):
+        if self._initialized:
+            return self._value
+        with self._lock:
+            if not self._initialized:
+                self._value = self._factory()
+                self._initialized = True
+        return self._value
@@ -0,0 +1,179 @@
+import os
+import re
+import logging
+import tempfile
+import subprocess
+from difflib import SequenceMatcher
+from concurrent.futures import ThreadPoolExecutor
+
+LONG_AUDIO_ENABLED = os.getenv("LONG_AUDIO_ENABLED", "false").lower() == "true"
+# Uploads above this size are split (about 3 minutes of AMR audio from a phone)
+LONG_AUDIO_MIN_BYTES = int(os.getenv("LONG_AUDIO_MIN_BYTES", str(256 * 1024)))
+LONG_AUDIO_SEGMENT_SECONDS = float(os.getenv("LONG_AUDIO_SEGMENT_SECONDS", "120"))
+# Consecutive segments share this much audio, so no word is lost at a cut
+LONG_AUDIO_OVERLAP_SECONDS = float(os.getenv("LONG_AUDIO_OVERLAP_SECONDS", "5"))
+# Segment transcriptions in flight, shared by all requests
+LONG_AUDIO_CONCURRENCY = int(os.getenv("LONG_AUDIO_CONCURRENCY", "4"))
+FFMPEG_PATH = os.getenv("FFMPEG_PATH", "ffmpeg")
+
+DURATION_PATTERN = re.compile(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)")
+WORD_PATTERN = re.compile(r"\S+")
+# Fewer matching words than this at a seam are taken as chance, not as the overlap
+MIN_OVERLAP_WORDS = 3
+
+
+class SegmentationError(Exception):
+    pass
+
+
+class AudioSegment:
+    """
+    A part of a recording, `start` and `end` in seconds from its beginning.
+    """
+
+    def __init__(self, index: int, start: float, end: float, data: bytes = None):
+        self.index = index
+        self.start = start
+        self.end = end
+        self.data = data
+
+    @property
+    def duration(self):
+        return self.end - self.start
+
+
+def plan_segments(duration: float, segment_seconds=LONG_AUDIO_SEGMENT_SECONDS, overlap_seconds=LONG_AUDIO_OVERLAP_SECONDS):
+    """
+    (start, end) of overlapping segments covering `duration`; a short remainder is
+    added to the last segment instead of becoming a segment of its own.
+    """
+    step = segment_seconds - overlap_seconds
+    if step <= 0:
+        raise ValueError("Segments must be longer than their overlap")
+    bounds = []
+    start = 0.0
+    while True:
+        end = start + segment_seconds
+        if duration - end < segment_seconds / 4:
+            bounds.append((start, duration))
+            return bounds
+        bounds.append((start, end))
+        start += step
+
+
+def _normalize(word: str):
+    return re.sub(r"\W+", "", word.lower())
+
+
+def merge_overlap(left: str, right: str, window: int):
+    """
+    Joins two transcriptions of overlapping audio. The longest run of matching words
+    between the end of `left` and the beginning of `right` (ignoring case and punctuation)
+    is the overlap: `left` is cut where it starts and `right` continues from there, which
+    also drops words cut in half at either edge. Whitespace, e.g. line breaks between
+    speakers, is kept.
+    """
+    left_words = list(WORD_PATTERN.finditer(left))
+    right_words = list(WORD_PATTERN.finditer(right))
+    if not left_words or not right_words:
+        return (left + " " + right).strip()
+    tail = left_words[-window:]
+    head = right_words[:window]
+    matcher = SequenceMatcher(
+        None, [_normalize(word.group()) for word in tail], [_normalize(word.group()) for word in head], autojunk=False
+    )
+    match = matcher.find_longest_match(0, len(tail), 0, len(head))
+    if match.size < MIN_OVERLAP_WORDS:
+        logging.debug("No overlap found between transcription segments, joining them as they are.")
+        return left.rstrip() + " " + right.lstrip()
+    return left[:tail[match.a].start()] + right[head[match.b].start():]
+
+
+def stitch(texts, overlap_seconds=LONG_AUDIO_OVERLAP_SECONDS):
+    # Fast speech is around 3 words per second; the window leaves room for words cut at the edges
+    window = int(overlap_seconds * 4) + 10
+    stitched = ""
+    for text in texts:
+        text = (text or "").strip()
+        if text:
+            stitched = merge_overlap(stitched, text, window) if stitched else text
+    return stitched
+
+
+class ChunkedTranscriber:
+    """
+    Transcribes long recordings in overlapping segments, cut with ffmpeg (stream copy,
+    no re-encoding) and transcribed concurrently by `transcribe(segment, prompt)`, which
+    returns the segment's text. Gemini in the server, a fake in benchmarks.
+    """
+
+    def __init__(self, transcribe, segment_seconds=LONG_AUDIO_SEGMENT_SECONDS, overlap_seconds=LONG_AUDIO_OVERLAP_SECONDS,
+                 max_workers=LONG_AUDIO_CONCURRENCY, ffmpeg=FFMPEG_PATH):
+        self.transcribe_segment = transcribe
+        self.segment_seconds = segment_seconds
+        self.overlap_seconds = overlap_seconds
+        self.ffmpeg = ffmpeg
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="transcribe")
+
+    def duration(self, path: str):
+        # ffmpeg without an output prints the input's duration and exits with an error
+        try:
+            result = subprocess.run([self.ffmpeg, "-hide_banner", "-i", path], capture_output=True, text=True)
+        except OSError as e:
+            raise SegmentationError(f"Could not run ffmpeg: {e}") from e
+        match = DURATION_PATTERN.search(result.stderr)
+        if not match:
+            raise SegmentationError(f"Could not read the duration of the recording: {result.stderr.strip()[-200:]}")
+        hours, minutes, seconds = match.groups()
+        return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+    def cut(self, path: str, segment: AudioSegment):
+        with tempfile.TemporaryDirectory() as directory:
+            output = os.path.join(directory, f"segment-{segment.index}.3gp")
+            try:
+                subprocess.run(
+                    [self.ffmpeg, "-v", "error", "-ss", f"{segment.start:.3f}", "-t", f"{segment.duration:.3f}",
+                     "-i", path, "-c", "copy", "-f", "3gp", output],
+                    capture_output=True, text=True, check=True
+                )
+                with open(output, "rb") as f:
+                    return f.read()
+            except subprocess.CalledProcessError as e:
+                raise SegmentationError(f"Could not cut segment {segment.index}: {e.stderr.strip()[-200:]}") from e
+            except OSError as e:
+                raise SegmentationError(f"Could not cut segment {segment.index}: {e}") from e
+
+    def _segment_text(self, path: str, segment: AudioSegment, prompt: str):
+        segment.data = self.cut(path, segment)
+        return self.transcribe_segment(segment, prompt)
+
+    def transcribe_file(self, path: str, prompt: str, on_progress=None):
+        segments = [
+            AudioSegment(index, start, end)
+            for index, (start, end) in enumerate(plan_segments(self.duration(path), self.segment_seconds, self.overlap_seconds))
+        ]
+        logging.debug(f"Transcribing {segments[-1].end:.0f}s of audio in {len(segments)} segments.")
+        futures = [self._executor.submit(self._segment_text, path, segment, prompt) for segment in segments]
+        texts = []
+        try:
+            for segment, future in zip(segments, futures):
+                texts.append(future.result())
+                if on_progress:
+                    on_progress("transcription_segment", {
+                        "index": segment.index, "segments": len(segments), "start": segment.start, "end": segment.end
+                    })
+        finally:
+            for future in futures:
+                future.cancel()
+        return stitch(texts, self.overlap_seconds)
+
+    def transcribe(self, upload, prompt: str, on_progress=None):
+        """
+        `upload` is an AudioUpload; one kept in memory is written to a temporary file for ffmpeg.
+        """
+        if not upload.in_memory:
+            return self.transcribe_file(upload.path, prompt, on_progress)
+        with tempfile.NamedTemporaryFile(suffix=".3gp") as f:
+            f.write(upload.getvalue())
+            f.flush()
+            return self.transcribe_file(f.name, prompt, on_progress)
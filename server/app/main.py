@@ -1,13 +1,30 @@
+import time
+import asyncio
+import imaplib
 import logging
-from fastapi import Body, FastAPI, Depends, HTTPException, Request, APIRouter
+from fastapi import Body, FastAPI, Depends, HTTPException, Request, APIRouter, Query
+from fastapi.responses import JSONResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 
 load_dotenv()
 
-from .processing import process_text_and_get_response
-from .audio import process_audio
+from .processing import process_text_and_get_response, process_batch_text, BATCH_MAX_MESSAGES, outbox
+from .outbox import OUTBOX_ENABLED
+from .prompts import extraction_cache
+from .audio import process_audio, process_audio_async, transcription_cache, audio_response_cache, audio_executor
 from .auth import verify_token
+from .jobs import JobQueue, JobStore, JobQueueFull
+from .uploads import receive_audio
+from .warmup import WARMUP_ON_STARTUP, start_background_warmup
+from .metrics import request_duration, render_metrics, METRICS_PUBLIC
+from .model_router import model_router
+from .auth_manager import auth_manager, GOOGLE_TOKEN_RENEWAL
+from .admission import admission, admission_controller
+from .streaming import ProgressStream
+from .search_index import search_index, SEARCH_INDEX_ENABLED
+from .mirror import mirror, parse_time, MIRROR_ENABLED
+from .email_ingest import email_ingestor, EMAIL_INGEST_ENABLED
 
 logging.basicConfig(level=logging.DEBUG, format='%(asctime)s - %(levelname)s - %(message)s')
 
@@ -22,12 +39,101 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.middleware("http")
+async def record_request_duration(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Label by route template, not by raw path, to keep the number of series bounded
+        route = request.scope.get("route")
+        request_duration.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=route.path if route else "unmatched",
+            status=status
+        )
+
+@app.get("/metrics", response_class=PlainTextResponse, dependencies=[] if METRICS_PUBLIC else [Depends(verify_token)])
+def metrics_endpoint():
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4")
+
+job_queue = JobQueue(JobStore(), {"audio": process_audio})
+
+@app.on_event("startup")
+def start_job_workers():
+    job_queue.start()
+
+@app.on_event("startup")
+def start_outbox_workers():
+    # Delivers writes left in the outbox by a previous run
+    if OUTBOX_ENABLED:
+        outbox.get().start()
+
+@app.on_event("startup")
+def start_mirror_sync():
+    if MIRROR_ENABLED:
+        mirror.get().start()
+
+@app.on_event("startup")
+def start_email_ingest():
+    if EMAIL_INGEST_ENABLED:
+        email_ingestor.get().start()
+
+@app.on_event("startup")
+def start_token_renewer():
+    if GOOGLE_TOKEN_RENEWAL:
+        auth_manager.start_renewer()
+
+@app.on_event("startup")
+def start_warmup():
+    if WARMUP_ON_STARTUP:
+        start_background_warmup()
+
+def submit_audio_job(audio_bytes: bytes):
+    try:
+        job_id = job_queue.submit("audio", audio_bytes)
+    except JobQueueFull as e:
+        logging.error(f"Could not queue audio job: {e}")
+        raise HTTPException(status_code=503, detail=str(e))
+    logging.debug(f"Queued audio job {job_id}.")
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job_id, "status": "queued", "status_url": f"/assistant/jobs/{job_id}"}
+    )
+
+async def stream_processing(lane: str, executor, func, *args, cleanup=None):
+    """
+    Runs `func` in the background and returns its progress as server-sent events.
+    The admission slot is held until the processing finishes, even if the client disconnects.
+    """
+    try:
+        admitted = await admission_controller.admit(lane)
+    except HTTPException:
+        if cleanup:
+            cleanup()
+        raise
+    started = time.monotonic()
+
+    def finished():
+        if admitted:
+            admission_controller.release(lane, time.monotonic() - started)
+        if cleanup:
+            cleanup()
+
+    stream = ProgressStream(asyncio.get_running_loop())
+    stream.run(executor, func, *args, on_finished=finished)
+    return stream.response()
+
 assistant_router = APIRouter(
     prefix="/assistant",
     dependencies=[Depends(verify_token)]
 )
 
-@assistant_router.post("/text-command")
+@assistant_router.post("/text-command", dependencies=[Depends(admission("text"))])
 def assistant_text_command_endpoint(
     body: dict = Body(...)
 ):
@@ -45,9 +151,45 @@ def assistant_text_command_endpoint(
         logging.error(f"Error processing message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
-@assistant_router.post("/audio-command")
+@assistant_router.post("/text-command/stream")
+async def assistant_text_command_stream_endpoint(
+    body: dict = Body(...)
+):
+    logging.debug("Received new message for streamed processing.")
+    message = body.get("message")
+    if not message:
+        logging.error("Missing 'message' in request body")
+        raise HTTPException(status_code=400, detail="Missing 'message' in request body")
+    return await stream_processing("text", None, process_text_and_get_response, message)
+
+@assistant_router.post("/batch-text-command", dependencies=[Depends(admission("text"))])
+def assistant_batch_text_command_endpoint(
+    body: dict = Body(...)
+):
+    messages = body.get("messages")
+    logging.debug(f"Received batch of {len(messages) if isinstance(messages, list) else 0} messages for processing.")
+    if not isinstance(messages, list) or not messages:
+        logging.error("Missing 'messages' in request body")
+        raise HTTPException(status_code=400, detail="Missing 'messages' in request body")
+    if not all(isinstance(message, str) and message.strip() for message in messages):
+        logging.error("Invalid 'messages' in request body")
+        raise HTTPException(status_code=400, detail="Every entry of 'messages' must be a non-empty string")
+    if len(messages) > BATCH_MAX_MESSAGES:
+        logging.error(f"Batch of {len(messages)} messages is too large")
+        raise HTTPException(status_code=413, detail=f"Too many messages. Maximum is {BATCH_MAX_MESSAGES} per batch.")
+
+    try:
+        response_data = process_batch_text(messages)
+        logging.debug("Finished processing batch.")
+        return {"success": True, **response_data}
+    except ValueError as e:
+        logging.error(f"Error processing batch: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@assistant_router.post("/audio-command", dependencies=[Depends(admission("audio", concurrency=False))])
 async def assistant_audio_command_endpoint(
-    request: Request
+    request: Request,
+    mode: str = Query(None)
 ):
     logging.debug("Received new audio file for processing.")
     content_type = request.headers.get('content-type')
@@ -55,40 +197,211 @@ async def assistant_audio_command_endpoint(
         logging.error(f"Invalid content type: {content_type}")
         raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}. Only audio/3gpp is accepted.")
 
-    audio_bytes = await request.body()
-
-    if len(audio_bytes) > 500 * 1024:
-        logging.error("Audio file is too large")
-        raise HTTPException(status_code=413, detail="Audio file is too large. Maximum size is 500KB (~5 minutes).")
+    upload = await receive_audio(
+        request,
+        max_bytes=500 * 1024,
+        too_large_detail="Audio file is too large. Maximum size is 500KB (~5 minutes)."
+    )
 
     try:
-        response_data = process_audio(audio_bytes)
+        if mode == "job":
+            return submit_audio_job(upload.getvalue())
+
+        # The slot is taken only now that the upload has been read
+        async with admission_controller.slot("audio"):
+            response_data = await process_audio_async(upload)
         return response_data
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing audio: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing audio: {e}")
+    finally:
+        upload.close()
 
-@assistant_router.post("/audio-conversation")
-async def assistant_audio_conversation_endpoint(
+@assistant_router.post("/audio-command/stream")
+async def assistant_audio_command_stream_endpoint(
     request: Request
 ):
-    logging.debug("Received new audio file for processing.")
+    logging.debug("Received new audio file for streamed processing.")
     content_type = request.headers.get('content-type')
     if not content_type == "audio/3gpp":
         logging.error(f"Invalid content type: {content_type}")
         raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}. Only audio/3gpp is accepted.")
 
-    audio_bytes = await request.body()
+    upload = await receive_audio(
+        request,
+        max_bytes=500 * 1024,
+        too_large_detail="Audio file is too large. Maximum size is 500KB (~5 minutes)."
+    )
+    return await stream_processing("audio", audio_executor, process_audio, upload, cleanup=upload.close)
+
+@assistant_router.post("/audio-conversation", dependencies=[Depends(admission("audio", concurrency=False))])
+async def assistant_audio_conversation_endpoint(
+    request: Request,
+    mode: str = Query(None)
+):
+    logging.debug("Received new audio file for processing.")
+    content_type = request.headers.get('content-type')
+    if not content_type == "audio/3gpp":
+        logging.error(f"Invalid content type: {content_type}")
+        raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}. Only audio/3gpp is accepted.")
 
-    if len(audio_bytes) > 3 * 1024 * 1024:
-        logging.error("Audio file is too large")
-        raise HTTPException(status_code=413, detail="Audio file is too large. Maximum size is 3MB (~30 minutes).")
+    upload = await receive_audio(
+        request,
+        max_bytes=3 * 1024 * 1024,
+        too_large_detail="Audio file is too large. Maximum size is 3MB (~30 minutes)."
+    )
 
     try:
-        response_data = process_audio(audio_bytes)
+        if mode == "job":
+            return submit_audio_job(upload.getvalue())
+
+        # The slot is taken only now that the upload has been read
+        async with admission_controller.slot("audio"):
+            response_data = await process_audio_async(upload)
         return response_data
+    except HTTPException:
+        raise
     except Exception as e:
         logging.error(f"Error processing audio: {e}")
         raise HTTPException(status_code=500, detail=f"Error processing audio: {e}")
+    finally:
+        upload.close()
+
+@assistant_router.post("/audio-conversation/stream")
+async def assistant_audio_conversation_stream_endpoint(
+    request: Request
+):
+    logging.debug("Received new audio file for streamed processing.")
+    content_type = request.headers.get('content-type')
+    if not content_type == "audio/3gpp":
+        logging.error(f"Invalid content type: {content_type}")
+        raise HTTPException(status_code=400, detail=f"Invalid content type: {content_type}. Only audio/3gpp is accepted.")
+
+    upload = await receive_audio(
+        request,
+        max_bytes=3 * 1024 * 1024,
+        too_large_detail="Audio file is too large. Maximum size is 3MB (~30 minutes)."
+    )
+    return await stream_processing("audio", audio_executor, process_audio, upload, cleanup=upload.close)
+
+@assistant_router.get("/jobs/{job_id}")
+def assistant_job_status_endpoint(job_id: str):
+    job = job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@assistant_router.get("/cache")
+def assistant_cache_stats_endpoint():
+    return {
+        "extraction": extraction_cache.stats(),
+        "transcription": transcription_cache.stats(),
+        "audio_response": audio_response_cache.stats()
+    }
+
+@assistant_router.get("/outbox")
+def assistant_outbox_endpoint(limit: int = Query(100)):
+    if not OUTBOX_ENABLED:
+        return {"enabled": False}
+    return {"enabled": True, **outbox.get().snapshot(limit)}
+
+@assistant_router.post("/outbox/{item_id}/retry")
+def assistant_outbox_retry_endpoint(item_id: str):
+    if not OUTBOX_ENABLED:
+        raise HTTPException(status_code=404, detail="Outbox is disabled")
+    item = outbox.get().retry(item_id)
+    if not item:
+        raise HTTPException(status_code=404, detail="No failed outbox item with this id")
+    return item
+
+@assistant_router.get("/search")
+def assistant_search_endpoint(
+    q: str = Query(..., min_length=1),
+    k: int = Query(10, ge=1, le=100),
+    item_type: str = Query(None, alias="type"),
+    exact: bool = Query(False)
+):
+    if not SEARCH_INDEX_ENABLED:
+        raise HTTPException(status_code=404, detail="Search index is disabled")
+    index = search_index.get()
+    return {"query": q, **index.search(q, k=k, item_type=item_type, exact=exact), "index": index.stats()}
+
+def _mirror():
+    if not MIRROR_ENABLED:
+        raise HTTPException(status_code=404, detail="Calendar and Tasks mirror is disabled")
+    return mirror.get()
+
+def _mirror_time(value: str, name: str):
+    if value is None:
+        return None
+    try:
+        return parse_time(value)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid '{name}', expected an ISO date or date and time")
+
+@assistant_router.get("/mirror")
+def assistant_mirror_endpoint():
+    return _mirror().snapshot()
+
+@assistant_router.post("/mirror/sync")
+def assistant_mirror_sync_endpoint():
+    return _mirror().sync()
+
+@assistant_router.get("/mirror/events")
+def assistant_mirror_events_endpoint(
+    start: str = Query(None),
+    end: str = Query(None),
+    q: str = Query(None),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    store = _mirror().store
+    start_ts, end_ts = _mirror_time(start, "start"), _mirror_time(end, "end")
+    if q:
+        return {"events": store.search_events(q, start_ts, end_ts, limit)}
+    if start_ts is None or end_ts is None:
+        raise HTTPException(status_code=400, detail="Either 'q' or both 'start' and 'end' are required")
+    return {"events": store.events_between(start_ts, end_ts, limit)}
+
+@assistant_router.get("/mirror/tasks")
+def assistant_mirror_tasks_endpoint(
+    due_after: str = Query(None),
+    due_before: str = Query(None),
+    q: str = Query(None),
+    include_completed: bool = Query(False),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    store = _mirror().store
+    if q:
+        return {"tasks": store.search_tasks(q, include_completed, limit)}
+    return {"tasks": store.tasks_due_between(
+        _mirror_time(due_after, "due_after"), _mirror_time(due_before, "due_before"), include_completed, limit
+    )}
+
+def _email_ingestor():
+    if not EMAIL_INGEST_ENABLED:
+        raise HTTPException(status_code=404, detail="Email ingestion is disabled")
+    return email_ingestor.get()
+
+@assistant_router.get("/email")
+def assistant_email_endpoint():
+    return _email_ingestor().snapshot()
+
+@assistant_router.post("/email/poll")
+def assistant_email_poll_endpoint():
+    try:
+        return _email_ingestor().poll()
+    except (OSError, imaplib.IMAP4.error, RuntimeError) as e:
+        logging.error(f"Could not poll mailbox: {e}")
+        raise HTTPException(status_code=502, detail=f"Could not poll mailbox: {e}")
+
+@assistant_router.get("/admission")
+def assistant_admission_endpoint():
+    return admission_controller.snapshot()
+
+@assistant_router.get("/model-router")
+def assistant_model_router_endpoint():
+    return model_router.snapshot()
 
 app.include_router(assistant_router)
\ No newline at end of file
@@ -0,0 +1,178 @@
+import os
+import time
+import bisect
+import threading
+import functools
+
+# /metrics takes the same x-auth token as the assistant endpoints unless this is set
+METRICS_PUBLIC = os.getenv("METRICS_PUBLIC", "false").lower() == "true"
+# Latency buckets in seconds, from cache hits to long audio transcriptions
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labelnames, values, extra=None):
+    pairs = list(zip(labelnames, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels.get(name, "") for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, (counts, total, count) in sorted(self._values.items()):
+                cumulative = 0
+                for bound, bucket_count in zip(self.buckets + ("+Inf",), counts):
+                    cumulative += bucket_count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, ('le', bound))} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {total}")
+                lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {count}")
+        return lines
+
+
+class _Timer:
+    def __init__(self, histogram, labels):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+        return False
+
+
+stage_duration = Histogram(
+    "assistant_stage_duration_seconds",
+    "Duration of model calls in the processing pipeline.",
+    ["stage"]
+)
+connector_duration = Histogram(
+    "assistant_connector_duration_seconds",
+    "Duration of calls to third-party connectors.",
+    ["connector"]
+)
+request_duration = Histogram(
+    "assistant_request_duration_seconds",
+    "Duration of HTTP requests by route.",
+    ["method", "route", "status"]
+)
+tokens_used = Counter(
+    "assistant_gemini_tokens_total",
+    "Gemini tokens used, as reported in total_tokens_used."
+)
+items_created = Counter(
+    "assistant_items_created_total",
+    "Items successfully created in integrations, by type.",
+    ["type"]
+)
+integration_errors = Counter(
+    "assistant_integration_errors_total",
+    "Failed connector calls, by connector.",
+    ["connector"]
+)
+
+REGISTRY = [stage_duration, connector_duration, request_duration, tokens_used, items_created, integration_errors]
+
+
+def render_metrics():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def timed_stage(stage):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with stage_duration.time(stage=stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _failures(result):
+    # Batch writers return one result per item
+    if isinstance(result, list):
+        return sum(_failures(item) for item in result)
+    if isinstance(result, dict):
+        return int(result.get("success") is False)
+    return int(getattr(result, "ok", True) is False)
+
+
+def timed_connector(connector):
+    """
+    Times a connector call and counts it as an error when it raises or
+    returns an unsuccessful result.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception:
+                integration_errors.inc(connector=connector)
+                raise
+            finally:
+                connector_duration.observe(time.perf_counter() - started, connector=connector)
+            failures = _failures(result)
+            if failures:
+                integration_errors.inc(failures, connector=connector)
+            return result
+        return wrapper
+    return decorator
@@ -0,0 +1,384 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo
+from .integrations.googleCalendarConnector import calendar_service, CALENDAR_ID, CALENDAR_TIMEZONE
+from .integrations.googleTasksConnector import tasks_service
+from .lazy import Lazy
+
+MIRROR_ENABLED = os.getenv("MIRROR_ENABLED", "false").lower() == "true"
+MIRROR_DB_PATH = os.getenv("MIRROR_DB_PATH", "mirror.db")
+# Seconds between background syncs; the server's own writes trigger one sooner
+MIRROR_SYNC_INTERVAL = float(os.getenv("MIRROR_SYNC_INTERVAL", "300"))
+# Delay of the sync following a write, so the writes of one command are picked up together
+MIRROR_SYNC_DELAY = float(os.getenv("MIRROR_SYNC_DELAY", "2"))
+# Results per page; the Tasks API returns at most 100
+MIRROR_CALENDAR_PAGE_SIZE = 2500
+MIRROR_TASKS_PAGE_SIZE = 100
+# Tasks have no sync token; updatedMin is moved back by this many seconds to allow for clock skew
+MIRROR_TASKS_OVERLAP = timedelta(seconds=float(os.getenv("MIRROR_TASKS_OVERLAP", "300")))
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def _zone(name=None):
+    return ZoneInfo(name or CALENDAR_TIMEZONE)
+
+
+def parse_time(value: str):
+    """
+    ISO date or date and time to a UNIX timestamp; values without an offset are in CALENDAR_TIMEZONE.
+    """
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=_zone())
+    return parsed.timestamp()
+
+
+def event_time(value: dict):
+    # All-day events have a date, others a dateTime, with a time zone of their own
+    if not value:
+        return None
+    if value.get("dateTime"):
+        parsed = datetime.fromisoformat(value["dateTime"])
+        if parsed.tzinfo is None:
+            parsed = parsed.replace(tzinfo=_zone(value.get("timeZone")))
+        return parsed.timestamp()
+    if value.get("date"):
+        return datetime.fromisoformat(value["date"]).replace(tzinfo=_zone(value.get("timeZone"))).timestamp()
+    return None
+
+
+def task_due(value: str):
+    # Google keeps only the date of a due time (as midnight UTC), taken here as local midnight
+    if not value:
+        return None
+    return datetime.fromisoformat(value[:10]).replace(tzinfo=_zone()).timestamp()
+
+
+def match_query(text: str):
+    """
+    FTS5 query matching every word of `text` as a prefix, or None when it has no words.
+    """
+    words = WORD_PATTERN.findall(text)
+    return " ".join(f'"{word}"*' for word in words) if words else None
+
+
+def _status_code(e):
+    return getattr(getattr(e, "resp", None), "status", None)
+
+
+class MirrorStore:
+    """
+    SQLite (WAL) copy of calendar events and tasks, with time and full-text indexes.
+    Rows keep the API resource as returned by Google; full-text rows share the rowid of their item.
+    """
+
+    def __init__(self, path=MIRROR_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS events (
+                id TEXT PRIMARY KEY,
+                calendar_id TEXT NOT NULL,
+                summary TEXT,
+                start_ts REAL,
+                end_ts REAL,
+                status TEXT,
+                updated TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS events_start ON events (start_ts);
+            CREATE INDEX IF NOT EXISTS events_end ON events (end_ts);
+            CREATE TABLE IF NOT EXISTS tasks (
+                id TEXT PRIMARY KEY,
+                tasklist_id TEXT NOT NULL,
+                title TEXT,
+                due_ts REAL,
+                status TEXT,
+                updated TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS tasks_due ON tasks (due_ts);
+            CREATE INDEX IF NOT EXISTS tasks_list ON tasks (tasklist_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS events_fts USING fts5(summary, tokenize='unicode61 remove_diacritics 2');
+            CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(title, tokenize='unicode61 remove_diacritics 2');
+            CREATE TABLE IF NOT EXISTS sync_state (
+                resource TEXT PRIMARY KEY,
+                sync_token TEXT,
+                updated_min TEXT,
+                synced_at REAL
+            );
+        """)
+        self._conn.commit()
+        # Bounds time range queries, which then only scan events starting shortly before the range
+        self._longest_event = self._conn.execute("SELECT COALESCE(MAX(end_ts - start_ts), 0) FROM events").fetchone()[0]
+
+    def _delete(self, table: str, item_id: str):
+        row = self._conn.execute(f"SELECT rowid FROM {table} WHERE id = ?", (item_id,)).fetchone()
+        if row:
+            self._conn.execute(f"DELETE FROM {table}_fts WHERE rowid = ?", row)
+            self._conn.execute(f"DELETE FROM {table} WHERE rowid = ?", row)
+
+    def _clear(self, table: str, column: str, value: str):
+        self._conn.execute(f"DELETE FROM {table}_fts WHERE rowid IN (SELECT rowid FROM {table} WHERE {column} = ?)", (value,))
+        self._conn.execute(f"DELETE FROM {table} WHERE {column} = ?", (value,))
+
+    def apply_events(self, calendar_id: str, events, replace=False):
+        """
+        Stores fetched events; cancelled ones are removed. `replace` drops the calendar's
+        events first, for a full sync.
+        """
+        with self._lock, self._conn:
+            if replace:
+                self._clear("events", "calendar_id", calendar_id)
+            for event in events:
+                self._delete("events", event["id"])
+                if event.get("status") == "cancelled":
+                    continue
+                start, end = event_time(event.get("start")), event_time(event.get("end"))
+                cursor = self._conn.execute(
+                    "INSERT INTO events (id, calendar_id, summary, start_ts, end_ts, status, updated, data) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        event["id"], calendar_id, event.get("summary"), start, end,
+                        event.get("status"), event.get("updated"), json.dumps(event, ensure_ascii=False)
+                    )
+                )
+                self._conn.execute("INSERT INTO events_fts (rowid, summary) VALUES (?, ?)", (cursor.lastrowid, event.get("summary") or ""))
+                if start is not None and end is not None:
+                    self._longest_event = max(self._longest_event, end - start)
+
+    def apply_tasks(self, tasklist_id: str, tasks, replace=False):
+        with self._lock, self._conn:
+            if replace:
+                self._clear("tasks", "tasklist_id", tasklist_id)
+            for task in tasks:
+                self._delete("tasks", task["id"])
+                if task.get("deleted"):
+                    continue
+                cursor = self._conn.execute(
+                    "INSERT INTO tasks (id, tasklist_id, title, due_ts, status, updated, data) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        task["id"], tasklist_id, task.get("title"), task_due(task.get("due")),
+                        task.get("status"), task.get("updated"), json.dumps(task, ensure_ascii=False)
+                    )
+                )
+                self._conn.execute("INSERT INTO tasks_fts (rowid, title) VALUES (?, ?)", (cursor.lastrowid, task.get("title") or ""))
+
+    def remove_tasklists_except(self, tasklist_ids):
+        placeholders = ", ".join("?" for _ in tasklist_ids)
+        with self._lock, self._conn:
+            stale = [row[0] for row in self._conn.execute(
+                f"SELECT DISTINCT tasklist_id FROM tasks WHERE tasklist_id NOT IN ({placeholders})", tuple(tasklist_ids)
+            )]
+            for tasklist_id in stale:
+                self._clear("tasks", "tasklist_id", tasklist_id)
+                self._conn.execute("DELETE FROM sync_state WHERE resource = ?", (f"tasks:{tasklist_id}",))
+
+    def get_state(self, resource: str):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT sync_token, updated_min, synced_at FROM sync_state WHERE resource = ?", (resource,)
+            ).fetchone()
+        return dict(zip(("sync_token", "updated_min", "synced_at"), row)) if row else {}
+
+    def set_state(self, resource: str, sync_token=None, updated_min=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sync_state (resource, sync_token, updated_min, synced_at) VALUES (?, ?, ?, ?)",
+                (resource, sync_token, updated_min, time.time())
+            )
+
+    def _rows(self, sql, params):
+        with self._lock:
+            return [json.loads(row[0]) for row in self._conn.execute(sql, params)]
+
+    def events_between(self, start: float, end: float, limit: int = 100):
+        """
+        Events overlapping [start, end), by start time.
+        """
+        return self._rows(
+            "SELECT data FROM events WHERE start_ts >= ? AND start_ts < ? AND end_ts > ? ORDER BY start_ts LIMIT ?",
+            (start - self._longest_event, end, start, limit)
+        )
+
+    def search_events(self, text: str, start: float = None, end: float = None, limit: int = 100):
+        query = match_query(text)
+        if not query:
+            return []
+        return self._rows(
+            "SELECT e.data FROM events_fts f JOIN events e ON e.rowid = f.rowid WHERE events_fts MATCH ? "
+            "AND (? IS NULL OR e.end_ts > ?) AND (? IS NULL OR e.start_ts < ?) ORDER BY e.start_ts LIMIT ?",
+            (query, start, start, end, end, limit)
+        )
+
+    def tasks_due_between(self, start: float = None, end: float = None, include_completed=False, limit: int = 100):
+        return self._rows(
+            "SELECT data FROM tasks WHERE (? IS NULL OR due_ts >= ?) AND (? IS NULL OR due_ts < ?) "
+            "AND (? OR status != 'completed') ORDER BY due_ts IS NULL, due_ts LIMIT ?",
+            (start, start, end, end, include_completed, limit)
+        )
+
+    def search_tasks(self, text: str, include_completed=False, limit: int = 100):
+        query = match_query(text)
+        if not query:
+            return []
+        return self._rows(
+            "SELECT t.data FROM tasks_fts f JOIN tasks t ON t.rowid = f.rowid WHERE tasks_fts MATCH ? "
+            "AND (? OR t.status != 'completed') ORDER BY t.due_ts IS NULL, t.due_ts LIMIT ?",
+            (query, include_completed, limit)
+        )
+
+    def counts(self):
+        with self._lock:
+            return {
+                "events": self._conn.execute("SELECT COUNT(*) FROM events").fetchone()[0],
+                "tasks": self._conn.execute("SELECT COUNT(*) FROM tasks").fetchone()[0],
+                "sync_state": {
+                    row[0]: {"synced_at": row[1], "incremental": row[2]}
+                    for row in self._conn.execute(
+                        "SELECT resource, synced_at, sync_token IS NOT NULL OR updated_min IS NOT NULL FROM sync_state"
+                    )
+                }
+            }
+
+
+class GoogleMirror:
+    """
+    Keeps a MirrorStore in sync with Google: a full sync first, then only changes,
+    using the Calendar API's sync tokens and the Tasks API's updatedMin.
+    """
+
+    def __init__(self, store: MirrorStore, interval=MIRROR_SYNC_INTERVAL, delay=MIRROR_SYNC_DELAY):
+        self.store = store
+        self.interval = interval
+        self.delay = delay
+        self.last_sync = None
+        self._sync_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def _list_events(self, service, sync_token):
+        params = {"calendarId": CALENDAR_ID, "maxResults": MIRROR_CALENDAR_PAGE_SIZE, "singleEvents": True}
+        if sync_token:
+            params["syncToken"] = sync_token
+        events, page_token = [], None
+        while True:
+            response = service.events().list(pageToken=page_token, **params).execute()
+            events.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return events, response.get("nextSyncToken")
+
+    def sync_calendar(self):
+        resource = f"calendar:{CALENDAR_ID}"
+        service = calendar_service.get()
+        sync_token = self.store.get_state(resource).get("sync_token")
+        try:
+            events, next_token = self._list_events(service, sync_token)
+        except Exception as e:
+            # 410 Gone: the sync token expired, only a full sync can recover
+            if not sync_token or _status_code(e) != 410:
+                raise
+            logging.debug("Calendar sync token expired, running a full sync.")
+            sync_token = None
+            events, next_token = self._list_events(service, None)
+        self.store.apply_events(CALENDAR_ID, events, replace=not sync_token)
+        self.store.set_state(resource, sync_token=next_token)
+        return {"changes": len(events), "full": not sync_token}
+
+    def _list_tasks(self, service, tasklist_id, updated_min):
+        params = {"tasklist": tasklist_id, "maxResults": MIRROR_TASKS_PAGE_SIZE, "showCompleted": True, "showHidden": True}
+        if updated_min:
+            params.update(updatedMin=updated_min, showDeleted=True)
+        tasks, page_token = [], None
+        while True:
+            response = service.tasks().list(pageToken=page_token, **params).execute()
+            tasks.extend(response.get("items", []))
+            page_token = response.get("nextPageToken")
+            if not page_token:
+                return tasks
+
+    def sync_tasks(self):
+        google_tasks = tasks_service.get()
+        if not google_tasks._ensure_service():
+            raise RuntimeError("Tasks service not initialized")
+        service = google_tasks.service
+        tasklists = service.tasklists().list(maxResults=100).execute().get("items", [])
+        changes, full = 0, False
+        for tasklist in tasklists:
+            resource = f"tasks:{tasklist['id']}"
+            updated_min = self.store.get_state(resource).get("updated_min")
+            started = datetime.now(timezone.utc) - MIRROR_TASKS_OVERLAP
+            tasks = self._list_tasks(service, tasklist["id"], updated_min)
+            self.store.apply_tasks(tasklist["id"], tasks, replace=not updated_min)
+            self.store.set_state(resource, updated_min=started.isoformat(timespec="seconds").replace("+00:00", "Z"))
+            changes += len(tasks)
+            full = full or not updated_min
+        self.store.remove_tasklists_except([tasklist["id"] for tasklist in tasklists])
+        return {"changes": changes, "full": full, "tasklists": len(tasklists)}
+
+    def sync(self):
+        """
+        Syncs events and tasks; one sync runs at a time. Returns what changed.
+        """
+        with self._sync_lock:
+            started = time.perf_counter()
+            result = {}
+            for name, sync in (("calendar", self.sync_calendar), ("tasks", self.sync_tasks)):
+                try:
+                    result[name] = sync()
+                except Exception as e:
+                    logging.error(f"Could not sync {name} mirror: {e}")
+                    result[name] = {"error": str(e)}
+            result["duration_seconds"] = round(time.perf_counter() - started, 3)
+            self.last_sync = {"finished_at": time.time(), **result}
+            return result
+
+    def request_sync(self):
+        """
+        Asks the background thread for a sync soon, e.g. after the server created events or tasks.
+        """
+        self._wake.set()
+
+    def _run(self):
+        while True:
+            self.sync()
+            if self._wake.wait(self.interval):
+                # Writes often come in a burst, one sync covers them all
+                time.sleep(self.delay)
+                self._wake.clear()
+
+    def start(self):
+        """
+        Starts the background sync thread, beginning with a full sync on the first run.
+        """
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="google-mirror", daemon=True)
+        self._thread.start()
+
+    def snapshot(self):
+        return {**self.store.counts(), "last_sync": self.last_sync}
+
+
+# Created on first use, only when MIRROR_ENABLED
+mirror = Lazy(lambda: GoogleMirror(MirrorStore()))
+
+
+def request_mirror_sync(responses):
+    """
+    Schedules a sync when a command created events or tasks, so the mirror includes them.
+    """
+    if MIRROR_ENABLED and any(
+        response["type"] in ("google_task", "google_calendar") and (response.get("response") or {}).get("success")
+        for response in responses
+    ):
+        mirror.get().request_sync()
@@ -0,0 +1,140 @@
+import os
+import time
+import logging
+import threading
+import statistics
+from collections import deque
+from .classifier import classify_message
+
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "false").lower() == "true"
+GEMINI_STRONG_MODEL = os.getenv("GEMINI_STRONG_MODEL", os.getenv("LANGCHAIN_MODEL", "gemini-2.5-flash"))
+GEMINI_FAST_MODEL = os.getenv("GEMINI_FAST_MODEL", "gemini-2.5-flash-lite")
+# Messages up to this many words with a confident pre-classification count as simple
+ROUTER_SIMPLE_MAX_WORDS = int(os.getenv("ROUTER_SIMPLE_MAX_WORDS", "25"))
+ROUTER_WINDOW = int(os.getenv("ROUTER_WINDOW", "50"))
+# Stats based decisions need at least this many samples per model
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "5"))
+ROUTER_MAX_PARSE_FAILURE_RATE = float(os.getenv("ROUTER_MAX_PARSE_FAILURE_RATE", "0.2"))
+# While the stats keep simple messages away from the fast model, every n-th one still
+# goes there, so its window keeps getting fresh samples and it can recover
+ROUTER_PROBE_EVERY = int(os.getenv("ROUTER_PROBE_EVERY", "20"))
+
+
+class ModelStats:
+    """
+    Rolling window of latency, tokens and JSON parse outcome of recent calls to one model.
+    """
+
+    def __init__(self, window=ROUTER_WINDOW):
+        self._samples = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.parse_failures = 0
+
+    def record(self, latency: float, tokens: int, parsed: bool):
+        with self._lock:
+            self._samples.append((latency, tokens, parsed))
+            self.calls += 1
+            self.parse_failures += not parsed
+
+    def summary(self):
+        with self._lock:
+            samples = list(self._samples)
+            calls, parse_failures = self.calls, self.parse_failures
+        if not samples:
+            return {"samples": 0, "calls": calls, "parse_failures": parse_failures}
+        latencies = [latency for latency, _, _ in samples]
+        return {
+            "samples": len(samples),
+            "calls": calls,
+            "parse_failures": parse_failures,
+            "latency_p50": statistics.median(latencies),
+            "latency_mean": statistics.mean(latencies),
+            "tokens_mean": statistics.mean(tokens for _, tokens, _ in samples),
+            "parse_failure_rate": sum(not parsed for _, _, parsed in samples) / len(samples)
+        }
+
+
+class ModelRouter:
+    """
+    Picks the model for an extraction: simple messages go to the fast model, unless its
+    recent parse failure rate is too high or it has become slower than the strong model.
+    Long or ambiguous messages, and escalations after failed parses, use the strong model.
+    """
+
+    def __init__(self, fast_model=GEMINI_FAST_MODEL, strong_model=GEMINI_STRONG_MODEL, enabled=MODEL_ROUTING):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self.enabled = enabled
+        self.stats = {fast_model: ModelStats(), strong_model: ModelStats()}
+        self.decisions = {}
+        self._held_back = 0
+        self._lock = threading.Lock()
+
+    def _decide(self, model, reason):
+        with self._lock:
+            key = f"{model}: {reason}"
+            self.decisions[key] = self.decisions.get(key, 0) + 1
+        logging.debug(f"Routing extraction to {model} ({reason}).")
+        return model
+
+    def choose(self, message: str):
+        if not self.enabled or self.fast_model == self.strong_model:
+            return self.strong_model
+
+        classification = classify_message(message)
+        if len(message.split()) > ROUTER_SIMPLE_MAX_WORDS:
+            return self._decide(self.strong_model, "long message")
+        if not classification.confident:
+            return self._decide(self.strong_model, "ambiguous message")
+
+        reason = self._hold_back_reason()
+        if reason is None:
+            return self._decide(self.fast_model, "simple message")
+        with self._lock:
+            self._held_back += 1
+            probe = ROUTER_PROBE_EVERY > 0 and self._held_back % ROUTER_PROBE_EVERY == 0
+        if probe:
+            return self._decide(self.fast_model, "probe")
+        return self._decide(self.strong_model, reason)
+
+    def _hold_back_reason(self):
+        fast = self.stats[self.fast_model].summary()
+        strong = self.stats[self.strong_model].summary()
+        if fast["samples"] >= ROUTER_MIN_SAMPLES and fast["parse_failure_rate"] > ROUTER_MAX_PARSE_FAILURE_RATE:
+            return "fast model parse failures"
+        if (
+            fast["samples"] >= ROUTER_MIN_SAMPLES and strong["samples"] >= ROUTER_MIN_SAMPLES
+            and fast["latency_p50"] > strong["latency_p50"]
+        ):
+            return "fast model slower"
+        return None
+
+    def escalate(self, model: str):
+        """
+        Returns the model to retry with after `model` produced an unparsable response, or None.
+        """
+        if model == self.strong_model:
+            return None
+        return self._decide(self.strong_model, "escalated after parse failure")
+
+    def record(self, model: str, started: float, tokens: int, parsed: bool):
+        stats = self.stats.get(model)
+        if stats is None:
+            with self._lock:
+                stats = self.stats.setdefault(model, ModelStats())
+        stats.record(time.perf_counter() - started, tokens, parsed)
+
+    def snapshot(self):
+        with self._lock:
+            decisions = dict(self.decisions)
+        return {
+            "enabled": self.enabled,
+            "fast_model": self.fast_model,
+            "strong_model": self.strong_model,
+            "models": {model: stats.summary() for model, stats in self.stats.items()},
+            "decisions": decisions
+        }
+
+
+model_router = ModelRouter()
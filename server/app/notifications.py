@@ -1,5 +1,14 @@
+import os
+import queue
+import logging
+import threading
 from .integrations.ntfyConnector import send_ntfy_notification
 
+NOTIFICATIONS_IN_BACKGROUND = os.getenv("NOTIFICATIONS_IN_BACKGROUND", "true").lower() == "true"
+NOTIFICATIONS_MAX_PENDING = int(os.getenv("NOTIFICATIONS_MAX_PENDING", "100"))
+# ntfy accepts at most 3 action buttons per notification
+NTFY_MAX_ACTIONS = 3
+
 NOTIFICATION_TEMPLATES = {
     "google_task": {
         "title": "Nowe zadanie w Google Tasks",
@@ -31,27 +40,115 @@ NOTIFICATION_TEMPLATES = {
     }
 }
 
+def _action_label(text: str):
+    # Commas and semicolons are separators in the ntfy Actions header
+    return text.replace(",", " ").replace(";", " ").strip()
+
+def build_item_notification(response):
+    item_type = response.get("type")
+    if item_type not in NOTIFICATION_TEMPLATES:
+        return None
+
+    template = NOTIFICATION_TEMPLATES[item_type]
+    data = response.get("data", {})
+    response_data = response.get("response") or {}
+
+    title = data.get("title", "bez tytułu")
+    start_datetime = data.get("start_datetime", "nieznana data")
+
+    return {
+        "title": template["title"],
+        "message": template["message"].format(title=title, start_datetime=start_datetime),
+        "tags": template["tags"],
+        "item_title": title,
+        "action_text": template["action_text"],
+        "action_url": response_data.get(template["action_url_key"], "")
+    }
+
+def build_summary_notification(responses):
+    """
+    Collapses all items created by one command into a single notification.
+    A single item keeps its own template, several items are listed in one message
+    with an action button for each of the first NTFY_MAX_ACTIONS of them.
+    """
+    items = [item for item in map(build_item_notification, responses) if item]
+    if not items:
+        return None
+
+    if len(items) == 1:
+        item = items[0]
+        actions = [f'view, {item["action_text"]}, {item["action_url"]}'] if item["action_url"] else None
+        return {
+            "title": item["title"],
+            "message": item["message"],
+            "tags": item["tags"],
+            "actions": actions
+        }
+
+    tags = []
+    for item in items:
+        tags.extend(tag for tag in item["tags"] if tag not in tags)
+
+    actions = [
+        f'view, {_action_label(item["item_title"])[:40] or item["action_text"]}, {item["action_url"]}'
+        for item in items if item["action_url"]
+    ][:NTFY_MAX_ACTIONS]
+
+    return {
+        "title": f"Utworzono nowe elementy: {len(items)}",
+        "message": "\n".join(f"- {item['message']}" for item in items),
+        "tags": tags,
+        "actions": actions or None
+    }
+
+class NotificationDispatcher:
+    """
+    Sends notifications from a single background thread, so ntfy round trips
+    are not part of the request latency.
+    """
+
+    def __init__(self, max_pending=NOTIFICATIONS_MAX_PENDING):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="notifications", daemon=True)
+                self._thread.start()
+
+    def dispatch(self, notification):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(notification)
+        except queue.Full:
+            logging.error("Notification queue is full, dropping notification.")
+
+    def _work(self):
+        while True:
+            notification = self._queue.get()
+            try:
+                deliver(notification)
+            finally:
+                self._queue.task_done()
+
+    def join(self):
+        self._queue.join()
+
+def deliver(notification):
+    try:
+        send_ntfy_notification(**notification)
+    except Exception as e:
+        logging.error(f"Failed to send notification: {e}")
+
+notification_dispatcher = NotificationDispatcher()
+
 def send_notifications(responses):
-    for response in responses:
-        item_type = response.get("type")
-        if item_type not in NOTIFICATION_TEMPLATES:
-            continue
-
-        template = NOTIFICATION_TEMPLATES[item_type]
-        data = response.get("data", {})
-        response_data = response.get("response", {})
-
-        title = data.get("title", "bez tytułu")
-        start_datetime = data.get("start_datetime", "nieznana data")
-        
-        message = template["message"].format(title=title, start_datetime=start_datetime)
-        
-        action_url = response_data.get(template["action_url_key"], "")
-        actions = [f'view, {template["action_text"]}, {action_url}'] if action_url else None
-
-        send_ntfy_notification(
-            title=template["title"],
-            message=message,
-            tags=template["tags"],
-            actions=actions
-        )
+    notification = build_summary_notification(responses)
+    if not notification:
+        return
+    if NOTIFICATIONS_IN_BACKGROUND:
+        notification_dispatcher.dispatch(notification)
+    else:
+        deliver(notification)
@@ -0,0 +1,389 @@
+import os
+import json
+import time
+import uuid
+import random
+import sqlite3
+import hashlib
+import logging
+import threading
+from .executor import INTEGRATION_CONCURRENCY
+
+OUTBOX_ENABLED = os.getenv("OUTBOX_ENABLED", "false").lower() == "true"
+OUTBOX_DB_PATH = os.getenv("OUTBOX_DB_PATH", "outbox.db")
+OUTBOX_WORKERS = int(os.getenv("OUTBOX_WORKERS", "4"))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_RETRY_BASE_DELAY = float(os.getenv("OUTBOX_RETRY_BASE_DELAY", "2"))
+OUTBOX_RETRY_MAX_DELAY = float(os.getenv("OUTBOX_RETRY_MAX_DELAY", "300"))
+# The same write enqueued again within this many seconds is not repeated, e.g. when a phone resends a command
+OUTBOX_DEDUP_WINDOW = float(os.getenv("OUTBOX_DEDUP_WINDOW", "600"))
+# Delivered items are kept this long for deduplication and inspection
+OUTBOX_RETENTION = float(os.getenv("OUTBOX_RETENTION", str(7 * 86400)))
+OUTBOX_POLL_INTERVAL = 1.0
+
+UNFINISHED = ("pending", "running")
+
+
+def dedup_key(operation: str, args):
+    payload = json.dumps([operation, args], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def is_retryable(status_code):
+    # Unknown failures (network errors, timeouts) are retried, client errors are not
+    return status_code is None or status_code == 429 or status_code >= 500
+
+
+def backoff_delay(attempts: int):
+    delay = min(OUTBOX_RETRY_MAX_DELAY, OUTBOX_RETRY_BASE_DELAY * 2 ** (attempts - 1))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxStore:
+    """
+    SQLite (WAL) table of connector writes waiting for delivery.
+    """
+
+    COLUMNS = (
+        "id", "group_id", "service", "operation", "item_type", "item_data", "args", "status",
+        "attempts", "next_attempt_at", "last_error", "result", "created_at", "updated_at"
+    )
+
+    def __init__(self, path=OUTBOX_DB_PATH):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS outbox (
+                id TEXT PRIMARY KEY,
+                dedup_key TEXT NOT NULL,
+                group_id TEXT NOT NULL,
+                service TEXT NOT NULL,
+                operation TEXT NOT NULL,
+                item_type TEXT NOT NULL,
+                item_data TEXT NOT NULL,
+                args TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL,
+                last_error TEXT,
+                result TEXT,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_due ON outbox (status, next_attempt_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_dedup ON outbox (dedup_key, created_at)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS outbox_group ON outbox (group_id)")
+        self._conn.commit()
+
+    def _row_to_item(self, row):
+        item = dict(zip(self.COLUMNS, row))
+        item["item_data"] = json.loads(item["item_data"])
+        item["args"] = json.loads(item["args"])
+        item["result"] = json.loads(item["result"]) if item["result"] else None
+        return item
+
+    def _select(self, where: str, params=(), suffix=""):
+        return self._conn.execute(
+            f"SELECT {', '.join(self.COLUMNS)} FROM outbox WHERE {where} {suffix}",
+            params
+        ).fetchall()
+
+    def add(self, group_id, service, operation, item_type, item_data, args):
+        """
+        Returns `(item_id, status, duplicate)`; a write already enqueued within the dedup
+        window (and not failed) is not added again.
+        """
+        return self.add_many(group_id, [(service, operation, item_type, item_data, args)])[0]
+
+    def add_many(self, group_id, entries):
+        """
+        Adds `(service, operation, item_type, item_data, args)` entries of one group in a
+        single transaction, so workers never see a part of the group. Returns `add`'s
+        result per entry.
+        """
+        now = time.time()
+        added = []
+        with self._lock:
+            for service, operation, item_type, item_data, args in entries:
+                key = dedup_key(operation, args)
+                existing = self._conn.execute(
+                    "SELECT id, status FROM outbox WHERE dedup_key = ? AND created_at > ? AND status != 'failed' "
+                    "ORDER BY created_at DESC LIMIT 1",
+                    (key, now - OUTBOX_DEDUP_WINDOW)
+                ).fetchone()
+                if existing:
+                    added.append((existing[0], existing[1], True))
+                    continue
+                item_id = uuid.uuid4().hex
+                self._conn.execute(
+                    "INSERT INTO outbox (id, dedup_key, group_id, service, operation, item_type, item_data, args, "
+                    "status, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, 'pending', ?, ?, ?)",
+                    (
+                        item_id, key, group_id, service, operation, item_type,
+                        json.dumps(item_data, ensure_ascii=False, default=str),
+                        json.dumps(args, ensure_ascii=False, default=str),
+                        now, now, now
+                    )
+                )
+                added.append((item_id, "pending", False))
+            self._conn.commit()
+        return added
+
+    def claim(self, excluded_services=()):
+        """
+        Marks the next due pending item of a service not in `excluded_services` as running.
+        """
+        placeholders = ", ".join("?" for _ in excluded_services)
+        service_filter = f"AND service NOT IN ({placeholders})" if excluded_services else ""
+        with self._lock:
+            rows = self._select(
+                f"status = 'pending' AND next_attempt_at <= ? {service_filter}",
+                (time.time(), *excluded_services),
+                "ORDER BY next_attempt_at LIMIT 1"
+            )
+            if not rows:
+                return None
+            item = self._row_to_item(rows[0])
+            self._conn.execute(
+                "UPDATE outbox SET status = 'running', updated_at = ? WHERE id = ?",
+                (time.time(), item["id"])
+            )
+            self._conn.commit()
+        return item
+
+    def update(self, item_id: str, **fields):
+        if "result" in fields:
+            fields["result"] = json.dumps(fields["result"], ensure_ascii=False, default=str)
+        fields["updated_at"] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE outbox SET {assignments} WHERE id = ?", (*fields.values(), item_id))
+            self._conn.commit()
+
+    def get(self, item_id: str):
+        with self._lock:
+            rows = self._select("id = ?", (item_id,))
+        return self._row_to_item(rows[0]) if rows else None
+
+    def group(self, group_id: str):
+        with self._lock:
+            rows = self._select("group_id = ?", (group_id,), "ORDER BY created_at")
+        return [self._row_to_item(row) for row in rows]
+
+    def unfinished_in_group(self, group_id: str):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM outbox WHERE group_id = ? AND status IN ('pending', 'running')",
+                (group_id,)
+            ).fetchone()[0]
+
+    def list(self, status: str, limit: int = 100):
+        # A negative limit means no limit in SQLite
+        with self._lock:
+            rows = self._select("status = ?", (status, limit), "ORDER BY created_at LIMIT ?")
+        return [self._row_to_item(row) for row in rows]
+
+    def counts(self):
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status").fetchall()
+        return dict(rows)
+
+    def next_due(self, excluded_services=()):
+        placeholders = ", ".join("?" for _ in excluded_services)
+        service_filter = f"AND service NOT IN ({placeholders})" if excluded_services else ""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT MIN(next_attempt_at) FROM outbox WHERE status = 'pending' {service_filter}",
+                excluded_services
+            ).fetchone()
+        return row[0]
+
+    def reset_running(self):
+        with self._lock:
+            self._conn.execute("UPDATE outbox SET status = 'pending', updated_at = ? WHERE status = 'running'", (time.time(),))
+            self._conn.commit()
+
+    def purge(self, before: float):
+        with self._lock:
+            self._conn.execute("DELETE FROM outbox WHERE status = 'done' AND updated_at < ?", (before,))
+            self._conn.commit()
+
+
+class Outbox:
+    """
+    Delivers connector writes from the store on background workers, with exponential
+    backoff between attempts and at most `concurrency[service]` calls per service at a time.
+    `handlers` maps operation names to connector functions; `on_group_done` is called with
+    all items of a group once none of them is pending anymore.
+    """
+
+    def __init__(self, store: OutboxStore, handlers: dict, on_group_done=None,
+                 workers=OUTBOX_WORKERS, concurrency=None, max_attempts=OUTBOX_MAX_ATTEMPTS):
+        self.store = store
+        self.handlers = handlers
+        self.on_group_done = on_group_done
+        self.workers = workers
+        self.concurrency = concurrency or INTEGRATION_CONCURRENCY
+        self.max_attempts = max_attempts
+        self._running = {}
+        self._condition = threading.Condition()
+        self._finish_lock = threading.Lock()
+        self._threads = []
+        self._purged_at = 0.0
+
+    def start(self):
+        """
+        Starts the workers; items left running by a previous run are delivered again.
+        """
+        with self._condition:
+            if self._threads:
+                return
+            self.store.reset_running()
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"outbox-worker-{i}", daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def enqueue(self, group_id: str, item_type: str, item_data, call):
+        """
+        Stores an IntegrationCall for delivery and returns the item's queued state.
+        """
+        return self.enqueue_group(group_id, [(item_type, item_data, call)])[0]
+
+    def enqueue_group(self, group_id: str, items):
+        """
+        Stores the `(item_type, item_data, call)` items of one group together and returns
+        their queued states; the group is only handed to the workers once all are stored.
+        """
+        for _, _, call in items:
+            if call.func.__name__ not in self.handlers:
+                raise ValueError(f"Unknown outbox operation: {call.func.__name__}")
+        self.start()
+        added = self.store.add_many(group_id, [
+            (call.integration, call.func.__name__, item_type, item_data, list(call.args))
+            for item_type, item_data, call in items
+        ])
+        with self._condition:
+            self._condition.notify_all()
+        return [
+            {
+                'queued': True,
+                'outbox_id': item_id,
+                'status': status,
+                'duplicate': duplicate
+            }
+            for item_id, status, duplicate in added
+        ]
+
+    def current(self, queued: dict):
+        """
+        The result of a write returned queued by `enqueue_group` once it is delivered or
+        has failed, otherwise its queued state now. Purged items keep `queued` as it was.
+        """
+        item = self.store.get(queued["outbox_id"])
+        if item is None:
+            return queued
+        if item["status"] in UNFINISHED:
+            return {**queued, 'status': item["status"]}
+        return item["result"]
+
+    def retry(self, item_id: str):
+        item = self.store.get(item_id)
+        if not item or item["status"] != "failed":
+            return None
+        self.store.update(item_id, status="pending", attempts=0, next_attempt_at=time.time())
+        with self._condition:
+            self._condition.notify_all()
+        return self.store.get(item_id)
+
+    def snapshot(self, limit: int = 100):
+        return {
+            "counts": self.store.counts(),
+            "pending": self.store.list("pending", limit) + self.store.list("running", limit),
+            "failed": self.store.list("failed", limit)
+        }
+
+    def _full_services(self):
+        return [
+            service for service, running in self._running.items()
+            if running >= self.concurrency.get(service, float("inf"))
+        ]
+
+    def _claim(self):
+        with self._condition:
+            item = self.store.claim(self._full_services())
+            if item:
+                self._running[item["service"]] = self._running.get(item["service"], 0) + 1
+            return item
+
+    def _release(self, item):
+        with self._condition:
+            self._running[item["service"]] -= 1
+            self._condition.notify_all()
+
+    def _idle(self):
+        now = time.time()
+        if now - self._purged_at > 3600:
+            self._purged_at = now
+            self.store.purge(now - OUTBOX_RETENTION)
+        with self._condition:
+            # Items of services at their limit don't count: `_release` wakes the workers for them
+            next_due = self.store.next_due(self._full_services())
+            timeout = OUTBOX_POLL_INTERVAL if next_due is None else min(OUTBOX_POLL_INTERVAL, max(0.01, next_due - now))
+            self._condition.wait(timeout)
+
+    def _work(self):
+        while True:
+            item = self._claim()
+            if item is None:
+                self._idle()
+                continue
+            try:
+                self._deliver(item)
+            except Exception as e:
+                logging.error(f"Outbox item {item['id']} could not be processed: {e}")
+            finally:
+                self._release(item)
+
+    def _deliver(self, item):
+        handler = self.handlers.get(item["operation"])
+        status_code = None
+        try:
+            if handler is None:
+                raise ValueError(f"Unknown outbox operation: {item['operation']}")
+            result = handler(*item["args"])
+        except Exception as e:
+            status_code = getattr(e, "status", 400 if isinstance(e, ValueError) else None)
+            result = {'success': False, 'error': f'{item["service"]} call failed: {e}'}
+
+        attempts = item["attempts"] + 1
+        if not (isinstance(result, dict) and result.get("success") is False):
+            logging.debug(f"Outbox item {item['id']} delivered after {attempts} attempts.")
+            self._finish(item, "done", attempts, result)
+            return
+
+        error = result.get("error")
+        status_code = result.get("status_code", status_code)
+        if is_retryable(status_code) and attempts < self.max_attempts:
+            delay = backoff_delay(attempts)
+            logging.debug(f"Outbox item {item['id']} failed ({error}), retrying in {delay:.1f}s.")
+            self.store.update(
+                item["id"], status="pending", attempts=attempts, next_attempt_at=time.time() + delay, last_error=error
+            )
+            return
+
+        logging.error(f"Outbox item {item['id']} failed after {attempts} attempts: {error}")
+        self._finish(item, "failed", attempts, result, error)
+
+    def _finish(self, item, status, attempts, result, error=None):
+        # Serialized, so exactly one worker sees the group without unfinished items
+        with self._finish_lock:
+            self.store.update(item["id"], status=status, attempts=attempts, result=result, last_error=error)
+            group_done = self.store.unfinished_in_group(item["group_id"]) == 0
+        if group_done and self.on_group_done:
+            try:
+                self.on_group_done(self.store.group(item["group_id"]))
+            except Exception as e:
+                logging.error(f"Outbox group {item['group_id']} callback failed: {e}")
@@ -1,86 +1,306 @@
 import os
+import uuid
 import logging
 from datetime import datetime
-from .integrations.googleTasksConnector import create_google_task
-from .integrations.googleCalendarConnector import create_calendar_event
+from .integrations.googleTasksConnector import create_google_task, create_google_tasks
+from .integrations.googleCalendarConnector import create_calendar_event, create_calendar_events
 from .integrations.notionConnector import create_notion_page
-from .prompts import extract_data_from_message
+from .prompts import (
+    extract_data_from_message, extract_data_from_message_streaming, extract_data_from_messages, EXTRACTION_CATEGORIES
+)
 from .notifications import send_notifications
+from .executor import IntegrationCall, integration_executor
+from .metrics import tokens_used, items_created
+from .admission import token_budget
+from .outbox import OUTBOX_ENABLED, Outbox, OutboxStore
+from .search_index import index_created_items
+from .mirror import request_mirror_sync
+from .lazy import Lazy
 
 # Make sure to set these environment variables in your .env file
 NOTION_NOTES_PAGE_ID = os.getenv("NOTION_NOTES_PAGE_ID")
 NOTION_SHOPPING_LIST_PAGE_ID = os.getenv("NOTION_SHOPPING_LIST_PAGE_ID")
+# Start integration writes while the model is still generating the extraction
+EXTRACTION_STREAMING = os.getenv("EXTRACTION_STREAMING", "false").lower() == "true"
+BATCH_MAX_MESSAGES = int(os.getenv("BATCH_MAX_MESSAGES", "100"))
+# Messages of a batch whose writes are submitted together; the next ones wait, so a large
+# batch neither outlasts the integration timeout in the queue nor starves other requests
+BATCH_WRITE_WAVE = int(os.getenv("BATCH_WRITE_WAVE", "10"))
 
-def process_tasks(tasks):
-    logging.debug(f"Processing {len(tasks)} tasks.")
-    responses = []
-    for task in tasks:
-        task_response = create_google_task(task)
-        responses.append({
-            "type": "google_task",
-            "data": task,
-            "response": task_response
-        })
-    return responses
+def plan_tasks(tasks):
+    logging.debug(f"Planning {len(tasks)} tasks.")
+    return [
+        ("google_task", task, IntegrationCall("google_tasks", create_google_task, task))
+        for task in tasks
+    ]
 
-def process_events(events):
-    logging.debug(f"Processing {len(events)} events.")
-    responses = []
-    for event in events:
-        event_response = create_calendar_event(event)
-        responses.append({
-            "type": "google_calendar",
-            "data": event,
-            "response": event_response
-        })
-    return responses
+def plan_events(events):
+    logging.debug(f"Planning {len(events)} events.")
+    return [
+        ("google_calendar", event, IntegrationCall("google_calendar", create_calendar_event, event))
+        for event in events
+    ]
 
-def process_notes(notes):
-    logging.debug(f"Processing {len(notes)} notes.")
-    responses = []
-    for note in notes:
-        note_response = create_notion_page(note, NOTION_NOTES_PAGE_ID)
-        responses.append({
-            "type": "notion_page",
-            "data": note,
-            "response": note_response
-        })
-    return responses
+def plan_notes(notes):
+    logging.debug(f"Planning {len(notes)} notes.")
+    return [
+        ("notion_page", note, IntegrationCall("notion", create_notion_page, note, NOTION_NOTES_PAGE_ID))
+        for note in notes
+    ]
 
-def process_shopping_lists(shopping_lists):
-    logging.debug(f"Processing {len(shopping_lists)} shopping lists.")
-    responses = []
+def plan_shopping_lists(shopping_lists):
+    logging.debug(f"Planning {len(shopping_lists)} shopping lists.")
+    plans = []
     for shopping_list in shopping_lists:
         shopping_data = {
             "title": f"Lista zakupów {datetime.now().strftime('%m-%d')}",
             "content": shopping_list.get("content", "No content")
         }
-        shopping_response = create_notion_page(shopping_data, NOTION_SHOPPING_LIST_PAGE_ID)
-        responses.append({
-            "type": "notion_shopping_list",
-            "data": shopping_data,
-            "response": shopping_response
-        })
+        plans.append((
+            "notion_shopping_list",
+            shopping_data,
+            IntegrationCall("notion", create_notion_page, shopping_data, NOTION_SHOPPING_LIST_PAGE_ID)
+        ))
+    return plans
+
+PLANNERS = {
+    "tasks": plan_tasks,
+    "events": plan_events,
+    "notes": plan_notes,
+    "shopping_lists": plan_shopping_lists,
+}
+
+def plan_extracted_data(data: dict):
+    plans = []
+    for category in EXTRACTION_CATEGORIES:
+        plans.extend(PLANNERS[category](data.get(category, [])))
+    return plans
+
+def batch_writer(integration: str):
+    """
+    Connector writing several items of `integration` in one request, or None.
+    Looked up on every call, so wrappers installed on this module (e.g. by benchmarks) apply.
+    """
+    return {
+        "google_tasks": create_google_tasks,
+        "google_calendar": create_calendar_events,
+    }.get(integration)
+
+def submit_plans(plans):
+    """
+    Submits the planned calls; calls to a connector with a batch writer are sent together.
+    Returns a future per plan.
+    """
+    futures = [None] * len(plans)
+    batches = {}
+    for index, (_, _, call) in enumerate(plans):
+        if batch_writer(call.integration):
+            batches.setdefault(call.integration, []).append(index)
+        else:
+            futures[index] = integration_executor.submit(call)
+
+    for integration, indexes in batches.items():
+        calls = [plans[index][2] for index in indexes]
+        if len(calls) == 1:
+            futures[indexes[0]] = integration_executor.submit(calls[0])
+            continue
+        for index, future in zip(indexes, integration_executor.submit_batch(calls, batch_writer(integration))):
+            futures[index] = future
+    return futures
+
+def run_plans(plans, on_progress=None):
+    return collect_plans(plans, submit_plans(plans), on_progress)
+
+def collect_plans(plans, futures, on_progress=None):
+    """
+    Waits for the calls in plan order; `on_progress` gets an `integration` event per result.
+    """
+    responses = []
+    for index, ((item_type, data, call), future) in enumerate(zip(plans, futures)):
+        response = {
+            "type": item_type,
+            "data": data,
+            "response": integration_executor.wait(call, future)
+        }
+        responses.append(response)
+        if on_progress:
+            on_progress("integration", {"index": index, **response})
     return responses
 
-def process_text_and_get_response(text: str):
+def count_tokens(total_tokens: int):
+    tokens_used.inc(total_tokens)
+    token_budget.record(total_tokens)
+
+def count_created_items(responses):
+    for response in responses:
+        if (response.get("response") or {}).get("success"):
+            items_created.inc(type=response["type"])
+
+def notify_outbox_group(items):
+    """
+    Metrics and the summary notification of one command, once the outbox delivered all its items.
+    """
+    responses = [
+        {"type": item["item_type"], "data": item["item_data"], "response": item["result"]}
+        for item in items
+    ]
+    count_created_items(responses)
+    index_created_items(responses)
+    request_mirror_sync(responses)
+    send_notifications(responses)
+
+def _create_outbox():
+    return Outbox(
+        OutboxStore(),
+        {
+            "create_google_task": create_google_task,
+            "create_calendar_event": create_calendar_event,
+            "create_notion_page": create_notion_page,
+        },
+        on_group_done=notify_outbox_group
+    )
+
+# Created on first use, only when OUTBOX_ENABLED
+outbox = Lazy(_create_outbox)
+
+def enqueue_plans(plans):
+    """
+    Stores the planned writes of one command in the outbox, to be delivered in the background.
+    """
+    if not plans:
+        return []
+    queued = outbox.get().enqueue_group(uuid.uuid4().hex, plans)
+    return [
+        {
+            "type": item_type,
+            "data": data,
+            "response": response
+        }
+        for (item_type, data, _), response in zip(plans, queued)
+    ]
+
+def extract_and_dispatch_streaming(text: str):
+    """
+    Submits every item to its connector as soon as the streaming parser emits it.
+    Returns the extracted data, tokens used and the submitted plans with their futures,
+    ordered like the non-streaming path: tasks, events, notes, shopping lists.
+    """
+    dispatched = {category: [] for category in EXTRACTION_CATEGORIES}
+
+    def dispatch(category, item):
+        plan = PLANNERS[category]([item])[0]
+        dispatched[category].append((plan, integration_executor.submit(plan[2])))
+
+    data, total_tokens = extract_data_from_message_streaming(text, dispatch)
+
+    # Items the incremental parser could not pick up are dispatched from the full response
+    for category in EXTRACTION_CATEGORIES:
+        for item in data.get(category, [])[len(dispatched[category]):]:
+            dispatch(category, item)
+
+    ordered = [entry for category in EXTRACTION_CATEGORIES for entry in dispatched[category]]
+    return data, total_tokens, [plan for plan, _ in ordered], [future for _, future in ordered]
+
+def process_text_and_get_response(text: str, on_stage=None, on_progress=None, progress=None):
+    """
+    `on_progress` is an optional callable invoked with an event name and its data as results
+    become available: `extraction`, then `integration` per item and `notifications`.
+    `progress` is the JobProgress of a job, an extraction it already recorded is reused.
+    """
     logging.debug("Extracting data from text.")
-    data, total_tokens = extract_data_from_message(text)
-    
+    if on_stage:
+        on_stage("extracting")
+    extraction = progress.get("extraction") if progress else None
+    dispatched = None
+    if extraction:
+        logging.debug("Extraction recorded by an earlier run of the job, skipping it.")
+        data, total_tokens = extraction["data"], extraction["total_tokens"]
+    # With the outbox, writes don't wait for the response anyway, so streaming gains nothing.
+    # Jobs record the extraction before writing, so they don't stream either.
+    elif EXTRACTION_STREAMING and not OUTBOX_ENABLED and not progress:
+        data, total_tokens, plans, futures = extract_and_dispatch_streaming(text)
+        dispatched = (plans, futures)
+    else:
+        data, total_tokens = extract_data_from_message(text)
+        if progress:
+            progress.save("extraction", {"data": data, "total_tokens": total_tokens})
+    return process_extracted_data(
+        data, total_tokens, on_stage=on_stage, dispatched=dispatched, on_progress=on_progress, progress=progress
+    )
+
+def resume_plans(plans, progress, run, on_progress=None):
+    """
+    Runs the plans of a job with `run(plans, on_progress)`, skipping writes an interrupted
+    earlier run completed: their recorded responses are returned instead. Failed writes are
+    tried again. Each response is recorded in `progress` as soon as it is known.
+    """
+    completed = progress.get("integrations", {})
+    remaining = [
+        index for index in range(len(plans))
+        if str(index) not in completed or (completed[str(index)].get("response") or {}).get("success") is False
+    ]
+    if len(remaining) < len(plans):
+        logging.debug(f"Skipping {len(plans) - len(remaining)} writes completed by an earlier run of the job.")
+
+    def record(event, data):
+        if event == "integration":
+            index = remaining[data["index"]]
+            completed[str(index)] = {key: value for key, value in data.items() if key != "index"}
+            progress.save("integrations", completed)
+            data = {**data, "index": index}
+        if on_progress:
+            on_progress(event, data)
+
+    responses = run([plans[index] for index in remaining], record)
+    for index, response in zip(remaining, responses):
+        completed[str(index)] = response
+    progress.save("integrations", completed)
+    return [completed[str(index)] for index in range(len(plans))]
+
+def process_extracted_data(data: dict, total_tokens: int, on_stage=None, dispatched=None, on_progress=None, progress=None):
+    """
+    Creates the extracted items in their integrations and sends notifications.
+    `dispatched` holds the plans and futures of items already submitted by streaming extraction.
+    With OUTBOX_ENABLED the items are only queued; notifications follow their delivery.
+    With a job's `progress`, writes completed by an earlier run are not repeated.
+    """
     tasks = data.get("tasks", [])
     events = data.get("events", [])
     notes = data.get("notes", [])
     shopping_lists = data.get("shopping_lists", [])
 
     logging.debug("Processing extracted data.")
-    responses = []
-    responses.extend(process_tasks(tasks))
-    responses.extend(process_events(events))
-    responses.extend(process_notes(notes))
-    responses.extend(process_shopping_lists(shopping_lists))
+    if on_progress:
+        on_progress("extraction", {"data": data, "total_tokens_used": total_tokens})
+    if on_stage:
+        on_stage("integrations")
+    count_tokens(total_tokens)
+    if dispatched:
+        responses = collect_plans(*dispatched, on_progress)
+    elif OUTBOX_ENABLED:
+        plans = plan_extracted_data(data)
+        if progress:
+            responses = resume_plans(plans, progress, lambda remaining, _: enqueue_plans(remaining))
+        else:
+            responses = enqueue_plans(plans)
+        if on_progress:
+            for index, response in enumerate(responses):
+                on_progress("integration", {"index": index, **response})
+    elif progress:
+        responses = resume_plans(plan_extracted_data(data), progress, run_plans, on_progress)
+    else:
+        responses = run_plans(plan_extracted_data(data), on_progress)
 
-    logging.debug("Sending notifications.")
-    send_notifications(responses)
+    if not OUTBOX_ENABLED or dispatched:
+        count_created_items(responses)
+        index_created_items(responses)
+        request_mirror_sync(responses)
+        logging.debug("Sending notifications.")
+        if on_stage:
+            on_stage("notifications")
+        send_notifications(responses)
+        if on_progress:
+            on_progress("notifications", {})
 
     logging.debug("Finished processing.")
     return {
@@ -93,4 +313,65 @@ def process_text_and_get_response(text: str):
             "shopping_lists_created": len(shopping_lists),
             "total_tokens_used": total_tokens
         }
-    }
\ No newline at end of file
+    }
+
+def current_responses(responses):
+    """
+    `responses` of an earlier command, with writes queued in the outbox replaced by their state now.
+    """
+    return [
+        {**response, "response": outbox.get().current(response["response"])}
+        if (response.get("response") or {}).get("queued") else response
+        for response in responses
+    ]
+
+def is_final(responses):
+    # A write still running at its deadline may yet fail or succeed
+    return not any((response.get("response") or {}).get("pending") for response in responses)
+
+def failed_items(responses):
+    return [response for response in responses if (response.get("response") or {}).get("success") is False]
+
+def process_batch_text(messages):
+    """
+    Processes many independent messages: extraction in as few model calls as possible,
+    then the writes of BATCH_WRITE_WAVE messages at a time on the shared integration executor.
+    A message fails when its extraction or any of its writes failed.
+    """
+    extractions, model_calls = extract_data_from_messages(messages)
+
+    results = []
+    for start in range(0, len(messages), BATCH_WRITE_WAVE):
+        wave = list(zip(messages, extractions))[start:start + BATCH_WRITE_WAVE]
+        dispatched = []
+        for _, extraction in wave:
+            if extraction["error"] or OUTBOX_ENABLED:
+                dispatched.append(None)
+                continue
+            plans = plan_extracted_data(extraction["data"])
+            dispatched.append((plans, submit_plans(plans)))
+
+        for (message, extraction), submitted in zip(wave, dispatched):
+            if extraction["error"]:
+                count_tokens(extraction["tokens"])
+                results.append({"success": False, "message": message, "error": extraction["error"]})
+                continue
+            response_data = process_extracted_data(extraction["data"], extraction["tokens"], dispatched=submitted)
+            failed = failed_items(response_data["integrations"])
+            if failed:
+                error = f"{len(failed)} of {len(response_data['integrations'])} items could not be created"
+                results.append({"success": False, "message": message, "error": error, **response_data})
+            else:
+                results.append({"success": True, "message": message, **response_data})
+
+    succeeded = sum(result["success"] for result in results)
+    return {
+        "results": results,
+        "summary": {
+            "messages": len(messages),
+            "succeeded": succeeded,
+            "failed": len(messages) - succeeded,
+            "model_calls": model_calls,
+            "total_tokens_used": sum(extraction["tokens"] for extraction in extractions)
+        }
+    }
@@ -1,32 +1,90 @@
 import os, json, re
+import time
+import hashlib
 import logging
+import threading
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import unicodedata
 from datetime import datetime
-from langchain_google_genai import ChatGoogleGenerativeAI
+from .cache import LRUCache, DiskCache, TieredCache
+from .lazy import Lazy
+from .metrics import timed_stage
+from .streaming_json import IncrementalItemParser, loads_tolerant
+from .classifier import classify_message
+from .model_router import model_router
 
-gemini = ChatGoogleGenerativeAI(
-    model=os.getenv("LANGCHAIN_MODEL", "gemini-2.5-flash"),
-    google_api_key=os.getenv("GOOGLE_AI_API_KEY")
+LANGCHAIN_MODEL = os.getenv("LANGCHAIN_MODEL", "gemini-2.5-flash")
+# Optional Gemini API endpoint override, e.g. for a local stand-in server
+GEMINI_API_ENDPOINT = os.getenv("GEMINI_API_ENDPOINT")
+EXTRACTION_CACHE_SIZE = int(os.getenv("EXTRACTION_CACHE_SIZE", "256"))
+EXTRACTION_CACHE_TTL = float(os.getenv("EXTRACTION_CACHE_TTL", "86400"))
+# Optional on-disk tier, disabled when not set
+EXTRACTION_CACHE_PATH = os.getenv("EXTRACTION_CACHE_PATH")
+EXTRACTION_CACHE_DISK_SIZE = int(os.getenv("EXTRACTION_CACHE_DISK_SIZE", "5000"))
+
+EXTRACTION_CATEGORIES = ("tasks", "events", "notes", "shopping_lists")
+# Include only the prompt sections for categories the local classifier finds in the message
+EXTRACTION_PRECLASSIFY = os.getenv("EXTRACTION_PRECLASSIFY", "false").lower() == "true"
+# Batch extraction: messages per model call and model calls in flight for one batch
+EXTRACTION_BATCH_SIZE = int(os.getenv("EXTRACTION_BATCH_SIZE", "10"))
+EXTRACTION_BATCH_CONCURRENCY = int(os.getenv("EXTRACTION_BATCH_CONCURRENCY", "2"))
+
+def _create_gemini(model=LANGCHAIN_MODEL):
+    # langchain is slow to import, so it is only loaded when the model is first needed
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    endpoint_options = {}
+    if GEMINI_API_ENDPOINT:
+        endpoint_options = {"client_options": {"api_endpoint": GEMINI_API_ENDPOINT}, "transport": "rest"}
+    return ChatGoogleGenerativeAI(
+        model=model,
+        google_api_key=os.getenv("GOOGLE_AI_API_KEY"),
+        **endpoint_options
+    )
+
+gemini = Lazy(_create_gemini)
+gemini_models = {LANGCHAIN_MODEL: gemini}
+_gemini_models_lock = threading.Lock()
+
+def get_gemini(model: str = LANGCHAIN_MODEL):
+    with _gemini_models_lock:
+        holder = gemini_models.get(model)
+        if holder is None:
+            holder = gemini_models[model] = Lazy(functools.partial(_create_gemini, model))
+    return holder.get()
+
+extraction_cache = TieredCache(
+    LRUCache(max_entries=EXTRACTION_CACHE_SIZE, ttl=EXTRACTION_CACHE_TTL),
+    DiskCache(EXTRACTION_CACHE_PATH, max_entries=EXTRACTION_CACHE_DISK_SIZE, ttl=EXTRACTION_CACHE_TTL) if EXTRACTION_CACHE_PATH else None
 )
 
-def invoke_data_extraction_prompt(message: str):
-    logging.debug("Invoking data extraction prompt.")
-    return gemini.invoke(
-        f"""
-Przeanalizuj wiadomość i zwróć informacje zawarte w treści w ustrukturyzowany sposób wyłącznie w formacie JSON, w formie rekordu z polami: tasks, events, notes, shopping_lists.
-Każdy z tych rekordów powinien być listą obiektów, gdzie każdy obiekt zawiera następujące pola:
-Dla tasks:
+def normalize_message(message: str):
+    message = unicodedata.normalize("NFC", message)
+    return " ".join(message.split()).casefold()
+
+def extraction_cache_key(message: str, reference_date: str):
+    """
+    The prompt embeds the current date, so relative dates like "jutro" only map to
+    the same result on the same day - the reference date is part of the key.
+    """
+    key = f"{LANGCHAIN_MODEL}\n{reference_date}\n{normalize_message(message)}"
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+# Prompt sections per category, in the order they appear in the prompt
+EXTRACTION_FIELD_SECTIONS = {
+    "tasks": """Dla tasks:
 - title: tytuł zadania
 - description: opis zadania
-- due_date: data wykonania zadania, jeśli nie da się określić, załóż że zadanie jest do wykonania na jutro.
-Dla notes:
+- due_date: data wykonania zadania, jeśli nie da się określić, załóż że zadanie jest do wykonania na jutro.""",
+    "notes": """Dla notes:
 - title: tytuł notatki
 - content: treść notatki. Jeśli notatka jest długa, podziel ją na akapity. Jeśli notatka zawiera listy, zachowaj ich strukturę, używając myślników do oznaczenia punktów listy.
-  Jeśli notatka zawiera prośbę skierowaną do asystenta, spełnij ją, wypisz swoje wnioski w treści notatki w nawiasie kwadratowym [].
-Dla shopping_lists:
+  Jeśli notatka zawiera prośbę skierowaną do asystenta, spełnij ją, wypisz swoje wnioski w treści notatki w nawiasie kwadratowym [].""",
+    "shopping_lists": """Dla shopping_lists:
 - content: lista przedmiotów do kupienia, w formie nienumerowanej listy podzielonej na kategorie, zgodnie z tym jak podzielone są produkty w supermarketach.
   Zwróć uwagę żeby uwzględnić wszystkie wspomniane w komunikacie pozycje. Jeśli pojawiają się dodatkowe informacje, takie jak ilość, marka, rodzaj czy warunki kiedy należy kupić
-  (na przykład, "jeśli będzie długi termin ważności"), uwzględnij je w opisie pozycji.s
-Dla events:
+  (na przykład, "jeśli będzie długi termin ważności"), uwzględnij je w opisie pozycji.s""",
+    "events": """Dla events:
 - title: tytuł wydarzenia
 - description: opis wydarzenia
 - start_datetime: data i czas rozpoczęcia
@@ -37,65 +95,112 @@ Dla events:
   - "COUNT": (opcjonalne) ile razy ma się powtórzyć.
   - "UNTIL": (opcjonalne) do kiedy ma się powtarzać, format "YYYYMMDD".
   - "BYDAY": (opcjonalne) w które dni tygodnia, np. "MO,TU" dla poniedziałków i wtorków.
-  Użyj COUNT albo UNTIL, nie obu naraz.
+  Użyj COUNT albo UNTIL, nie obu naraz.""",
+}
 
-Bierz pod uwagę że dziś jest {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, wszystkie wydarzenia powinny być w przyszłości, nie mogą być w przeszłości.
-Przykład odpowiedzi:
-{{
-    tasks: [
-        {{
+EXTRACTION_EXAMPLE_SECTIONS = {
+    "tasks": """    tasks: [
+        {
             "title": "Zadanie 1",
             "description": "Opis zadania 1",
             "due_date": "2025-09-10"
-        }}
-    ],
-    notes: [
-        {{
+        }
+    ]""",
+    "notes": """    notes: [
+        {
             "title": "Notatka 1",
             "content": "Treść notatki 1"
-        }}
-    ],
-    shopping_lists: [
-        {{
+        }
+    ]""",
+    "shopping_lists": """    shopping_lists: [
+        {
             "content": "Nabiał\n - Mleko (jeśli będzie długi termin ważności)\n - Jogurt naturalny marki Pilos\n - Jajka Ligol\nOwoce\n - Jabłka\n - Banany\n - Pomarańcze"
-        }}
-    ],
-    events: [
-        {{
+        }
+    ]""",
+    "events": """    events: [
+        {
             "title": "Spotkanie z klientem",
             "description": "Omówienie projektu",
             "start_datetime": "2025-09-11 12:00:00",
             "end_datetime": "2025-09-11 13:00:00"
-        }},
-        {{
+        },
+        {
             "title": "Cotygodniowe zebranie",
             "description": "Podsumowanie tygodnia, powtarza się 10 razy",
             "start_datetime": "2025-09-12 09:00:00",
             "end_datetime": "2025-09-12 10:00:00",
-            "recurrence": {{
+            "recurrence": {
                 "FREQ": "WEEKLY",
                 "INTERVAL": 1,
                 "COUNT": 10,
                 "BYDAY": "FR"
-            }}
-        }}
-    ]
+            }
+        }
+    ]""",
+}
+
+def build_extraction_instructions(categories=EXTRACTION_CATEGORIES):
+    """
+    Builds the extraction instructions limited to `categories`; all four by default.
+    """
+    sections = [category for category in EXTRACTION_FIELD_SECTIONS if category in categories]
+    fields = "\n".join(EXTRACTION_FIELD_SECTIONS[category] for category in sections)
+    example = ",\n".join(EXTRACTION_EXAMPLE_SECTIONS[category] for category in sections)
+    record_fields = ", ".join(category for category in EXTRACTION_CATEGORIES if category in categories)
+    return f"""
+Przeanalizuj wiadomość i zwróć informacje zawarte w treści w ustrukturyzowany sposób wyłącznie w formacie JSON, w formie rekordu z polami: {record_fields}.
+Każdy z tych rekordów powinien być listą obiektów, gdzie każdy obiekt zawiera następujące pola:
+{fields}
+
+Bierz pod uwagę że dziś jest {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}, wszystkie wydarzenia powinny być w przyszłości, nie mogą być w przeszłości.
+Przykład odpowiedzi:
+{{
+{example}
 }}
 Zwróć uwagę, żeby odpowiedź była poprawnym JSON-em
+"""
 
-Treść wiadomości: {message}""")
+def build_data_extraction_prompt(message: str):
+    categories = EXTRACTION_CATEGORIES
+    if EXTRACTION_PRECLASSIFY:
+        categories = classify_message(message).categories
+    return f"""{build_extraction_instructions(categories)}
+Treść wiadomości: {message}"""
 
-def extract_data_from_message(message: str):
-    logging.debug("Extracting data from message.")
-    response = invoke_data_extraction_prompt(message) 
-    if not response or not response.content:
-        logging.error("No response from Gemini")
-        raise ValueError("No response from Gemini")
-    
-    token_usage = response.usage_metadata
-    total_tokens = token_usage.get('total_tokens', 0) if token_usage else 0
-    logging.debug(f"Gemini response: {response.content}")
-    match = re.search(r"\{.*\}", response.content, re.DOTALL)
+def build_audio_extraction_prompt():
+    """
+    Prompt for the single-pass audio mode: transcription and extraction in one model call.
+    """
+    return f"""
+Dokonaj transkrypcji załączonego pliku audio. Wiadomością, którą należy przeanalizować, jest treść tej transkrypcji.
+Oprócz pól tasks, events, notes, shopping_lists dodaj do rekordu JSON pole transcription z pełną transkrypcją nagrania.
+{build_extraction_instructions()}"""
+
+def build_batch_extraction_prompt(messages):
+    """
+    Prompt extracting several independent messages in one model call, answered with
+    one record per message under "messages", each tagged with the message index.
+    """
+    numbered = "\n".join(f'<message index="{index}">\n{message}\n</message>' for index, message in enumerate(messages))
+    return f"""
+Otrzymasz {len(messages)} niezależnych wiadomości, każdą w znaczniku <message> z numerem w atrybucie index.
+Przeanalizuj każdą wiadomość osobno, zgodnie z poniższymi instrukcjami - informacje z jednej wiadomości nie mogą trafić do rekordu innej.
+Zwróć jeden obiekt JSON z polem messages: listą rekordów, po jednym dla każdej wiadomości, w kolejności numerów.
+Każdy rekord ma pole index z numerem wiadomości oraz pola opisane poniżej.
+{build_extraction_instructions()}
+Wiadomości:
+{numbered}"""
+
+def invoke_data_extraction_prompt(message: str, model: str = LANGCHAIN_MODEL):
+    logging.debug(f"Invoking data extraction prompt with {model}.")
+    return get_gemini(model).invoke(build_data_extraction_prompt(message))
+
+def stream_data_extraction_prompt(message: str, model: str = LANGCHAIN_MODEL):
+    logging.debug(f"Streaming data extraction prompt with {model}.")
+    return get_gemini(model).stream(build_data_extraction_prompt(message))
+
+def parse_extraction_response(content: str):
+    match = re.search(r"\{.*\}", content, re.DOTALL)
     if not match:
         logging.error("Could not find JSON array in Gemini response")
         raise ValueError("Could not find JSON array in Gemini response")
@@ -106,5 +211,243 @@ def extract_data_from_message(message: str):
     except json.JSONDecodeError as e:
         logging.error(f"Could not decode JSON from Gemini response: {e}")
         raise ValueError("Could not decode JSON from Gemini response")
-        
+    return json_data
+
+def parse_batch_extraction_response(content: str, count: int):
+    """
+    Splits a batch extraction response back into per-message records.
+    Messages the model left out (or numbered twice) are None.
+    """
+    json_data = parse_extraction_response(content)
+    records = json_data.get("messages")
+    if not isinstance(records, list):
+        logging.error("Batch extraction response has no messages list")
+        raise ValueError("Batch extraction response has no messages list")
+
+    extractions = [None] * count
+    seen = set()
+    for record in records:
+        index = record.get("index") if isinstance(record, dict) else None
+        if not isinstance(index, int) or not 0 <= index < count:
+            continue
+        if index in seen:
+            extractions[index] = None
+            continue
+        seen.add(index)
+        extractions[index] = {category: record.get(category, []) for category in EXTRACTION_CATEGORIES}
+    return extractions
+
+def cache_extraction(message: str, json_data: dict):
+    """
+    Stores an extraction made outside of extract_data_from_message, e.g. in the single-pass audio mode.
+    """
+    cache_key = extraction_cache_key(message, datetime.now().strftime('%Y-%m-%d'))
+    extraction_cache.put(cache_key, json.dumps(json_data, ensure_ascii=False))
+
+@timed_stage("extraction")
+def extract_data_from_message(message: str):
+    logging.debug("Extracting data from message.")
+    cache_key = extraction_cache_key(message, datetime.now().strftime('%Y-%m-%d'))
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        logging.debug("Extraction cache hit.")
+        return json.loads(cached), 0
+
+    model = model_router.choose(message)
+    total_tokens = 0
+    while True:
+        started = time.perf_counter()
+        response = invoke_data_extraction_prompt(message, model)
+        token_usage = response.usage_metadata if response else None
+        tokens = token_usage.get('total_tokens', 0) if token_usage else 0
+        # Tokens of a failed attempt are spent too, they count towards the total
+        total_tokens += tokens
+        try:
+            if not response or not response.content:
+                logging.error("No response from Gemini")
+                raise ValueError("No response from Gemini")
+            logging.debug(f"Gemini response: {response.content}")
+            json_data = parse_extraction_response(response.content)
+        except ValueError:
+            model_router.record(model, started, tokens, parsed=False)
+            retry_model = model_router.escalate(model)
+            if retry_model is None:
+                raise
+            logging.debug(f"Escalating extraction from {model} to {retry_model}.")
+            model = retry_model
+            continue
+        model_router.record(model, started, tokens, parsed=True)
+        break
+
+    extraction_cache.put(cache_key, json.dumps(json_data, ensure_ascii=False))
+    return json_data, total_tokens
+
+@timed_stage("extraction")
+def extract_data_from_message_streaming(message: str, on_item):
+    """
+    Like extract_data_from_message, but consumes the model output as it is generated
+    and calls `on_item(category, item)` for every task, event, note or shopping list
+    as soon as its JSON object is complete.
+    """
+    logging.debug("Extracting data from message with streaming.")
+    cache_key = extraction_cache_key(message, datetime.now().strftime('%Y-%m-%d'))
+    cached = extraction_cache.get(cache_key)
+    if cached is not None:
+        logging.debug("Extraction cache hit.")
+        json_data = json.loads(cached)
+        for category in EXTRACTION_CATEGORIES:
+            for item in json_data.get(category, []):
+                on_item(category, item)
+        return json_data, 0
+
+    # Items are dispatched while the response streams in, so a failed parse can't be
+    # escalated to the strong model here - it is only recorded in the router stats
+    model = model_router.choose(message)
+    started = time.perf_counter()
+    parser = IncrementalItemParser()
+    total_tokens = 0
+    try:
+        for chunk in stream_data_extraction_prompt(message, model):
+            if chunk.usage_metadata:
+                total_tokens += chunk.usage_metadata.get('total_tokens', 0)
+            if not chunk.content:
+                continue
+            for category, item in parser.feed(chunk.content):
+                if category in EXTRACTION_CATEGORIES and isinstance(item, dict):
+                    on_item(category, item)
+
+        if not parser.text:
+            logging.error("No response from Gemini")
+            raise ValueError("No response from Gemini")
+        logging.debug(f"Gemini response: {parser.text}")
+        json_data = parse_streamed_extraction(parser)
+    except ValueError as e:
+        model_router.record(model, started, total_tokens, parsed=False)
+        return _dispatched_extraction(parser, total_tokens, e)
+    except Exception as e:
+        return _dispatched_extraction(parser, total_tokens, e)
+    model_router.record(model, started, total_tokens, parsed=True)
+
+    extraction_cache.put(cache_key, json.dumps(json_data, ensure_ascii=False))
+    return json_data, total_tokens
+
+def _streamed_items(parser: IncrementalItemParser):
+    return {
+        category: [item for item in parser.items.get(category, []) if isinstance(item, dict)]
+        for category in EXTRACTION_CATEGORIES
+    }
+
+def parse_streamed_extraction(parser: IncrementalItemParser):
+    """
+    The full streamed response, parsed as leniently as the items were. When it still
+    isn't valid JSON (e.g. unquoted keys), the items the parser completed are the result.
+    """
+    match = re.search(r"\{.*\}", parser.text, re.DOTALL)
+    if match:
+        try:
+            return loads_tolerant(match.group(0))
+        except json.JSONDecodeError as e:
+            logging.debug(f"Streamed response is not valid JSON, using the streamed items: {e}")
+    json_data = _streamed_items(parser)
+    if not any(json_data.values()):
+        logging.error("Could not decode JSON from Gemini response")
+        raise ValueError("Could not decode JSON from Gemini response")
+    return json_data
+
+def _dispatched_extraction(parser: IncrementalItemParser, total_tokens: int, error: Exception):
+    """
+    Once items were passed to `on_item` they are being written, so a later failure
+    must not fail the request: the items sent so far are returned instead.
+    """
+    json_data = _streamed_items(parser)
+    if not any(json_data.values()):
+        raise error
+    logging.error(f"Streaming extraction failed after items were dispatched, keeping them: {error}")
     return json_data, total_tokens
+
+def _extract_batch(messages):
+    """
+    One model call for a group of messages. Returns per-message records (None where the
+    response can't be used) and the tokens of the call.
+    """
+    model = model_router.strong_model
+    started = time.perf_counter()
+    try:
+        response = get_gemini(model).invoke(build_batch_extraction_prompt(messages))
+    except Exception as e:
+        # Network, quota or server errors: the messages are retried one by one
+        logging.error(f"Batch extraction call failed: {e}")
+        model_router.record(model, started, 0, parsed=False)
+        return [None] * len(messages), 0
+    token_usage = response.usage_metadata if response else None
+    total_tokens = token_usage.get('total_tokens', 0) if token_usage else 0
+    try:
+        if not response or not response.content:
+            logging.error("No response from Gemini")
+            raise ValueError("No response from Gemini")
+        logging.debug(f"Gemini batch response: {response.content}")
+        extractions = parse_batch_extraction_response(response.content, len(messages))
+    except ValueError:
+        model_router.record(model, started, total_tokens, parsed=False)
+        return [None] * len(messages), total_tokens
+    model_router.record(model, started, total_tokens, parsed=True)
+    return extractions, total_tokens
+
+def _share_tokens(total_tokens, messages):
+    """
+    Splits the tokens of a batch call across its messages proportionally to their length.
+    """
+    lengths = [len(message) or 1 for message in messages]
+    shares = [total_tokens * length // sum(lengths) for length in lengths]
+    shares[-1] += total_tokens - sum(shares)
+    return shares
+
+def extract_data_from_messages(messages):
+    """
+    Extracts many independent messages with one model call per EXTRACTION_BATCH_SIZE
+    uncached messages. Messages a batch response does not cover are extracted one by one.
+    Returns a list of {"data", "tokens", "error"} per message and the number of model calls.
+    Tokens of a batch call are split across its messages by message length.
+    """
+    reference_date = datetime.now().strftime('%Y-%m-%d')
+    results = [None] * len(messages)
+    pending = []
+    for index, message in enumerate(messages):
+        cached = extraction_cache.get(extraction_cache_key(message, reference_date))
+        if cached is not None:
+            results[index] = {"data": json.loads(cached), "tokens": 0, "error": None}
+        else:
+            pending.append(index)
+
+    batches = [pending[i:i + EXTRACTION_BATCH_SIZE] for i in range(0, len(pending), EXTRACTION_BATCH_SIZE)]
+    logging.debug(f"Extracting {len(pending)} of {len(messages)} messages in {len(batches)} batches.")
+    model_calls = len(batches)
+    if batches:
+        with ThreadPoolExecutor(max_workers=EXTRACTION_BATCH_CONCURRENCY, thread_name_prefix="batch-extraction") as pool:
+            responses = list(pool.map(lambda batch: _extract_batch([messages[i] for i in batch]), batches))
+    else:
+        responses = []
+
+    # Tokens of a batch call count for its messages even when they have to be extracted again
+    spent = {}
+    for batch, (extractions, total_tokens) in zip(batches, responses):
+        shares = _share_tokens(total_tokens, [messages[i] for i in batch])
+        for index, extraction, tokens in zip(batch, extractions, shares):
+            spent[index] = tokens
+            if extraction is None:
+                continue
+            results[index] = {"data": extraction, "tokens": tokens, "error": None}
+            cache_extraction(messages[index], extraction)
+
+    for index, result in enumerate(results):
+        if result is not None:
+            continue
+        logging.debug(f"Message {index} missing from batch response, extracting it alone.")
+        model_calls += 1
+        try:
+            data, tokens = extract_data_from_message(messages[index])
+            results[index] = {"data": data, "tokens": tokens + spent.get(index, 0), "error": None}
+        except ValueError as e:
+            logging.error(f"Could not extract message {index}: {e}")
+            results[index] = {"data": None, "tokens": spent.get(index, 0), "error": str(e)}
+    return results, model_calls
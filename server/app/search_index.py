@@ -0,0 +1,386 @@
+import os
+import re
+import json
+import math
+import time
+import zlib
+import sqlite3
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from .lazy import Lazy
+
+SEARCH_INDEX_ENABLED = os.getenv("SEARCH_INDEX_ENABLED", "false").lower() == "true"
+# Directory holding the vector file and the item database
+SEARCH_INDEX_PATH = os.getenv("SEARCH_INDEX_PATH", "search_index")
+# "hashing" works offline; "gemini" uses the Gemini embedding API
+SEARCH_EMBEDDER = os.getenv("SEARCH_EMBEDDER", "hashing")
+SEARCH_EMBEDDING_DIM = int(os.getenv("SEARCH_EMBEDDING_DIM", "256"))
+GEMINI_EMBEDDING_MODEL = os.getenv("GEMINI_EMBEDDING_MODEL", "models/gemini-embedding-001")
+# Queries score every item exactly up to this many items, and use the IVF index above
+SEARCH_ANN_THRESHOLD = int(os.getenv("SEARCH_ANN_THRESHOLD", "20000"))
+# IVF lists scanned per query; more lists means better recall and slower queries
+SEARCH_ANN_NPROBE = int(os.getenv("SEARCH_ANN_NPROBE", "16"))
+# The IVF index is retrained once this share of items has been added since the last training
+SEARCH_ANN_REBUILD_FRACTION = 0.2
+SEARCH_INITIAL_CAPACITY = 1024
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+class HashingEmbedder:
+    """
+    Feature hashing of words and character trigrams, so inflected forms
+    (mleko, mleka) still share most features. Needs no model or network.
+    """
+
+    name = "hashing"
+
+    def __init__(self, dim=SEARCH_EMBEDDING_DIM):
+        self.dim = dim
+
+    def _features(self, text: str):
+        for word in WORD_PATTERN.findall(text.lower()):
+            yield word, 1.0
+            padded = f"^{word}$"
+            for start in range(len(padded) - 2):
+                yield padded[start:start + 3], 0.5
+
+    def embed(self, texts):
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for feature, weight in self._features(text):
+                digest = zlib.crc32(feature.encode("utf-8"))
+                # The top bit picks the sign, so collisions cancel out instead of adding up
+                vectors[row, digest % self.dim] += weight if digest & 0x80000000 else -weight
+        return vectors
+
+
+class GeminiEmbedder:
+    name = "gemini"
+
+    def __init__(self, dim=SEARCH_EMBEDDING_DIM, model=GEMINI_EMBEDDING_MODEL):
+        self.dim = dim
+        self.model = model
+        self._client = Lazy(self._create_client)
+
+    def _create_client(self):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=self.model, google_api_key=os.getenv("GOOGLE_AI_API_KEY"))
+
+    def embed(self, texts):
+        vectors = self._client.get().embed_documents(list(texts), output_dimensionality=self.dim)
+        return np.asarray(vectors, dtype=np.float32)
+
+
+EMBEDDERS = {
+    "hashing": HashingEmbedder,
+    "gemini": GeminiEmbedder,
+}
+
+
+def normalize(vectors):
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k(scores, k):
+    """
+    Indexes of the `k` highest scores, best first.
+    """
+    if len(scores) <= k:
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+class VectorStore:
+    """
+    Unit-length float32 vectors in a memory-mapped file, grown by doubling its capacity.
+    Rows are only appended; `count` is kept by the caller.
+    """
+
+    def __init__(self, path: str, dim: int, count: int):
+        self.path = path
+        self.dim = dim
+        capacity = SEARCH_INITIAL_CAPACITY
+        if os.path.exists(path):
+            capacity = max(capacity, os.path.getsize(path) // (4 * dim))
+        while capacity < count:
+            capacity *= 2
+        self._open(capacity)
+
+    def _open(self, capacity: int):
+        with open(self.path, "ab") as f:
+            if f.tell() < capacity * self.dim * 4:
+                f.truncate(capacity * self.dim * 4)
+        self.capacity = capacity
+        self.vectors = np.memmap(self.path, dtype=np.float32, mode="r+", shape=(capacity, self.dim))
+
+    def write(self, position: int, vectors):
+        while position + len(vectors) > self.capacity:
+            self.vectors.flush()
+            # Readers holding the previous mapping keep a valid view of the rows they know about
+            self._open(self.capacity * 2)
+        self.vectors[position:position + len(vectors)] = vectors
+        self.vectors.flush()
+
+
+class IVFIndex:
+    """
+    Inverted file index: k-means centroids over the vectors, and per centroid the positions
+    of the vectors closest to it. A query scores the vectors of the `nprobe` closest lists.
+    """
+
+    def __init__(self, vectors, iterations=8, sample_per_list=64, seed=0):
+        count = len(vectors)
+        self.size = count
+        self.nlist = max(1, int(math.sqrt(count)))
+        rng = np.random.default_rng(seed)
+        sample = np.asarray(vectors[rng.choice(count, min(count, self.nlist * sample_per_list), replace=False)])
+        centroids = sample[rng.choice(len(sample), self.nlist, replace=False)].copy()
+        for _ in range(iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            filled = np.bincount(assignment, minlength=self.nlist) > 0
+            # Empty lists keep their previous centroid
+            centroids[filled] = normalize(sums[filled])
+        self.centroids = centroids
+
+        assignment = np.concatenate([
+            np.argmax(np.asarray(vectors[start:start + 8192]) @ centroids.T, axis=1)
+            for start in range(0, count, 8192)
+        ])
+        self.order = np.argsort(assignment, kind="stable")
+        self.offsets = np.concatenate(([0], np.cumsum(np.bincount(assignment, minlength=self.nlist))))
+
+    def candidates(self, query, nprobe: int):
+        lists = top_k(self.centroids @ query, nprobe)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+
+class SearchIndex:
+    """
+    Created items with their embeddings. Metadata is kept in SQLite, row `position`
+    matching the row of the vector file.
+    """
+
+    def __init__(self, path=SEARCH_INDEX_PATH, embedder=None, ann_threshold=SEARCH_ANN_THRESHOLD,
+                 nprobe=SEARCH_ANN_NPROBE):
+        os.makedirs(path, exist_ok=True)
+        self.embedder = embedder or EMBEDDERS[SEARCH_EMBEDDER]()
+        self.ann_threshold = ann_threshold
+        self.nprobe = nprobe
+        self._lock = threading.Lock()
+        self._ann = None
+        self._ann_building = False
+        self._conn = sqlite3.connect(os.path.join(path, "items.db"), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS items (
+                position INTEGER PRIMARY KEY,
+                type TEXT NOT NULL,
+                title TEXT,
+                text TEXT NOT NULL,
+                data TEXT NOT NULL,
+                response TEXT,
+                created_at REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+        self.count = self._conn.execute("SELECT COUNT(*) FROM items").fetchone()[0]
+        self.types = [row[0] for row in self._conn.execute("SELECT type FROM items ORDER BY position")]
+        self._types_array = None
+        self.store = VectorStore(os.path.join(path, "vectors.f32"), self.embedder.dim, self.count)
+
+        signature = f"{self.embedder.name}:{self.embedder.dim}"
+        stored = self._conn.execute("SELECT value FROM meta WHERE key = 'embedder'").fetchone()
+        if stored and stored[0] != signature and self.count:
+            logging.debug(f"Embedder changed from {stored[0]} to {signature}, re-embedding {self.count} items.")
+            self._reembed()
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('embedder', ?)", (signature,))
+        self._conn.commit()
+        self._maybe_build_ann()
+
+    def _reembed(self, batch=256):
+        for start in range(0, self.count, batch):
+            texts = [row[0] for row in self._conn.execute(
+                "SELECT text FROM items WHERE position >= ? ORDER BY position LIMIT ?", (start, batch)
+            )]
+            self.store.write(start, normalize(self.embedder.embed(texts)))
+
+    def add(self, items):
+        """
+        `items` are dicts with `type`, `title`, `text`, `data` and optionally `response`.
+        """
+        if not items:
+            return
+        vectors = normalize(self.embedder.embed([item["text"] for item in items]))
+        now = time.time()
+        with self._lock:
+            position = self.count
+            # The vectors are written first; rows past `count` are overwritten if the insert fails
+            self.store.write(position, vectors)
+            self._conn.executemany(
+                "INSERT INTO items (position, type, title, text, data, response, created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        position + offset, item["type"], item.get("title"), item["text"],
+                        json.dumps(item["data"], ensure_ascii=False, default=str),
+                        json.dumps(item.get("response"), ensure_ascii=False, default=str),
+                        now
+                    )
+                    for offset, item in enumerate(items)
+                ]
+            )
+            self._conn.commit()
+            self.types.extend(item["type"] for item in items)
+            self._types_array = None
+            self.count += len(items)
+        self._maybe_build_ann()
+
+    def _maybe_build_ann(self):
+        """
+        Trains the IVF index once past the threshold, and retrains it as the index grows.
+        Runs on the caller's thread, which is the index writer thread for additions.
+        """
+        with self._lock:
+            count = self.count
+            ann = self._ann
+            stale = ann is None or count - ann.size > ann.size * SEARCH_ANN_REBUILD_FRACTION
+            if count < self.ann_threshold or not stale or self._ann_building:
+                return
+            self._ann_building = True
+            vectors = self.store.vectors
+        try:
+            started = time.perf_counter()
+            self._ann = IVFIndex(vectors[:count])
+            logging.debug(f"Built IVF index over {count} items in {time.perf_counter() - started:.2f}s.")
+        finally:
+            self._ann_building = False
+
+    def search(self, query: str, k: int = 10, item_type: str = None, exact: bool = False):
+        query_vector = normalize(self.embedder.embed([query]))[0]
+        with self._lock:
+            count = self.count
+            vectors = self.store.vectors
+            ann = None if exact else self._ann
+            if item_type and self._types_array is None:
+                self._types_array = np.asarray(self.types)
+            types = self._types_array
+
+        started = time.perf_counter()
+        if ann is not None:
+            # Items added since the index was trained are scored exactly
+            positions = np.concatenate((ann.candidates(query_vector, self.nprobe), np.arange(ann.size, count)))
+            strategy = "ivf"
+        else:
+            positions = None
+            strategy = "exact"
+        if item_type:
+            mask = types == item_type
+            positions = np.flatnonzero(mask) if positions is None else positions[mask[positions]]
+        if positions is None:
+            scores = vectors[:count] @ query_vector
+            best = top_k(scores, k)
+            best_positions, best_scores = best, scores[best]
+        else:
+            scores = vectors[positions] @ query_vector
+            best = top_k(scores, k)
+            best_positions, best_scores = positions[best], scores[best]
+        scoring_ms = (time.perf_counter() - started) * 1000
+
+        rows = self._load([int(position) for position in best_positions])
+        return {
+            "strategy": strategy,
+            "items": count,
+            "scoring_ms": round(scoring_ms, 3),
+            "results": [
+                {**rows[int(position)], "score": round(float(score), 4)}
+                for position, score in zip(best_positions, best_scores)
+                if int(position) in rows
+            ]
+        }
+
+    def _load(self, positions):
+        if not positions:
+            return {}
+        placeholders = ", ".join("?" for _ in positions)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT position, type, title, text, data, response, created_at FROM items WHERE position IN ({placeholders})",
+                positions
+            ).fetchall()
+        return {
+            row[0]: {
+                "type": row[1],
+                "title": row[2],
+                "text": row[3],
+                "data": json.loads(row[4]),
+                "response": json.loads(row[5]) if row[5] else None,
+                "created_at": row[6]
+            }
+            for row in rows
+        }
+
+    def stats(self):
+        with self._lock:
+            return {
+                "items": self.count,
+                "embedder": self.embedder.name,
+                "dim": self.embedder.dim,
+                "capacity": self.store.capacity,
+                "ann": {"lists": self._ann.nlist, "trained_on": self._ann.size} if self._ann else None,
+                "ann_threshold": self.ann_threshold
+            }
+
+
+def item_text(item_type: str, data: dict):
+    """
+    The text embedded for a created item: its title and the fields worth searching by.
+    """
+    fields = {
+        "google_task": ("title", "description", "due_date"),
+        "google_calendar": ("title", "description", "start_datetime"),
+    }.get(item_type, ("title", "content"))
+    return "\n".join(str(data[field]) for field in fields if data.get(field))
+
+
+search_index = Lazy(SearchIndex)
+
+# One writer thread: embedding stays off the request path and additions are serialized
+_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="search-index")
+
+
+def _index(items):
+    try:
+        search_index.get().add(items)
+    except Exception as e:
+        logging.error(f"Could not index {len(items)} created items: {e}")
+
+
+def index_created_items(responses):
+    """
+    Queues the successfully created items of a command for indexing.
+    """
+    if not SEARCH_INDEX_ENABLED:
+        return
+    items = [
+        {
+            "type": response["type"],
+            "title": response["data"].get("title"),
+            "text": item_text(response["type"], response["data"]),
+            "data": response["data"],
+            # Links and ids; the full Notion page is not worth keeping
+            "response": {key: value for key, value in response["response"].items() if key != "page_data"}
+        }
+        for response in responses
+        if (response.get("response") or {}).get("success")
+    ]
+    if items:
+        _index_executor.submit(_index, items)
@@ -0,0 +1,78 @@
+import os
+import json
+import asyncio
+import logging
+from fastapi.responses import StreamingResponse
+
+# Comment lines sent while no event is ready, so proxies keep the connection open
+SSE_KEEPALIVE_INTERVAL = float(os.getenv("SSE_KEEPALIVE_INTERVAL", "15"))
+
+# Closes the stream; carries no event
+_END = object()
+
+
+def format_event(event: str, data):
+    payload = json.dumps(data, ensure_ascii=False, default=str)
+    return f"event: {event}\ndata: {payload}\n\n"
+
+
+class ProgressStream:
+    """
+    Server-sent events from processing running on a worker thread.
+    `emit` may be called from any thread; the processing keeps running, and finishes
+    its writes, when the client disconnects.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self.closed = False
+
+    def emit(self, event: str, data=None):
+        if not self.closed:
+            self._loop.call_soon_threadsafe(self._queue.put_nowait, (event, data or {}))
+
+    def on_stage(self, stage: str):
+        self.emit("stage", {"stage": stage})
+
+    def run(self, executor, func, *args, on_finished=None):
+        """
+        Runs `func(*args, on_stage=..., on_progress=...)` on `executor`; its result is
+        sent as the final `done` event, an exception as `error`.
+        """
+        def work():
+            try:
+                result = func(*args, on_stage=self.on_stage, on_progress=self.emit)
+                self.emit("done", result)
+            except Exception as e:
+                logging.error(f"Error in streamed processing: {e}")
+                self.emit("error", {"detail": str(e)})
+            finally:
+                self._loop.call_soon_threadsafe(self._queue.put_nowait, _END)
+
+        future = self._loop.run_in_executor(executor, work)
+        if on_finished:
+            future.add_done_callback(lambda _: on_finished())
+        return future
+
+    async def events(self):
+        try:
+            while True:
+                try:
+                    item = await asyncio.wait_for(self._queue.get(), SSE_KEEPALIVE_INTERVAL)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                if item is _END:
+                    return
+                yield format_event(*item)
+        finally:
+            # Client gone or stream finished; later events are dropped, the work goes on
+            self.closed = True
+
+    def response(self):
+        return StreamingResponse(
+            self.events(),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+        )
@@ -0,0 +1,107 @@
+import re
+import json
+import logging
+
+# Trailing commas before a closing bracket, a common model mistake
+_TRAILING_COMMA = re.compile(r",(\s*[}\]])")
+
+
+def loads_tolerant(text: str):
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(_TRAILING_COMMA.sub(r"\1", text))
+
+
+class IncrementalItemParser:
+    """
+    Consumes model output piece by piece and yields every object inside the top-level
+    arrays of the response (`{"tasks": [{...}, ...], ...}`) as soon as it is closed.
+
+    Tolerates text around the JSON (e.g. a ```json fence), unquoted top-level keys
+    and trailing commas inside items. `items` keeps every completed item by key.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.items = {}
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._string_start = None
+        self._last_string = None
+        self._bare = ""
+        self._key = None
+        self._array_key = None
+        self._item_start = None
+        self._done = False
+
+    def feed(self, chunk: str):
+        """
+        Appends `chunk` and returns a list of `(key, item)` pairs completed by it.
+        """
+        self.text += chunk
+        completed = []
+        text = self.text
+        while self._pos < len(text) and not self._done:
+            char = text[self._pos]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1:
+                        self._last_string = text[self._string_start + 1:self._pos]
+            elif char == '"':
+                if self._depth > 0:
+                    self._in_string = True
+                    self._string_start = self._pos
+            elif char in "{[":
+                self._open(char)
+            elif char in "}]":
+                item = self._close(char)
+                if item is not None:
+                    completed.append(item)
+            elif self._depth == 1:
+                self._top_level_char(char)
+            self._pos += 1
+        return completed
+
+    def _open(self, char):
+        if self._depth == 1 and char == "[":
+            self._array_key = self._key
+        elif self._depth == 2 and char == "{":
+            self._item_start = self._pos
+        self._depth += 1
+
+    def _close(self, char):
+        self._depth -= 1
+        if self._depth == 0:
+            self._done = True
+        elif self._depth == 1:
+            self._array_key = None
+            self._key = None
+        elif self._depth == 2 and char == "}" and self._item_start is not None:
+            raw = self.text[self._item_start:self._pos + 1]
+            self._item_start = None
+            try:
+                item = loads_tolerant(raw)
+                self.items.setdefault(self._array_key, []).append(item)
+                return self._array_key, item
+            except json.JSONDecodeError as e:
+                logging.error(f"Could not decode streamed item for {self._array_key}: {e}")
+        return None
+
+    def _top_level_char(self, char):
+        if char == ":":
+            self._key = self._last_string if self._last_string is not None else self._bare.strip()
+            self._last_string = None
+            self._bare = ""
+        elif char == ",":
+            self._last_string = None
+            self._bare = ""
+        elif char.isalnum() or char == "_":
+            self._bare += char
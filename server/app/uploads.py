@@ -0,0 +1,94 @@
+import os
+import hashlib
+import logging
+import tempfile
+from fastapi import HTTPException, Request
+
+AUDIO_SPOOL_THRESHOLD = int(os.getenv("AUDIO_SPOOL_THRESHOLD", str(512 * 1024)))
+
+
+class AudioUpload:
+    """
+    Audio payload received in chunks. Kept in memory up to `spool_threshold` bytes,
+    larger uploads are spooled to a named temporary file so they can be passed on by path.
+    The SHA-256 digest is computed while the data arrives.
+    """
+
+    def __init__(self, spool_threshold=AUDIO_SPOOL_THRESHOLD):
+        self.spool_threshold = spool_threshold
+        self.size = 0
+        self.path = None
+        self._chunks = []
+        self._file = None
+        self._sha256 = hashlib.sha256()
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        upload = cls(spool_threshold=len(data) + 1)
+        upload.write(data)
+        return upload
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        self._sha256.update(chunk)
+        if self._file is None and self.size > self.spool_threshold:
+            self._file = tempfile.NamedTemporaryFile(suffix=".3gp", delete=False)
+            self.path = self._file.name
+            for buffered in self._chunks:
+                self._file.write(buffered)
+            self._chunks = []
+        if self._file is not None:
+            self._file.write(chunk)
+        else:
+            self._chunks.append(chunk)
+
+    def finish(self):
+        if self._file is not None:
+            self._file.close()
+
+    @property
+    def in_memory(self):
+        return self.path is None
+
+    def hexdigest(self):
+        return self._sha256.hexdigest()
+
+    def getvalue(self):
+        if self.in_memory:
+            if len(self._chunks) > 1:
+                self._chunks = [b"".join(self._chunks)]
+            return self._chunks[0] if self._chunks else b""
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self):
+        self._chunks = []
+        if self._file is not None:
+            self._file.close()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+        self.path = None
+
+
+async def receive_audio(request: Request, max_bytes: int, too_large_detail: str):
+    """
+    Reads the request body chunk by chunk and rejects it with 413 as soon as
+    it exceeds `max_bytes`, without buffering the rest of the upload.
+    """
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_bytes:
+        logging.error("Audio file is too large")
+        raise HTTPException(status_code=413, detail=too_large_detail)
+
+    upload = AudioUpload()
+    try:
+        async for chunk in request.stream():
+            if upload.size + len(chunk) > max_bytes:
+                logging.error("Audio file is too large")
+                raise HTTPException(status_code=413, detail=too_large_detail)
+            upload.write(chunk)
+        upload.finish()
+    except BaseException:
+        upload.close()
+        raise
+    return upload
@@ -0,0 +1,36 @@
+import os
+import logging
+import threading
+from .prompts import gemini
+from .audio import genai_configured
+from .integrations.googleTasksConnector import tasks_service
+from .integrations.googleCalendarConnector import calendar_service
+from .integrations.notionConnector import notion
+
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "false").lower() == "true"
+
+# Lazily created clients, in the order they are warmed up
+WARMUP_TARGETS = {
+    "gemini": gemini,
+    "genai": genai_configured,
+    "notion": notion,
+    "google_tasks": tasks_service,
+    "google_calendar": calendar_service,
+}
+
+def warm_up():
+    for name, target in WARMUP_TARGETS.items():
+        try:
+            target.get()
+            logging.debug(f"Warmed up {name}.")
+        except Exception as e:
+            logging.error(f"Could not warm up {name}: {e}")
+
+def start_background_warmup():
+    """
+    Initializes connectors in a daemon thread, so the server starts accepting requests
+    immediately and does not fail to start when Google is unreachable.
+    """
+    thread = threading.Thread(target=warm_up, name="warmup", daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,120 @@
+"""
+Email ingestion against the local IMAP and Gemini stand-ins: fills a mailbox with
+a mix of actionable mail, mailing lists and mail without keywords, then times the
+backfill (bulk header fetch, prefilter, partial body fetch, batch extraction), an
+incremental poll after new mail arrives, an idle poll, and a rescan after UIDVALIDITY
+changes. A sample of messages processed one at a time (fetch, then one extraction
+each) gives the baseline rate.
+
+Run from the server/ directory:
+    python -m bench.email_ingest
+    python -m bench.email_ingest --messages 10000 --gemini-latency 1.0 --imap-latency 0.05
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+from .search_index import PEOPLE, PLACES, TOPICS, VERBS, PRODUCTS
+
+
+def make_message(number, kind, rng):
+    message = EmailMessage()
+    message["Message-ID"] = f"<bench-{number}@example.com>"
+    message["Subject"] = f"Wiadomość {number}"
+    if kind == "actionable":
+        message["From"] = f"{rng.choice(['Anna', 'Tomek', 'Kasia', 'Marek'])} <osoba{number % 50}@example.com>"
+        message.set_content(
+            f"Cześć,\n{rng.choice(VERBS)} {rng.choice(PEOPLE)} w sprawie {rng.choice(TOPICS)} jutro o 10.\n"
+            f"Spotkanie w {rng.choice(PLACES)}, kup też {rng.choice(PRODUCTS)}.\n\n> poprzednia wiadomość\n-- \nPozdrawiam"
+        )
+    elif kind == "list":
+        message["From"] = "Sklep <newsletter@sklep.example.com>"
+        message["List-Id"] = "<promocje.sklep.example.com>"
+        message["List-Unsubscribe"] = "<https://sklep.example.com/wypisz>"
+        message.set_content(f"Promocje tygodnia: {', '.join(rng.sample(PRODUCTS, 4))}.")
+        message.add_alternative(f"<html><body><p>Promocje tygodnia</p>{'<br>' * 200}</body></html>", subtype="html")
+    else:
+        message["From"] = f"Znajomy <znajomy{number % 20}@example.com>"
+        message.set_content("Dzięki za wczoraj, było bardzo miło. Do usłyszenia!")
+    return message.as_bytes(policy=message.policy.clone(linesep="\r\n"))
+
+
+def fill(imap, count, rng, start=0, days=20):
+    kinds = ["actionable"] * 4 + ["list"] * 4 + ["other"] * 2
+    now = datetime.now()
+    for number in range(start, start + count):
+        imap.add_message(make_message(number, rng.choice(kinds), rng), now - timedelta(days=rng.uniform(0, days)))
+
+
+def model_calls(gemini):
+    return sum(1 for kind, _, _ in gemini.records if kind.startswith("gemini_"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--gemini-latency", type=float, default=0.8, help="seconds per model call")
+    parser.add_argument("--imap-latency", type=float, default=0.02, help="seconds per IMAP command")
+    parser.add_argument("--fetch-batch", type=int, default=500)
+    parser.add_argument("--process-batch", type=int, default=50)
+    parser.add_argument("--baseline-sample", type=int, default=30)
+    args = parser.parse_args()
+
+    from .fakes import start_fakes, fake_environment, FakeImap
+    fakes = start_fakes(latency={"gemini": args.gemini_latency})
+    imap = FakeImap(latency=args.imap_latency).start()
+    host, port = imap.address
+    os.environ.update(fake_environment(fakes, tempfile.mkdtemp()))
+    os.environ.update({
+        "IMAP_HOST": host, "IMAP_PORT": str(port), "IMAP_SSL": "false", "IMAP_USER": "bench", "IMAP_PASSWORD": "bench",
+        "EMAIL_BACKFILL_DAYS": "30", "EMAIL_FETCH_BATCH": str(args.fetch_batch), "EMAIL_PROCESS_BATCH": str(args.process_batch),
+    })
+    rng = random.Random(0)
+    fill(imap, args.messages, rng)
+
+    from app.email_ingest import EmailIngestor, EmailStore, fetched_items
+    from app.processing import process_text_and_get_response
+    ingestor = EmailIngestor(EmailStore(os.environ["EMAIL_DB_PATH"]))
+    gemini = fakes["gemini"]
+
+    def run(label):
+        gemini.reset()
+        imap.fetched = {"headers": 0, "bodies": 0}
+        stats = ingestor.poll()
+        rate = stats["fetched"] / stats["duration_seconds"] if stats["duration_seconds"] else 0
+        print(f"{label:<18} {stats['duration_seconds']:7.2f}s  {rate:7.1f} msg/s  "
+              f"fetched={stats['fetched']} processed={stats['processed']} skipped={stats['skipped']} failed={stats['failed']} write_failed={stats['write_failed']}  "
+              f"headers={imap.fetched['headers']} bodies={imap.fetched['bodies']} model_calls={model_calls(gemini)}")
+
+    print(f"{args.messages} messages, {args.gemini_latency}s per model call, {args.imap_latency}s per IMAP command\n")
+    run("backfill")
+    fill(imap, 20, rng, start=args.messages, days=0)
+    run("incremental")
+    run("idle")
+    imap.reset_uidvalidity()
+    run("uidvalidity reset")
+    print(f"skipped by reason: {ingestor.store.counts()['skipped']}")
+
+    # One message at a time: a FETCH round trip per message and one extraction each, no prefilter
+    connection = ingestor.connect()
+    gemini.reset()
+    started = time.perf_counter()
+    for uid in range(1, args.baseline_sample + 1):
+        status, data = connection.uid("FETCH", str(uid), "(UID BODY.PEEK[])")
+        for _, raw in fetched_items(data):
+            process_text_and_get_response(raw.decode("utf-8", "replace"))
+    connection.logout()
+    per_message = (time.perf_counter() - started) / args.baseline_sample
+    print(f"\none at a time:     {1 / per_message:7.1f} msg/s over {args.baseline_sample} messages "
+          f"(~{per_message * args.messages:.0f}s for the backfill)")
+
+    imap.stop()
+    for fake in fakes.values():
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,776 @@
+"""
+Local stand-ins for the remote services used by the server: Gemini, Notion,
+Google Tasks, Google Calendar and ntfy. Each one runs its own HTTP server on
+127.0.0.1 with configurable latency and error rate, and records how long it
+spent on every request. FakeImap is a plain-text IMAP server for email ingestion.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import email
+import random
+import threading
+import socketserver
+from datetime import datetime, timezone
+from urllib.parse import urlsplit, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SAMPLE_TRANSCRIPTION = (
+    "Jutro o dziesiątej spotkanie z Anną w sprawie projektu. "
+    "Muszę kupić mleko, chleb i jabłka. "
+    "Przypomnij mi, żeby zadzwonić do hydraulika w piątek."
+)
+
+
+def sample_extraction(tasks=1, events=1, notes=1, shopping_lists=1):
+    return {
+        "tasks": [
+            {"title": f"Zadanie {i + 1}", "description": "Opis zadania", "due_date": "2030-01-10"}
+            for i in range(tasks)
+        ],
+        "events": [
+            {
+                "title": f"Spotkanie {i + 1}",
+                "description": "Omówienie projektu",
+                "start_datetime": "2030-01-11 12:00:00",
+                "end_datetime": "2030-01-11 13:00:00"
+            }
+            for i in range(events)
+        ],
+        "notes": [
+            {"title": f"Notatka {i + 1}", "content": "Treść notatki\n - punkt pierwszy\n - punkt drugi"}
+            for i in range(notes)
+        ],
+        "shopping_lists": [
+            {"content": "Nabiał\n - Mleko\nPieczywo\n - Chleb"}
+            for _ in range(shopping_lists)
+        ]
+    }
+
+
+# Message tags of batch extraction prompts, quotes escaped inside the JSON request body
+BATCH_MESSAGE_PATTERN = re.compile(rb'(?:<|\\u003c)message index=\\"(\d+)\\"')
+
+
+class StreamBody:
+    """
+    Response body sent with chunked transfer encoding, `delay` seconds apart.
+    """
+
+    def __init__(self, chunks, content_type, delay=0.0):
+        self.chunks = chunks
+        self.content_type = content_type
+        self.delay = delay
+
+
+class FakeService:
+    """
+    Base for a fake HTTP API. Subclasses implement `handle(method, path, body)`
+    returning `(status, payload)` or `(status, payload, headers)`; payload is sent as JSON
+    unless it is bytes or a StreamBody.
+    """
+
+    name = "service"
+
+    def __init__(self, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.records = []
+        self._records_lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}"
+
+    def start(self):
+        service = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def _dispatch(self):
+                started = time.perf_counter()
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                status, payload, kind, headers = service.respond(self.command, self.path, self.headers, body)
+                if isinstance(payload, StreamBody):
+                    self._send_stream(status, payload)
+                else:
+                    data = payload if isinstance(payload, bytes) else json.dumps(payload).encode("utf-8")
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    for name, value in headers.items():
+                        self.send_header(name, value)
+                    self.end_headers()
+                    self.wfile.write(data)
+                service.record(kind, time.perf_counter() - started, status)
+
+            def _send_stream(self, status, stream):
+                self.send_response(status)
+                self.send_header("Content-Type", stream.content_type)
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                for chunk in stream.chunks:
+                    if stream.delay:
+                        time.sleep(stream.delay)
+                    self.wfile.write(f"{len(chunk):x}\r\n".encode() + chunk + b"\r\n")
+                    self.wfile.flush()
+                self.wfile.write(b"0\r\n\r\n")
+
+            do_GET = do_POST = do_PATCH = do_PUT = do_DELETE = _dispatch
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name=f"fake-{self.name}", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+    def respond(self, method, path, headers, body):
+        delay = self.latency + random.uniform(0, self.jitter)
+        if delay:
+            time.sleep(delay)
+        if self.error_rate and random.random() < self.error_rate:
+            return self.error_status, {"error": {"code": self.error_status, "message": "Injected error"}}, "error", {}
+        status, payload, *extra = self.handle(method, path, headers, body)
+        return status, payload, self.kind(method, path, body), extra[0] if extra else {}
+
+    def kind(self, method, path, body):
+        return self.name
+
+    def record(self, kind, duration, status):
+        with self._records_lock:
+            self.records.append((kind, duration, status))
+
+    def reset(self):
+        with self._records_lock:
+            self.records = []
+
+    def handle(self, method, path, headers, body):
+        raise NotImplementedError
+
+
+class FakeGemini(FakeService):
+    """
+    Gemini REST API (generateContent and streamGenerateContent). Requests carrying
+    inline audio are answered with a transcription (plus the extraction when JSON output
+    is requested, as in the single-pass audio mode), everything else with an extraction JSON.
+    Streamed responses are split into `stream_chunk_size` characters sent
+    `stream_chunk_delay` seconds apart, as a JSON array or as SSE with ?alt=sse.
+    `model_latency` adds extra seconds per model name and `malformed_rate` makes a model
+    answer extractions with text that is not JSON, e.g. to exercise model routing.
+    `transcription_latency` adds extra seconds to requests carrying audio, like long recordings.
+    Batch extraction prompts get one extraction record per <message> tag.
+
+    Also serves the File API used for uploads spooled to disk: the discovery document,
+    resumable uploads, and getting and deleting files. Requests referring to an uploaded
+    file count as carrying audio; `files` holds the size of every file not deleted.
+    """
+
+    name = "gemini"
+
+    def __init__(self, extraction=None, transcription=SAMPLE_TRANSCRIPTION, prompt_tokens=None, output_tokens=200,
+                 stream_chunk_size=40, stream_chunk_delay=0.02, model_latency=None, malformed_rate=None, transcription_latency=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.model_latency = model_latency or {}
+        self.transcription_latency = transcription_latency
+        self.malformed_rate = malformed_rate or {}
+        self.extraction = extraction or sample_extraction()
+        self.transcription = transcription
+        self.prompt_tokens = prompt_tokens
+        self.output_tokens = output_tokens
+        self.stream_chunk_size = stream_chunk_size
+        self.stream_chunk_delay = stream_chunk_delay
+        self.files = {}
+        self._uploads = {}
+
+    def _candidate(self, text, usage, prompt_tokens=0):
+        response = {
+            "candidates": [{
+                "content": {"role": "model", "parts": [{"text": text}]},
+                "index": 0
+            }]
+        }
+        if usage:
+            response["candidates"][0]["finishReason"] = "STOP"
+            response["usageMetadata"] = {
+                "promptTokenCount": prompt_tokens,
+                "candidatesTokenCount": self.output_tokens,
+                "totalTokenCount": prompt_tokens + self.output_tokens
+            }
+        return response
+
+    def _prompt_tokens(self, body):
+        # Without a fixed count, roughly 4 bytes of request per token
+        return self.prompt_tokens if self.prompt_tokens is not None else len(body) // 4
+
+    def _stream(self, path, text, prompt_tokens):
+        pieces = [text[i:i + self.stream_chunk_size] for i in range(0, len(text), self.stream_chunk_size)]
+        responses = [self._candidate(piece, i == len(pieces) - 1, prompt_tokens) for i, piece in enumerate(pieces)]
+        if "alt=sse" in path:
+            chunks = [f"data: {json.dumps(response)}\r\n\r\n".encode("utf-8") for response in responses]
+            return StreamBody(chunks, "text/event-stream", self.stream_chunk_delay)
+        chunks = [
+            (("[" if i == 0 else ",") + json.dumps(response)).encode("utf-8")
+            for i, response in enumerate(responses)
+        ] + [b"]"]
+        return StreamBody(chunks, "application/json", self.stream_chunk_delay)
+
+    def _file(self, name):
+        return {
+            "name": name, "mimeType": "audio/3gpp", "sizeBytes": str(self.files[name]),
+            "uri": f"{self.url}/v1beta/{name}", "state": "ACTIVE"
+        }
+
+    def _discovery(self):
+        schema = {"type": "object", "additionalProperties": {"type": "any"}}
+        return {
+            "kind": "discovery#restDescription", "discoveryVersion": "v1", "id": "generativelanguage:v1beta",
+            "name": "generativelanguage", "version": "v1beta", "protocol": "rest",
+            "rootUrl": f"{self.url}/", "servicePath": "", "baseUrl": f"{self.url}/", "batchPath": "batch",
+            "parameters": {"key": {"type": "string", "location": "query"}, "alt": {"type": "string", "location": "query"}},
+            "schemas": {"CreateFileRequest": {"id": "CreateFileRequest", **schema}, "CreateFileResponse": {"id": "CreateFileResponse", **schema}},
+            "resources": {"media": {"methods": {"upload": {
+                "id": "generativelanguage.media.upload", "path": "v1beta/files", "flatPath": "v1beta/files",
+                "httpMethod": "POST", "parameters": {}, "parameterOrder": [],
+                "request": {"$ref": "CreateFileRequest"}, "response": {"$ref": "CreateFileResponse"},
+                "supportsMediaUpload": True,
+                "mediaUpload": {"accept": ["*/*"], "maxSize": "2147483648", "protocols": {
+                    "simple": {"multipart": True, "path": "/upload/v1beta/files"},
+                    "resumable": {"multipart": True, "path": "/resumable/upload/v1beta/files"}
+                }}
+            }}}}
+        }
+
+    def handle_files(self, method, path, body):
+        route = path.split("?")[0]
+        if route == "/$discovery/rest":
+            return 200, self._discovery()
+        if route == "/upload/v1beta/files" and method == "POST":
+            upload_id = uuid.uuid4().hex
+            self._uploads[upload_id] = f"files/{upload_id[:12]}"
+            return 200, {}, {"Location": f"{self.url}/upload/v1beta/files?upload_id={upload_id}"}
+        if route == "/upload/v1beta/files" and method == "PUT":
+            name = self._uploads.pop(parse_qs(urlsplit(path).query).get("upload_id", [""])[0], None)
+            if name is None:
+                return 404, {"error": {"code": 404, "message": "Unknown upload"}}
+            self.files[name] = len(body)
+            return 200, {"file": self._file(name)}
+        name = route[len("/v1beta/"):]
+        if name not in self.files:
+            return 404, {"error": {"code": 404, "message": f"File {name} not found"}}
+        if method == "DELETE":
+            del self.files[name]
+            return 200, {}
+        return 200, self._file(name)
+
+    def kind(self, method, path, body):
+        route = path.split("?")[0]
+        if route == "/$discovery/rest":
+            return "gemini_file_discovery"
+        if route.startswith("/upload/") or route.startswith("/v1beta/files/"):
+            return {"POST": "gemini_file_upload_start", "PUT": "gemini_file_upload", "DELETE": "gemini_file_delete"}.get(
+                method, "gemini_file_get"
+            )
+        has_audio = b"inlineData" in body or b"inline_data" in body or b"fileData" in body or b"file_data" in body
+        wants_json = b"responseMimeType" in body or b"response_mime_type" in body
+        if has_audio and wants_json:
+            return "gemini_transcription_extraction"
+        if has_audio:
+            return "gemini_transcription"
+        return "gemini_batch_extraction" if BATCH_MESSAGE_PATTERN.search(body) else "gemini_extraction"
+
+    @staticmethod
+    def model_name(path):
+        # /v1beta/models/<model>:generateContent
+        return path.split("?")[0].rsplit("/", 1)[-1].split(":")[0]
+
+    def handle(self, method, path, headers, body):
+        if path.startswith(("/$discovery/", "/upload/", "/v1beta/files/")):
+            return self.handle_files(method, path, body)
+        if b"fileUri" in body or b"file_uri" in body:
+            uris = re.findall(rb'"file_?[uU]ri": ?"[^"]*/v1beta/(files/[^"]+)"', body)
+            if not uris or any(uri.decode() not in self.files for uri in uris):
+                return 400, {"error": {"code": 400, "message": "File not found or not uploaded"}}
+        if ":generateContent" not in path and ":streamGenerateContent" not in path:
+            return 404, {"error": {"code": 404, "message": f"Unknown path {path}"}}
+        model = self.model_name(path)
+        if self.model_latency.get(model):
+            time.sleep(self.model_latency[model])
+        kind = self.kind(method, path, body)
+        if self.transcription_latency and kind.startswith("gemini_transcription"):
+            time.sleep(self.transcription_latency)
+        if kind == "gemini_transcription":
+            text = self.transcription
+        elif kind == "gemini_transcription_extraction":
+            text = json.dumps({"transcription": self.transcription, **self.extraction}, ensure_ascii=False)
+        elif random.random() < self.malformed_rate.get(model, 0.0):
+            text = "Oto wyodrębnione informacje: zadania, wydarzenia i notatki."
+        elif kind == "gemini_batch_extraction":
+            indexes = sorted({int(index) for index in BATCH_MESSAGE_PATTERN.findall(body)})
+            records = [{"index": index, **self.extraction} for index in indexes]
+            text = "```json\n" + json.dumps({"messages": records}, ensure_ascii=False) + "\n```"
+        else:
+            text = "```json\n" + json.dumps(self.extraction, ensure_ascii=False) + "\n```"
+        prompt_tokens = self._prompt_tokens(body)
+        if ":streamGenerateContent" in path:
+            return 200, self._stream(path, text, prompt_tokens)
+        return 200, self._candidate(text, True, prompt_tokens)
+
+
+class FakeNotion(FakeService):
+    """
+    Notion pages and block children. Requests over Notion's limits (100 blocks,
+    2000 characters per rich_text item) are rejected like by the real API;
+    `rate_limit_rate` answers a share of requests with 429 rate_limited.
+    """
+
+    name = "notion"
+
+    def __init__(self, rate_limit_rate=0.0, **kwargs):
+        super().__init__(**kwargs)
+        self.rate_limit_rate = rate_limit_rate
+        self.blocks = {}
+
+    def kind(self, method, path, body):
+        return "notion_append" if "/v1/blocks/" in path else "notion"
+
+    @staticmethod
+    def invalid_children(children):
+        if len(children) > 100:
+            return f"body.children.length should be ≤ 100, instead was {len(children)}."
+        for block in children:
+            for item in block.get(block.get("type"), {}).get("rich_text", []):
+                if len(item.get("text", {}).get("content", "")) > 2000:
+                    return "body.children[].rich_text[].text.content.length should be ≤ 2000."
+        return None
+
+    def handle(self, method, path, headers, body):
+        if self.rate_limit_rate and random.random() < self.rate_limit_rate:
+            return 429, {"object": "error", "status": 429, "code": "rate_limited", "message": "Rate limited"}
+        payload = json.loads(body or b"{}")
+        children = payload.get("children", [])
+        error = self.invalid_children(children)
+        if error:
+            return 400, {"object": "error", "status": 400, "code": "validation_error", "message": error}
+        if method == "POST" and path.rstrip("/").endswith("/v1/pages"):
+            page_id = str(uuid.uuid4())
+            self.blocks[page_id] = list(children)
+            return 200, {"object": "page", "id": page_id, "url": f"https://www.notion.so/{page_id.replace('-', '')}"}
+        if method == "PATCH" and "/v1/blocks/" in path and path.rstrip("/").endswith("/children"):
+            page_id = path.rstrip("/").split("/")[-2]
+            self.blocks.setdefault(page_id, []).extend(children)
+            return 200, {"object": "list", "results": [{"object": "block", "id": str(uuid.uuid4())} for _ in children]}
+        if method == "PATCH" and "/v1/pages/" in path:
+            page_id = path.rstrip("/").split("/")[-1]
+            return 200, {"object": "page", "id": page_id, "archived": payload.get("archived", False)}
+        return 404, {"object": "error", "status": 404, "message": f"Unknown path {path}"}
+
+
+def _rfc3339_now():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+
+class FakeGoogle(FakeService):
+    """
+    Google Tasks and Calendar APIs, served under /tasks/v1 and /calendar/v3
+    like on googleapis.com, with multipart batch requests on their batch paths.
+    Created events and tasks are kept, and listed with paging, Calendar sync tokens
+    and Tasks updatedMin.
+    """
+
+    name = "google"
+    batch_paths = ("/batch", "/batch/calendar/v3")
+    # Lifetime in seconds of the access tokens issued on refresh
+    token_lifetime = 3600
+    tasklist_id = "default-list"
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._store_lock = threading.Lock()
+        # Every change gets the next sequence number; a sync token is the last one seen
+        self.sequence = 0
+        self.sync_token_floor = 0
+        self.events = {}
+        self.tasks = {}
+
+    def put_event(self, event):
+        with self._store_lock:
+            self.sequence += 1
+            event = {"kind": "calendar#event", "id": uuid.uuid4().hex, "status": "confirmed", **event, "updated": _rfc3339_now()}
+            self.events[event["id"]] = (self.sequence, event)
+        return event
+
+    def delete_event(self, event_id):
+        _, event = self.events[event_id]
+        self.put_event({**event, "status": "cancelled"})
+
+    def put_task(self, task):
+        with self._store_lock:
+            task = {"kind": "tasks#task", "id": uuid.uuid4().hex, "status": "needsAction", **task, "updated": _rfc3339_now()}
+            self.tasks[task["id"]] = task
+        return task
+
+    def delete_task(self, task_id):
+        self.put_task({**self.tasks[task_id], "deleted": True})
+
+    def expire_sync_tokens(self):
+        with self._store_lock:
+            self.sequence += 1
+            self.sync_token_floor = self.sequence
+
+    @staticmethod
+    def _page(items, query, key):
+        offset = int(query.get("pageToken", ["0"])[0])
+        size = int(query.get("maxResults", ["100"])[0])
+        page = {"kind": key, "items": items[offset:offset + size]}
+        if offset + size < len(items):
+            page["nextPageToken"] = str(offset + size)
+        return page
+
+    def list_events(self, query):
+        sync_token = query.get("syncToken", [None])[0]
+        with self._store_lock:
+            if sync_token is not None and int(sync_token) < self.sync_token_floor:
+                return 410, {"error": {"code": 410, "message": "Sync token is no longer valid, a full sync is required."}}
+            changes = sorted(self.events.values(), key=lambda entry: entry[0])
+            if sync_token is None:
+                items = [event for _, event in changes if event["status"] != "cancelled"]
+            else:
+                items = [event for sequence, event in changes if sequence > int(sync_token)]
+            next_sync_token = str(self.sequence)
+        page = self._page(items, query, "calendar#events")
+        if "nextPageToken" not in page:
+            page["nextSyncToken"] = next_sync_token
+        return 200, page
+
+    def list_tasks(self, query):
+        updated_min = query.get("updatedMin", [None])[0]
+        show_deleted = query.get("showDeleted", ["false"])[0] == "true"
+        with self._store_lock:
+            items = [
+                task for task in self.tasks.values()
+                if (show_deleted or not task.get("deleted"))
+                and (updated_min is None or datetime.fromisoformat(task["updated"]) >= datetime.fromisoformat(updated_min))
+            ]
+        return 200, self._page(items, query, "tasks#tasks")
+
+    def kind(self, method, path, body):
+        if path.split("?")[0] in self.batch_paths:
+            return "google_batch"
+        if path.startswith("/token"):
+            return "google_token"
+        if path.startswith("/calendar/"):
+            return "google_calendar"
+        return "google_tasks"
+
+    def handle_batch(self, headers, body):
+        message = email.message_from_bytes(
+            f"Content-Type: {headers.get('Content-Type')}\r\n\r\n".encode("utf-8") + body
+        )
+        boundary = f"batch_{uuid.uuid4().hex}"
+        parts = []
+        for part in message.get_payload():
+            request = part.get_payload().replace("\r\n", "\n")
+            head, _, request_body = request.partition("\n\n")
+            method, path, _ = head.split("\n")[0].split(" ", 2)
+            status, payload = self.handle(method, path, {}, request_body.encode("utf-8"))
+            content_id = part["Content-ID"].strip("<>")
+            parts.append(
+                f"--{boundary}\r\nContent-Type: application/http\r\nContent-ID: <response-{content_id}>\r\n\r\n"
+                f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\nContent-Type: application/json\r\n\r\n"
+                f"{json.dumps(payload)}\r\n"
+            )
+        data = "".join(parts) + f"--{boundary}--\r\n"
+        return 200, StreamBody([data.encode("utf-8")], f"multipart/mixed; boundary={boundary}")
+
+    def handle(self, method, path, headers, body):
+        url = urlsplit(path)
+        path, query = url.path, parse_qs(url.query)
+        if method == "POST" and path in self.batch_paths:
+            return self.handle_batch(headers, body)
+        if method == "POST" and path == "/token":
+            # OAuth refresh, form-encoded
+            return 200, {"access_token": f"fake-token-{uuid.uuid4().hex}", "expires_in": self.token_lifetime, "token_type": "Bearer"}
+        payload = json.loads(body or b"{}")
+        if method == "GET" and path == "/tasks/v1/users/@me/lists":
+            return 200, {"kind": "tasks#taskLists", "items": [{"id": self.tasklist_id, "title": "Moje zadania"}]}
+        if method == "GET" and path.startswith("/tasks/v1/lists/") and path.endswith("/tasks"):
+            return self.list_tasks(query)
+        if method == "POST" and path.startswith("/tasks/v1/lists/") and path.endswith("/tasks"):
+            task_id = uuid.uuid4().hex
+            return 200, self.put_task({
+                "id": task_id,
+                "title": payload.get("title"),
+                "notes": payload.get("notes"),
+                "due": payload.get("due"),
+                "webViewLink": f"https://tasks.google.com/task/{task_id}"
+            })
+        if method == "GET" and path.startswith("/calendar/v3/calendars/") and path.endswith("/events"):
+            return self.list_events(query)
+        if method == "POST" and path.startswith("/calendar/v3/calendars/") and path.endswith("/events"):
+            event_id = uuid.uuid4().hex
+            return 200, self.put_event({
+                "id": event_id,
+                "htmlLink": f"https://www.google.com/calendar/event?eid={event_id}",
+                "summary": payload.get("summary"),
+                "description": payload.get("description"),
+                "start": payload.get("start"),
+                "end": payload.get("end"),
+                "recurrence": payload.get("recurrence")
+            })
+        return 404, {"error": {"code": 404, "message": f"Unknown path {path}"}}
+
+
+class FakeNtfy(FakeService):
+    name = "ntfy"
+
+    def handle(self, method, path, headers, body):
+        return 200, {"id": uuid.uuid4().hex, "time": int(time.time()), "event": "message", "topic": path.strip("/")}
+
+
+class FakeImap:
+    """
+    Single-mailbox IMAP4rev1 server without TLS, enough for the email ingestor: LOGIN,
+    SELECT/EXAMINE, UID SEARCH (UID set, SINCE, ALL) and UID FETCH of UID, RFC822.SIZE,
+    BODY.PEEK[HEADER.FIELDS (...)] and BODY.PEEK[] with an optional <0.N> partial.
+    Each command waits `latency` seconds; `fetched` counts the headers and bodies sent.
+    """
+
+    name = "imap"
+
+    def __init__(self, latency=0.0, user="bench", password="bench"):
+        self.latency = latency
+        self.user = user
+        self.password = password
+        self.uidvalidity = int(time.time())
+        self.messages = []
+        self.next_uid = 1
+        self.fetched = {"headers": 0, "bodies": 0}
+        self.records = []
+        self._lock = threading.Lock()
+        self._server = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def add_message(self, raw: bytes, date: datetime = None):
+        with self._lock:
+            self.messages.append({"uid": self.next_uid, "raw": raw, "date": (date or datetime.now()).date()})
+            self.next_uid += 1
+
+    def reset_uidvalidity(self):
+        """
+        Renumbers the mailbox as a server does after a rebuild; clients must forget their UIDs.
+        """
+        with self._lock:
+            self.uidvalidity += 1
+            for uid, message in enumerate(self.messages, start=1):
+                message["uid"] = uid
+            self.next_uid = len(self.messages) + 1
+
+    @staticmethod
+    def _in_set(uid, uid_set, max_uid):
+        for part in uid_set.split(","):
+            first, _, last = part.partition(":")
+            first = max_uid if first == "*" else int(first)
+            last = first if not last else max_uid if last == "*" else int(last)
+            if min(first, last) <= uid <= max(first, last):
+                return True
+        return False
+
+    def search(self, criteria):
+        tokens = criteria.split()
+        with self._lock:
+            messages = list(self.messages)
+        max_uid = messages[-1]["uid"] if messages else 0
+        while tokens:
+            token = tokens.pop(0).upper()
+            if token == "UID":
+                uid_set = tokens.pop(0)
+                messages = [message for message in messages if self._in_set(message["uid"], uid_set, max_uid)]
+            elif token == "SINCE":
+                since = datetime.strptime(tokens.pop(0).strip('"'), "%d-%b-%Y").date()
+                messages = [message for message in messages if message["date"] >= since]
+        return [message["uid"] for message in messages]
+
+    @staticmethod
+    def header_fields(raw: bytes, fields):
+        header = raw.split(b"\r\n\r\n", 1)[0]
+        kept, keep = [], False
+        for line in header.split(b"\r\n"):
+            if line[:1] in (b" ", b"\t"):
+                if keep:
+                    kept.append(line)
+                continue
+            keep = line.split(b":", 1)[0].strip().upper().decode("ascii", "replace") in fields
+            if keep:
+                kept.append(line)
+        return b"\r\n".join(kept) + b"\r\n\r\n"
+
+    def fetch(self, uid_set, items):
+        with self._lock:
+            messages = list(enumerate(self.messages, start=1))
+        max_uid = messages[-1][1]["uid"] if messages else 0
+        fields = re.search(r"HEADER\.FIELDS \(([^)]*)\)", items, re.IGNORECASE)
+        partial = re.search(r"BODY\.PEEK\[\]<(\d+)\.(\d+)>", items, re.IGNORECASE)
+        chunks = []
+        for sequence, message in messages:
+            if not self._in_set(message["uid"], uid_set, max_uid):
+                continue
+            parts = [f"UID {message['uid']}"]
+            if "RFC822.SIZE" in items.upper():
+                parts.append(f"RFC822.SIZE {len(message['raw'])}")
+            if fields:
+                data = self.header_fields(message["raw"], set(fields.group(1).upper().split()))
+                section, kind = f"BODY[HEADER.FIELDS ({fields.group(1).upper()})]", "headers"
+            elif "BODY.PEEK[]" in items.upper():
+                start, length = (int(partial.group(1)), int(partial.group(2))) if partial else (0, len(message["raw"]))
+                data = message["raw"][start:start + length]
+                section, kind = f"BODY[]<{start}>" if partial else "BODY[]", "bodies"
+            else:
+                chunks.append(f"* {sequence} FETCH ({' '.join(parts)})\r\n".encode())
+                continue
+            with self._lock:
+                self.fetched[kind] += 1
+            chunks.append(f"* {sequence} FETCH ({' '.join(parts)} {section} {{{len(data)}}}\r\n".encode() + data + b")\r\n")
+        return chunks
+
+    def command(self, tag, line):
+        words = line.split(" ", 2)
+        command = words[0].upper()
+        if command == "CAPABILITY":
+            return [b"* CAPABILITY IMAP4rev1\r\n"], "OK"
+        if command == "LOGIN":
+            user, password = (word.strip('"') for word in line.split(" ", 2)[1:])
+            return [], "OK" if (user, password) == (self.user, self.password) else "NO"
+        if command in ("SELECT", "EXAMINE"):
+            with self._lock:
+                untagged = [
+                    f"* {len(self.messages)} EXISTS\r\n", "* 0 RECENT\r\n",
+                    f"* OK [UIDVALIDITY {self.uidvalidity}] UIDs valid\r\n",
+                    f"* OK [UIDNEXT {self.next_uid}] Predicted next UID\r\n",
+                ]
+            return [chunk.encode() for chunk in untagged], "OK"
+        if command == "UID" and len(words) == 3:
+            subcommand, _, arguments = words[1].upper(), None, words[2]
+            if subcommand == "SEARCH":
+                return [f"* SEARCH {' '.join(map(str, self.search(arguments)))}\r\n".encode()], "OK"
+            if subcommand == "FETCH":
+                uid_set, items = arguments.split(" ", 1)
+                return self.fetch(uid_set, items), "OK"
+        if command in ("NOOP", "CLOSE"):
+            return [], "OK"
+        if command == "LOGOUT":
+            return [b"* BYE Logging out\r\n"], "OK"
+        return [], "BAD"
+
+    def start(self):
+        service = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def handle(self):
+                self.wfile.write(b"* OK [CAPABILITY IMAP4rev1] Fake IMAP ready\r\n")
+                while True:
+                    line = self.rfile.readline()
+                    if not line:
+                        return
+                    started = time.perf_counter()
+                    tag, _, rest = line.decode("utf-8", "replace").rstrip("\r\n").partition(" ")
+                    if service.latency:
+                        time.sleep(service.latency)
+                    chunks, status = service.command(tag, rest)
+                    self.wfile.write(b"".join(chunks) + f"{tag} {status} done\r\n".encode())
+                    self.wfile.flush()
+                    with service._lock:
+                        service.records.append((f"imap_{rest.split(' ')[0].lower()}", time.perf_counter() - started, status))
+                    if rest.upper().startswith("LOGOUT"):
+                        return
+
+        self._server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name="fake-imap", daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+
+def start_fakes(latency=None, error_rate=None, jitter=0.0):
+    """
+    Starts all fakes. `latency` and `error_rate` are dicts keyed by service name.
+    """
+    latency = latency or {}
+    error_rate = error_rate or {}
+    fakes = {}
+    for cls in (FakeGemini, FakeNotion, FakeGoogle, FakeNtfy):
+        fakes[cls.name] = cls(
+            latency=latency.get(cls.name, 0.0),
+            jitter=jitter,
+            error_rate=error_rate.get(cls.name, 0.0)
+        ).start()
+    return fakes
+
+
+def fake_environment(fakes, workdir):
+    """
+    Environment variables pointing the server at the fakes, with a Google token
+    that never needs a refresh written to `workdir`.
+    """
+    token_path = f"{workdir}/token.json"
+    with open(token_path, "w") as f:
+        json.dump({
+            "token": "fake-token",
+            "refresh_token": "fake-refresh-token",
+            "token_uri": f"{fakes['google'].url}/token",
+            "client_id": "fake-client",
+            "client_secret": "fake-secret",
+            "scopes": [
+                "https://www.googleapis.com/auth/calendar",
+                "https://www.googleapis.com/auth/tasks"
+            ],
+            "expiry": "2999-01-01T00:00:00Z"
+        }, f)
+    return {
+        "AUTH_TOKEN_SECRET": "bench",
+        "GOOGLE_AI_API_KEY": "fake-key",
+        "GEMINI_API_ENDPOINT": fakes["gemini"].url,
+        "NOTION_API_KEY": "fake-notion-key",
+        "NOTION_BASE_URL": fakes["notion"].url,
+        "NOTION_TRANSCRIPTION_PAGE_ID": "transcriptions",
+        "NOTION_NOTES_PAGE_ID": "notes",
+        "NOTION_SHOPPING_LIST_PAGE_ID": "shopping",
+        "GOOGLE_API_ENDPOINT": fakes["google"].url,
+        "GOOGLE_TOKEN_PATH": token_path,
+        "GOOGLE_TOKEN_URI": f"{fakes['google'].url}/token",
+        "NTFY_SERVER": fakes["ntfy"].url,
+        "NTFY_CHANNEL": "bench",
+        "JOBS_DB_PATH": f"{workdir}/jobs.db",
+        "OUTBOX_DB_PATH": f"{workdir}/outbox.db",
+        "SEARCH_INDEX_PATH": f"{workdir}/search_index",
+        "MIRROR_DB_PATH": f"{workdir}/mirror.db",
+        "EMAIL_DB_PATH": f"{workdir}/email.db",
+        # Benchmarks measure the full pipeline, not cache hits or admission control,
+        # unless ADMISSION_CONTROL is set explicitly
+        "ADMISSION_CONTROL": os.getenv("ADMISSION_CONTROL", "false"),
+        "EXTRACTION_CACHE_SIZE": "0",
+        "TRANSCRIPTION_CACHE_MAX_BYTES": "0",
+    }
@@ -0,0 +1,245 @@
+"""
+Offline end-to-end load test. Starts local fakes for Gemini, Notion, Google
+Tasks/Calendar and ntfy, runs the server against them and drives one endpoint
+at the chosen concurrency. Reports p50/p95/p99 latency, throughput and a
+per-stage breakdown of where the time went.
+
+With --background, another endpoint is kept busy while the measured one runs,
+e.g. long audio conversations next to text commands, and the measured endpoint's
+latency is reported against an idle baseline run first.
+
+Audio above AUDIO_SPOOL_THRESHOLD (512KB by default, so conversations only) is spooled
+to disk and sent through the Gemini File API fake; use --audio-size to pick either path.
+
+Run from the server/ directory, e.g.:
+    python -m bench.load --endpoint text-command --requests 200 --concurrency 16 \\
+        --latency gemini=0.8,notion=0.3,google=0.2,ntfy=0.05 --error-rate notion=0.02
+    python -m bench.load --endpoint text-command --background audio-conversation \\
+        --background-concurrency 8 --transcription-latency 5
+    python -m bench.load --endpoint audio-conversation --audio-size 1000000 --concurrency 8
+"""
+import os
+import math
+import time
+import socket
+import argparse
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .fakes import start_fakes, fake_environment, sample_extraction
+from .stages import StageTimer
+
+ENDPOINTS = {
+    "text-command": ("/assistant/text-command", "text"),
+    "batch-text-command": ("/assistant/batch-text-command", "batch"),
+    "audio-command": ("/assistant/audio-command", "audio"),
+    "audio-conversation": ("/assistant/audio-conversation", "audio"),
+}
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def parse_service_map(value):
+    result = {}
+    for part in filter(None, (value or "").split(",")):
+        name, number = part.split("=")
+        result[name.strip()] = float(number)
+    return result
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port):
+    import uvicorn
+    from app.main import app
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="bench-server", daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, thread
+
+
+def make_request_factory(endpoint, audio_size, message, batch_size=10):
+    path, kind = ENDPOINTS[endpoint]
+    headers = {"x-auth": "bench"}
+    if kind == "text":
+        return lambda client, i: client.post(path, json={"message": f"{message} ({i})"}, headers=headers)
+    if kind == "batch":
+        return lambda client, i: client.post(
+            path, json={"messages": [f"{message} ({i}.{j})" for j in range(batch_size)]}, headers=headers
+        )
+    headers["Content-Type"] = "audio/3gpp"
+    # Random bytes, so every request is a distinct upload
+    return lambda client, i: client.post(path, content=os.urandom(audio_size), headers=headers)
+
+
+def run_load(base_url, request, total, concurrency, timeout):
+    import httpx
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+    local = threading.local()
+
+    def one(i):
+        client = getattr(local, "client", None)
+        if client is None:
+            client = local.client = httpx.Client(base_url=base_url, timeout=timeout)
+        started = time.perf_counter()
+        try:
+            status = request(client, i).status_code
+        except Exception as e:
+            status = type(e).__name__
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies.append(elapsed)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(total)))
+    return latencies, statuses, time.perf_counter() - started
+
+
+def run_background(base_url, request, concurrency, timeout, stop):
+    """
+    Sends requests from `concurrency` threads until `stop` is set.
+    Returns the threads and the latencies and status codes they record.
+    """
+    import httpx
+    latencies = []
+    statuses = {}
+    lock = threading.Lock()
+
+    def loop(worker):
+        with httpx.Client(base_url=base_url, timeout=timeout) as client:
+            i = 0
+            while not stop.is_set():
+                started = time.perf_counter()
+                try:
+                    status = request(client, worker * 1000000 + i).status_code
+                except Exception as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - started
+                with lock:
+                    latencies.append(elapsed)
+                    statuses[status] = statuses.get(status, 0) + 1
+                i += 1
+
+    threads = [threading.Thread(target=loop, args=(worker,), name=f"bench-background-{worker}", daemon=True)
+               for worker in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    return threads, latencies, statuses
+
+
+def print_distribution(label, values):
+    ms = [value * 1000 for value in values]
+    print(
+        f"  {label:<28} n={len(ms):<6} mean={sum(ms) / len(ms):8.1f}  p50={percentile(ms, 50):8.1f}  "
+        f"p95={percentile(ms, 95):8.1f}  p99={percentile(ms, 99):8.1f}  (ms)"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="text-command")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--warmup", type=int, default=2, help="requests sent before measuring")
+    parser.add_argument("--latency", default="gemini=0.5,notion=0.2,google=0.15,ntfy=0.05",
+                        help="per-service latency in seconds, e.g. gemini=0.8,notion=0.3")
+    parser.add_argument("--jitter", type=float, default=0.0, help="random extra latency in seconds, up to this value")
+    parser.add_argument("--error-rate", default="", help="per-service error rate, e.g. notion=0.05")
+    parser.add_argument("--items", default="1,1,1,1", help="tasks,events,notes,shopping_lists per extraction")
+    parser.add_argument("--audio-size", type=int, default=64 * 1024)
+    parser.add_argument("--batch-size", type=int, default=10, help="messages per batch-text-command request")
+    parser.add_argument("--message", default="Jutro spotkanie z Anną o 10, kup mleko i chleb")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    parser.add_argument("--background", choices=sorted(ENDPOINTS), help="endpoint kept busy during the measured run")
+    parser.add_argument("--background-concurrency", type=int, default=4)
+    parser.add_argument("--transcription-latency", type=float, default=0.0,
+                        help="extra seconds per Gemini request carrying audio")
+    args = parser.parse_args()
+
+    tasks, events, notes, shopping_lists = (int(n) for n in args.items.split(","))
+    fakes = start_fakes(parse_service_map(args.latency), parse_service_map(args.error_rate), args.jitter)
+    fakes["gemini"].extraction = sample_extraction(tasks, events, notes, shopping_lists)
+    fakes["gemini"].transcription_latency = args.transcription_latency
+
+    workdir = tempfile.mkdtemp(prefix="assistant-bench-")
+    os.environ.update(fake_environment(fakes, workdir))
+
+    timer = StageTimer().install()
+    port = free_port()
+    server, _ = start_server(port)
+    base_url = f"http://127.0.0.1:{port}"
+    request = make_request_factory(args.endpoint, args.audio_size, args.message, args.batch_size)
+    background = None
+
+    try:
+        if args.warmup:
+            run_load(base_url, request, args.warmup, 1, args.timeout)
+        if args.background:
+            idle_latencies, _, _ = run_load(base_url, request, args.requests, args.concurrency, args.timeout)
+            stop = threading.Event()
+            background = run_background(
+                base_url, make_request_factory(args.background, args.audio_size, args.message, args.batch_size),
+                args.background_concurrency, args.timeout, stop
+            )
+            # Let the background requests get past upload and into processing
+            time.sleep(1.0)
+        timer.reset()
+        for fake in fakes.values():
+            fake.reset()
+
+        latencies, statuses, elapsed = run_load(base_url, request, args.requests, args.concurrency, args.timeout)
+        if background:
+            stop.set()
+            for thread in background[0]:
+                thread.join()
+        # Notifications are sent in the background, give them a moment to finish
+        time.sleep(0.5)
+    finally:
+        server.should_exit = True
+        for fake in fakes.values():
+            fake.stop()
+
+    print(f"{args.endpoint}: {args.requests} requests, concurrency {args.concurrency}")
+    print(f"  throughput: {args.requests / elapsed:.2f} req/s over {elapsed:.2f} s")
+    print(f"  status codes: {statuses}")
+    print("end-to-end latency:")
+    if background:
+        _, background_latencies, background_statuses = background
+        print_distribution("idle", idle_latencies)
+        print_distribution(f"with {args.background}", latencies)
+        print(f"{args.background} in the background, concurrency {args.background_concurrency}:")
+        print(f"  status codes: {background_statuses}")
+        print_distribution("request", background_latencies)
+    else:
+        print_distribution("request", latencies)
+    print("server stages:")
+    for stage, durations in sorted(timer.durations.items()):
+        print_distribution(stage, durations)
+    print("fake services (time spent inside the fake):")
+    for fake in fakes.values():
+        by_kind = {}
+        for kind, duration, _ in fake.records:
+            by_kind.setdefault(kind, []).append(duration)
+        for kind, durations in sorted(by_kind.items()):
+            print_distribution(kind, durations)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+"""
+Long recording transcription, one call vs. overlapping segments transcribed in parallel.
+Generates a recording with ffmpeg and a synthetic timed transcript, and uses a fake
+transcriber that returns the words spoken within a segment (occasionally dropping or
+cutting a word at its edges, as models do) after a delay growing with segment length.
+Reports wall time per concurrency and how many words went missing or were duplicated
+by stitching.
+
+Needs an ffmpeg build with the AMR-NB encoder. Run from the server/ directory:
+    python -m bench.long_audio
+    python -m bench.long_audio --minutes 30 --segment 120 --overlap 5 --concurrency 1,4,8
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import subprocess
+from difflib import SequenceMatcher
+from .search_index import PEOPLE, PLACES, TOPICS, VERBS, PRODUCTS
+
+WORDS_PER_SECOND = 2.5
+
+
+def make_recording(ffmpeg, seconds, path):
+    subprocess.run(
+        [ffmpeg, "-v", "error", "-y", "-f", "lavfi", "-i", f"sine=frequency=440:duration={seconds}:sample_rate=8000",
+         "-ac", "1", "-c:a", "libopencore_amrnb", "-b:a", "12.2k", path],
+        check=True
+    )
+
+
+def make_script(seconds, rng):
+    """
+    (time, word) pairs, roughly WORDS_PER_SECOND apart.
+    """
+    vocabulary = [word for phrase in PEOPLE + PLACES + TOPICS + VERBS + PRODUCTS for word in phrase.split()]
+    script, moment = [], 0.0
+    while moment < seconds:
+        word = rng.choice(vocabulary)
+        if rng.random() < 0.1:
+            word += "."
+        script.append((moment, word))
+        moment += rng.uniform(0.5, 1.5) / WORDS_PER_SECOND
+    return script
+
+
+class FakeTranscriber:
+    def __init__(self, script, base_latency, latency_per_minute, edge_noise, seed=0):
+        self.script = script
+        self.base_latency = base_latency
+        self.latency_per_minute = latency_per_minute
+        self.edge_noise = edge_noise
+        self.rng = random.Random(seed)
+
+    def __call__(self, segment, prompt):
+        assert segment.data, "segment was not cut"
+        time.sleep(self.base_latency + self.latency_per_minute * segment.duration / 60)
+        words = [word for moment, word in self.script if segment.start <= moment < segment.end]
+        if words and segment.start > 0 and self.rng.random() < self.edge_noise:
+            words[0] = words[0][len(words[0]) // 2:] or words[0]
+        if words and self.rng.random() < self.edge_noise:
+            words.pop()
+        return " ".join(words)
+
+
+def compare(expected, stitched):
+    """
+    Missing and extra words of the stitched transcription against the script.
+    """
+    missing = extra = 0
+    matcher = SequenceMatcher(None, expected, stitched.split(), autojunk=False)
+    for tag, i1, i2, j1, j2 in matcher.get_opcodes():
+        if tag in ("delete", "replace"):
+            missing += i2 - i1
+        if tag in ("insert", "replace"):
+            extra += j2 - j1
+    return missing, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--minutes", type=float, default=30)
+    parser.add_argument("--segment", type=float, default=120, help="segment length in seconds")
+    parser.add_argument("--overlap", type=float, default=5, help="overlap between segments in seconds")
+    parser.add_argument("--concurrency", default="1,4,8,16")
+    parser.add_argument("--base-latency", type=float, default=0.5, help="seconds per transcription call")
+    parser.add_argument("--latency-per-minute", type=float, default=0.4, help="extra seconds per minute of audio")
+    parser.add_argument("--edge-noise", type=float, default=0.3, help="chance of a cut or dropped word at a segment edge")
+    parser.add_argument("--ffmpeg", default=os.getenv("FFMPEG_PATH", "ffmpeg"))
+    args = parser.parse_args()
+
+    from app.long_audio import ChunkedTranscriber
+    seconds = args.minutes * 60
+    path = os.path.join(tempfile.mkdtemp(), "recording.3gp")
+    make_recording(args.ffmpeg, seconds, path)
+    script = make_script(seconds, random.Random(0))
+    expected = [word for _, word in script]
+    print(f"{args.minutes:g} min recording, {os.path.getsize(path) / 1024:.0f} KiB, {len(script)} words\n")
+
+    def run(label, **options):
+        transcriber = ChunkedTranscriber(
+            FakeTranscriber(script, args.base_latency, args.latency_per_minute, args.edge_noise),
+            ffmpeg=args.ffmpeg, **options
+        )
+        started = time.perf_counter()
+        stitched = transcriber.transcribe_file(path, "")
+        elapsed = time.perf_counter() - started
+        missing, extra = compare(expected, stitched)
+        print(f"  {label:<26} {elapsed:6.2f}s  missing={missing:<3} extra={extra}")
+
+    run("one call", segment_seconds=seconds + 1, overlap_seconds=0, max_workers=1)
+    for concurrency in (int(value) for value in args.concurrency.split(",")):
+        run(f"segments, concurrency={concurrency}",
+            segment_seconds=args.segment, overlap_seconds=args.overlap, max_workers=concurrency)
+    run("segments, no overlap", segment_seconds=args.segment, overlap_seconds=0, max_workers=max(
+        int(value) for value in args.concurrency.split(",")
+    ))
+
+
+if __name__ == "__main__":
+    main()
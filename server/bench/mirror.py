@@ -0,0 +1,109 @@
+"""
+Calendar and Tasks mirror against the local Google stand-in: seeds events and tasks,
+times the full sync, an incremental sync after a few changes and a full resync after
+the sync token expires, then compares local queries (time range, title) with a single
+events.list round trip to the fake.
+
+Run from the server/ directory:
+    python -m bench.mirror
+    python -m bench.mirror --events 20000 --tasks 5000 --latency 0.15
+"""
+import os
+import time
+import random
+import argparse
+import tempfile
+import statistics
+from datetime import datetime, timedelta
+from .search_index import PEOPLE, PLACES, TOPICS, VERBS
+
+
+def seed(google, events, tasks, rng):
+    start = datetime(2030, 1, 1, 8)
+    for _ in range(events):
+        begins = start + timedelta(days=rng.randint(0, 364), hours=rng.randint(0, 10))
+        google.put_event({
+            "summary": f"Spotkanie z {rng.choice(PEOPLE)} w {rng.choice(PLACES)}",
+            "start": {"dateTime": begins.isoformat(), "timeZone": "Europe/Warsaw"},
+            "end": {"dateTime": (begins + timedelta(hours=1)).isoformat(), "timeZone": "Europe/Warsaw"}
+        })
+    for _ in range(tasks):
+        due = start + timedelta(days=rng.randint(0, 364))
+        google.put_task({
+            "title": f"{rng.choice(VERBS).capitalize()} {rng.choice(PEOPLE)} w sprawie {rng.choice(TOPICS)}",
+            "due": due.strftime("%Y-%m-%dT00:00:00.000Z")
+        })
+
+
+def timed(func, runs):
+    latencies = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = func()
+        latencies.append((time.perf_counter() - started) * 1e6)
+    return statistics.median(latencies), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=5000)
+    parser.add_argument("--tasks", type=int, default=2000)
+    parser.add_argument("--latency", type=float, default=0.15, help="seconds per Google request")
+    parser.add_argument("--runs", type=int, default=1000, help="runs per local query")
+    args = parser.parse_args()
+
+    from .fakes import start_fakes, fake_environment
+    fakes = start_fakes(latency={"google": args.latency})
+    google = fakes["google"]
+    os.environ.update(fake_environment(fakes, tempfile.mkdtemp()))
+    # The tasks were seeded moments ago; no overlap, so the incremental sync only sees changes
+    os.environ["MIRROR_TASKS_OVERLAP"] = "0"
+    rng = random.Random(0)
+    seed(google, args.events, args.tasks, rng)
+
+    from app.mirror import GoogleMirror, MirrorStore, parse_time
+    from app.integrations.googleCalendarConnector import calendar_service, CALENDAR_ID
+    mirror = GoogleMirror(MirrorStore(os.environ["MIRROR_DB_PATH"]))
+
+    print(f"{args.events} events, {args.tasks} tasks, {args.latency}s per Google request\n")
+    print(f"full sync:          {mirror.sync()}")
+
+    for event_id in rng.sample(sorted(google.events), 2):
+        google.delete_event(event_id)
+    seed(google, 5, 3, rng)
+    google.delete_task(rng.choice(sorted(google.tasks)))
+    time.sleep(0.01)
+    print(f"incremental sync:   {mirror.sync()}")
+    google.expire_sync_tokens()
+    print(f"expired token:      {mirror.sync()}")
+
+    live_events = sum(1 for _, event in google.events.values() if event["status"] != "cancelled")
+    live_tasks = sum(1 for task in google.tasks.values() if not task.get("deleted"))
+    counts = mirror.store.counts()
+    print(f"mirror matches Google: events {counts['events']}/{live_events}, tasks {counts['tasks']}/{live_tasks}\n")
+
+    week_start, week_end = parse_time("2030-03-04"), parse_time("2030-03-11")
+    queries = {
+        "events in a week": lambda: mirror.store.events_between(week_start, week_end),
+        "events by title": lambda: mirror.store.search_events("spotkanie Anną", limit=20),
+        "tasks due in a week": lambda: mirror.store.tasks_due_between(week_start, week_end),
+        "tasks by title": lambda: mirror.store.search_tasks("zadzwonić faktury", limit=20),
+    }
+    for label, query in queries.items():
+        median, result = timed(query, args.runs)
+        print(f"  {label:<22} p50={median:9.1f} us  ({len(result)} results)")
+
+    service = calendar_service.get()
+    remote = lambda: service.events().list(
+        calendarId=CALENDAR_ID, maxResults=2500, singleEvents=True,
+        timeMin="2030-03-04T00:00:00Z", timeMax="2030-03-11T00:00:00Z"
+    ).execute()
+    median, _ = timed(remote, 10)
+    print(f"  {'remote events.list':<22} p50={median:9.1f} us  (one page)")
+
+    for fake in fakes.values():
+        fake.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+"""
+Model routing against the local Gemini stand-in: runs the sample messages through
+extraction with MODEL_ROUTING enabled, where the fast and the strong model get
+their own latency and the fast model answers a share of requests with text that
+is not JSON. Reports latency and tokens per routed extraction, escalations and
+the router statistics, next to a run that always uses the strong model.
+
+Run from the server/ directory:
+    python -m bench.model_routing
+    python -m bench.model_routing --fast-latency 0.2 --strong-latency 0.8 --fast-malformed 0.1
+"""
+import os
+import time
+import json
+import argparse
+import statistics
+from .prompt_size import SAMPLE_MESSAGES
+
+
+def run(messages, repeat):
+    from app.prompts import extract_data_from_message
+    latencies = []
+    tokens = 0
+    for _ in range(repeat):
+        for message in messages:
+            started = time.perf_counter()
+            _, used = extract_data_from_message(message)
+            latencies.append(time.perf_counter() - started)
+            tokens += used
+    return latencies, tokens
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--fast-model", default="gemini-2.5-flash-lite")
+    parser.add_argument("--strong-model", default="gemini-2.5-flash")
+    parser.add_argument("--fast-latency", type=float, default=0.2, help="seconds per call of the fast model")
+    parser.add_argument("--strong-latency", type=float, default=0.8, help="seconds per call of the strong model")
+    parser.add_argument("--fast-malformed", type=float, default=0.1, help="share of non-JSON answers of the fast model")
+    parser.add_argument("--repeat", type=int, default=2, help="passes over the sample messages")
+    args = parser.parse_args()
+
+    from .fakes import FakeGemini
+    fake = FakeGemini(
+        model_latency={args.fast_model: args.fast_latency, args.strong_model: args.strong_latency},
+        malformed_rate={args.fast_model: args.fast_malformed}
+    ).start()
+    os.environ.update({
+        "GEMINI_API_ENDPOINT": fake.url,
+        "GOOGLE_AI_API_KEY": "fake-key",
+        "GEMINI_FAST_MODEL": args.fast_model,
+        "GEMINI_STRONG_MODEL": args.strong_model,
+        "EXTRACTION_CACHE_SIZE": "0",
+    })
+
+    from app.model_router import model_router
+    results = {}
+    for label, enabled in (("strong only", False), ("routed", True)):
+        model_router.enabled = enabled
+        results[label] = run(SAMPLE_MESSAGES, args.repeat)
+
+    for label, (latencies, tokens) in results.items():
+        values = [value * 1000 for value in latencies]
+        print(
+            f"{label:<12} calls {len(values):>4}  tokens {tokens:>8}  "
+            f"latency median {statistics.median(values):8.1f} ms  mean {statistics.mean(values):8.1f} ms  "
+            f"max {max(values):8.1f} ms"
+        )
+    print()
+    print(json.dumps(model_router.snapshot(), indent=2))
+    fake.stop()
+
+
+if __name__ == "__main__":
+    main()
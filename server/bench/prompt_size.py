@@ -0,0 +1,117 @@
+"""
+Compares the full extraction prompt with the pre-classified one on a corpus
+of sample Polish messages.
+
+Offline (default): prompt size and estimated tokens (~4 characters per token).
+With --live: also sends both prompts to Gemini and reports prompt tokens from
+usage metadata and latency. --fake runs the live mode against the local Gemini
+stand-in with --latency seconds per call instead of the real API.
+
+Run from the server/ directory:
+    python -m bench.prompt_size
+    python -m bench.prompt_size --live --repeat 3
+"""
+import os
+import time
+import argparse
+import statistics
+
+SAMPLE_MESSAGES = [
+    "Kup mleko, chleb i masło",
+    "Dokup jajka, pomidory i kawę ziarnistą jeśli będzie promocja",
+    "Lista zakupów: papier toaletowy, płyn do naczyń, jabłka, banany",
+    "Jutro o 10 spotkanie z Anną w sprawie projektu",
+    "W piątek o 18:30 kolacja z rodzicami",
+    "Wizyta u dentysty 12.11 o 9:00",
+    "Trening co tydzień we wtorki o 19 przez najbliższe 10 tygodni",
+    "Przypomnij mi, żeby zadzwonić do hydraulika",
+    "Muszę zapłacić rachunek za prąd do końca tygodnia",
+    "Trzeba odebrać paczkę z paczkomatu",
+    "Wyślij Markowi prezentację do poniedziałku",
+    "Zanotuj pomysł na prezent dla Kasi: książka o ogrodnictwie",
+    "Zapisz przepis na naleśniki: mąka, mleko, jajka, szczypta soli",
+    "Zapamiętaj, że hasło do wifi u babci jest na lodówce",
+    "Podsumuj zalety i wady pompy ciepła",
+    "Jutro rano kup bułki, a o 15 spotkanie z księgową",
+    "Zrób przelew za czynsz i zanotuj numer faktury",
+    "Co słychać?",
+    "Samochód stuka przy hamowaniu",
+    "Urodziny Tomka w sobotę, kup prezent i zarezerwuj stolik",
+]
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def build_prompts(message):
+    from app.prompts import build_extraction_instructions
+    from app.classifier import classify_message
+    classification = classify_message(message)
+    full = f"{build_extraction_instructions()}\nTreść wiadomości: {message}"
+    reduced = f"{build_extraction_instructions(classification.categories)}\nTreść wiadomości: {message}"
+    return classification, full, reduced
+
+
+def invoke(prompt):
+    from app.prompts import gemini
+    started = time.perf_counter()
+    response = gemini.get().invoke(prompt)
+    elapsed = time.perf_counter() - started
+    usage = response.usage_metadata or {}
+    return elapsed, usage.get("input_tokens", 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="file with one message per line, defaults to the built-in sample")
+    parser.add_argument("--live", action="store_true", help="send prompts to Gemini and measure latency and tokens")
+    parser.add_argument("--fake", action="store_true", help="use the local Gemini stand-in in live mode")
+    parser.add_argument("--latency", type=float, default=0.5, help="latency of the Gemini stand-in in seconds")
+    parser.add_argument("--repeat", type=int, default=1, help="live calls per prompt variant")
+    args = parser.parse_args()
+
+    if args.fake:
+        from .fakes import FakeGemini
+        fake = FakeGemini(latency=args.latency).start()
+        os.environ.update({"GEMINI_API_ENDPOINT": fake.url, "GOOGLE_AI_API_KEY": "fake-key"})
+
+    messages = SAMPLE_MESSAGES
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            messages = [line.strip() for line in f if line.strip()]
+
+    totals = {"full": 0, "reduced": 0}
+    latencies = {"full": [], "reduced": []}
+    live_tokens = {"full": 0, "reduced": 0}
+    fallbacks = 0
+    print(f"{'message':<50} {'categories':<38} {'full':>6} {'reduced':>7}")
+    for message in messages:
+        classification, full, reduced = build_prompts(message)
+        fallbacks += not classification.confident
+        totals["full"] += estimate_tokens(full)
+        totals["reduced"] += estimate_tokens(reduced)
+        label = ",".join(classification.categories) if classification.confident else f"all ({classification.reason})"
+        print(f"{message[:48]:<50} {label:<38} {estimate_tokens(full):>6} {estimate_tokens(reduced):>7}")
+        if args.live:
+            for variant, prompt in (("full", full), ("reduced", reduced)):
+                for _ in range(args.repeat):
+                    elapsed, tokens = invoke(prompt)
+                    latencies[variant].append(elapsed)
+                    live_tokens[variant] += tokens
+
+    saved = 1 - totals["reduced"] / totals["full"]
+    print()
+    print(f"messages: {len(messages)}, full-prompt fallbacks: {fallbacks}")
+    print(f"estimated prompt tokens: full {totals['full']}, reduced {totals['reduced']} ({saved:.1%} saved)")
+    if args.live:
+        for variant in ("full", "reduced"):
+            values = [value * 1000 for value in latencies[variant]]
+            print(
+                f"live {variant:<8} input tokens {live_tokens[variant]:>8}  "
+                f"latency median {statistics.median(values):8.1f} ms  mean {statistics.mean(values):8.1f} ms"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+Search index latency with the offline hashing embedder: fills an index in a temporary
+directory with synthetic Polish tasks, events, notes and shopping lists, then measures
+query latency of exact scoring and of the IVF index at each size, with the IVF recall@k
+against exact results.
+
+Run from the server/ directory:
+    python -m bench.search_index
+    python -m bench.search_index --sizes 10000,100000 --queries 200 --nprobe 8,16,32
+"""
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+PRODUCTS = ["mleko", "chleb", "masło", "jajka", "ser", "pomidory", "jabłka", "kawa", "herbata", "makaron", "ryż", "szynka"]
+PEOPLE = ["Anną", "Tomkiem", "Kasią", "Markiem", "szefem", "dentystą", "mechanikiem", "księgową", "Piotrem", "mamą"]
+TOPICS = ["projektu", "budżetu", "urlopu", "remontu", "umowy", "faktury", "wdrożenia", "szkolenia", "przeprowadzki", "samochodu"]
+VERBS = ["zadzwonić do", "napisać do", "odebrać od", "wysłać do", "przypomnieć", "zapłacić"]
+PLACES = ["biurze", "domu", "kawiarni", "przychodni", "warsztacie", "banku", "urzędzie", "siłowni"]
+
+
+def synthetic_item(rng, number):
+    kind = rng.choice(("google_task", "google_calendar", "notion_page", "notion_shopping_list"))
+    if kind == "google_task":
+        data = {"title": f"{rng.choice(VERBS).capitalize()} {rng.choice(PEOPLE)} w sprawie {rng.choice(TOPICS)}",
+                "description": f"Sprawa nr {number}"}
+    elif kind == "google_calendar":
+        data = {"title": f"Spotkanie z {rng.choice(PEOPLE)} w {rng.choice(PLACES)}",
+                "description": f"Omówienie {rng.choice(TOPICS)}",
+                "start_datetime": f"2030-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d} {rng.randint(8, 18)}:00:00"}
+    elif kind == "notion_page":
+        data = {"title": f"Notatka o {rng.choice(TOPICS)}",
+                "content": " ".join(rng.choice(TOPICS + PLACES + PRODUCTS) for _ in range(12))}
+    else:
+        data = {"title": "Lista zakupów", "content": "\n".join(f"- {product}" for product in rng.sample(PRODUCTS, 4))}
+    return kind, data
+
+
+def fill(index, size, rng, batch=1000):
+    from app.search_index import item_text
+    started = time.perf_counter()
+    while index.count < size:
+        items = []
+        for number in range(index.count, min(size, index.count + batch)):
+            kind, data = synthetic_item(rng, number)
+            items.append({"type": kind, "title": data["title"], "text": item_text(kind, data), "data": data})
+        index.add(items)
+    return time.perf_counter() - started
+
+
+def measure(index, queries, k, exact):
+    latencies, results = [], []
+    for query in queries:
+        started = time.perf_counter()
+        found = index.search(query, k=k, exact=exact)
+        latencies.append((time.perf_counter() - started) * 1000)
+        results.append({(item["type"], item["text"]) for item in found["results"]})
+    return latencies, results
+
+
+def describe(label, latencies):
+    ordered = sorted(latencies)
+    p95 = ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+    print(f"  {label:<22} p50={statistics.median(ordered):7.2f}  p95={p95:7.2f}  (ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nprobe", default="8,16,32", help="IVF lists scanned per query, comma separated")
+    parser.add_argument("--ann-threshold", type=int, default=5000, help="items before the IVF index is built")
+    args = parser.parse_args()
+
+    from app.search_index import SearchIndex
+    rng = random.Random(0)
+    queries = [
+        rng.choice([
+            f"kupić {rng.choice(PRODUCTS)}",
+            f"spotkanie z {rng.choice(PEOPLE)}",
+            f"{rng.choice(TOPICS)} {rng.choice(PLACES)}",
+            f"zadzwonić {rng.choice(PEOPLE)} {rng.choice(TOPICS)}",
+        ])
+        for _ in range(args.queries)
+    ]
+
+    index = SearchIndex(path=tempfile.mkdtemp(), ann_threshold=args.ann_threshold)
+    for size in (int(size) for size in args.sizes.split(",")):
+        elapsed = fill(index, size, rng)
+        print(f"{size} items (added {elapsed:.1f}s cumulative, {index.stats()['ann']})")
+        exact_latencies, exact_results = measure(index, queries, args.k, exact=True)
+        describe("exact", exact_latencies)
+        for nprobe in (int(value) for value in args.nprobe.split(",")):
+            index.nprobe = nprobe
+            latencies, results = measure(index, queries, args.k, exact=False)
+            recall = statistics.mean(
+                len(found & expected) / max(1, len(expected)) for found, expected in zip(results, exact_results)
+            )
+            describe(f"ivf nprobe={nprobe}", latencies)
+            print(f"  {'':<22} recall@{args.k}={recall:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+"""
+Per-stage timing for benchmarks: wraps the pipeline functions of the running
+server in place and records how long every call took.
+"""
+import time
+import threading
+import importlib
+import functools
+
+# (module, attribute, stage name)
+PIPELINE_STAGES = [
+    ("app.audio", "transcribe_audio", "transcription"),
+    ("app.audio", "transcribe_and_extract_audio", "transcription_and_extraction"),
+    ("app.audio", "create_notion_page", "transcription_notion_save"),
+    ("app.processing", "extract_data_from_message", "extraction"),
+    ("app.processing", "extract_data_from_message_streaming", "extraction_streaming"),
+    ("app.processing", "create_google_task", "google_task"),
+    ("app.processing", "create_calendar_event", "google_calendar"),
+    ("app.processing", "create_google_tasks", "google_tasks_batch"),
+    ("app.processing", "create_calendar_events", "google_calendar_batch"),
+    ("app.processing", "create_notion_page", "notion_page"),
+    ("app.notifications", "send_ntfy_notification", "notification"),
+]
+
+
+class StageTimer:
+    def __init__(self):
+        self.durations = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, duration):
+        with self._lock:
+            self.durations.setdefault(stage, []).append(duration)
+
+    def wrap(self, module_name, attribute, stage):
+        module = importlib.import_module(module_name)
+        original = getattr(module, attribute)
+
+        @functools.wraps(original)
+        def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                self.record(stage, time.perf_counter() - started)
+
+        setattr(module, attribute, timed)
+
+    def install(self, stages=PIPELINE_STAGES):
+        for module_name, attribute, stage in stages:
+            self.wrap(module_name, attribute, stage)
+        return self
+
+    def reset(self):
+        with self._lock:
+            self.durations = {}
@@ -0,0 +1,59 @@
+"""
+Startup benchmark: import time of app.main and latency of the first request,
+each measured in a fresh interpreter so nothing is cached between runs.
+
+Run from the server/ directory:
+    python -m bench.startup --runs 5 --path /assistant/cache
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+import statistics
+
+MEASURE = """
+import json, time
+started = time.perf_counter()
+import app.main
+imported = time.perf_counter()
+from fastapi.testclient import TestClient
+with TestClient(app.main.app) as client:
+    ready = time.perf_counter()
+    response = client.request({method!r}, {path!r}, headers={{"x-auth": "bench"}}, json={body!r})
+    first_request = time.perf_counter()
+print(json.dumps({{
+    "import": imported - started,
+    "startup": ready - imported,
+    "first_request": first_request - ready,
+    "status": response.status_code
+}}))
+"""
+
+def run_once(method, path, body):
+    env = {**os.environ, "AUTH_TOKEN_SECRET": "bench"}
+    output = subprocess.run(
+        [sys.executable, "-c", MEASURE.format(method=method, path=path, body=body)],
+        env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--path", default="/assistant/cache")
+    parser.add_argument("--message", help="POST this message to /assistant/text-command as the first request")
+    args = parser.parse_args()
+
+    method, path, body = "GET", args.path, None
+    if args.message:
+        method, path, body = "POST", "/assistant/text-command", {"message": args.message}
+
+    results = [run_once(method, path, body) for _ in range(args.runs)]
+    for key in ("import", "startup", "first_request"):
+        values = [result[key] * 1000 for result in results]
+        print(f"{key:>14}: median {statistics.median(values):8.1f} ms, min {min(values):8.1f} ms, max {max(values):8.1f} ms")
+    print(f"{'status':>14}: {sorted({result['status'] for result in results})}")
+
+if __name__ == "__main__":
+    main()
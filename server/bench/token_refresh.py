@@ -0,0 +1,139 @@
+"""
+Google credential refresh against the local Google stand-in:
+
+- a burst of threads calling get_credentials with an expired token,
+- a burst of Google Tasks writes whose shared credentials expire under them,
+- writes running across several token expiries with the background renewer on.
+
+Each burst must cause exactly one refresh, and with the renewer no refresh may
+happen on a request thread; the benchmark exits with status 1 otherwise.
+
+Run from the server/ directory:
+    python -m bench.token_refresh
+    python -m bench.token_refresh --threads 100 --latency 0.3 --duration 20
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+import statistics
+from datetime import timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+
+def expire_token(token_path):
+    with open(token_path) as f:
+        token = json.load(f)
+    token["expiry"] = "2000-01-01T00:00:00Z"
+    with open(token_path, "w") as f:
+        json.dump(token, f)
+
+
+def burst(threads, func):
+    barrier = threading.Barrier(threads)
+
+    def call():
+        barrier.wait()
+        started = time.perf_counter()
+        func()
+        return time.perf_counter() - started
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(lambda _: call(), range(threads)))
+
+
+def refreshes(fake):
+    return sum(1 for kind, _, _ in fake.records if kind == "google_token")
+
+
+def check(failures, condition, message):
+    if not condition:
+        failures.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per Google request, token refresh included")
+    parser.add_argument("--duration", type=float, default=12.0, help="seconds of writes with the renewer on")
+    parser.add_argument("--token-lifetime", type=int, default=6, help="seconds, for the renewer run")
+    parser.add_argument("--renew-margin", type=float, help="GOOGLE_TOKEN_RENEW_MARGIN, half the token lifetime by default")
+    args = parser.parse_args()
+
+    from .fakes import start_fakes, fake_environment
+    fakes = start_fakes(latency={"google": args.latency})
+    google = fakes["google"]
+    workdir = tempfile.mkdtemp()
+    os.environ.update(fake_environment(fakes, workdir))
+    os.environ["GOOGLE_TOKEN_RENEW_MARGIN"] = str(args.renew_margin or args.token_lifetime / 2)
+    token_path = os.environ["GOOGLE_TOKEN_PATH"]
+
+    from app import auth_manager as auth_module
+    from app.integrations import googleTasksConnector
+
+    print(f"{args.threads} threads, {args.latency}s per Google request\n")
+    failures = []
+
+    expire_token(token_path)
+    manager = auth_module.auth_manager
+    google.reset()
+    latencies = burst(args.threads, manager.get_credentials)
+    check(failures, refreshes(google) == 1, f"get_credentials burst made {refreshes(google)} refreshes, expected 1")
+    print(f"get_credentials burst:  {refreshes(google)} refresh(es), "
+          f"max wait {max(latencies):.3f}s, token file valid: {bool(json.load(open(token_path))['token'])}")
+
+    data = {"title": "Kupić mleko"}
+    googleTasksConnector.create_google_task(data)
+    creds = manager.get_credentials()
+    creds.expiry = auth_module._utcnow() - timedelta(seconds=1)
+    google.reset()
+    latencies = burst(args.threads, lambda: googleTasksConnector.create_google_task(data))
+    check(failures, refreshes(google) == 1, f"request burst made {refreshes(google)} refreshes, expected 1")
+    print(f"request burst:          {refreshes(google)} refresh(es), "
+          f"p50 {statistics.median(latencies):.3f}s, max {max(latencies):.3f}s")
+
+    # Compressed time: google-auth treats tokens as expired 3m45s early, scaled down
+    # here with the token lifetime and renew margin
+    from google.auth import _helpers
+    _helpers.REFRESH_THRESHOLD = timedelta(seconds=args.token_lifetime / 6)
+    google.token_lifetime = args.token_lifetime
+    refresh_threads = []
+    original_refresh = manager.refresh
+
+    def recording_refresh(creds, request=None):
+        refresh_threads.append(threading.current_thread().name)
+        return original_refresh(creds, request)
+
+    manager.refresh = recording_refresh
+    creds.expiry = auth_module._utcnow() + timedelta(seconds=args.token_lifetime)
+    google.reset()
+    manager.start_renewer()
+    latencies = []
+    deadline = time.monotonic() + args.duration
+    while time.monotonic() < deadline:
+        latencies.extend(burst(8, lambda: googleTasksConnector.create_google_task(data)))
+    manager.stop_renewer()
+    on_requests = sum(1 for name in refresh_threads if name != "google-token-renewer")
+    check(failures, on_requests == 0, f"{on_requests} refreshes ran on request threads with the renewer on")
+    check(failures, refreshes(google) > 0, "the renewer did not refresh the token")
+    # The renewer refreshes at most every half lifetime, even with a margin longer than the lifetime
+    most = int(args.duration / (args.token_lifetime / 2)) + 1
+    check(failures, refreshes(google) <= most, f"the renewer made {refreshes(google)} refreshes, expected at most {most}")
+    print(f"renewer, {args.duration:.0f}s:          {refreshes(google)} refresh(es), {on_requests} on request threads, "
+          f"{len(latencies)} writes, max {max(latencies):.3f}s")
+
+    for fake in fakes.values():
+        fake.stop()
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("\nOK")
+
+
+if __name__ == "__main__":
+    main()